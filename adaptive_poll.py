@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Adaptive polling scheduler shared by the Modbus pollers.
+
+Polls fast while values are moving or while someone is watching (/sysinfo
+requests), and backs off to a slow heartbeat when the readings are flat and
+nobody is connected, e.g. at night. Saves CPU and bus energy on the
+solar-powered host.
+
+Client demand is shared between processes through the mtime of a small file
+(`POLL_DEMAND_FILE`), so `serve_with_info.py` can wake up `mppt_reader.py`.
+
+Tune with environment variables:
+
+    POLL_MIN_INTERVAL=1 POLL_MAX_INTERVAL=30 POLL_IDLE_AFTER=120 POLL_CHANGE_THRESHOLD=0.02
+"""
+import os
+import threading
+import time
+
+from env_config import env_float
+
+MIN_INTERVAL = env_float('POLL_MIN_INTERVAL', 1.0)
+MAX_INTERVAL = env_float('POLL_MAX_INTERVAL', 30.0)
+IDLE_AFTER = env_float('POLL_IDLE_AFTER', 120.0)
+CHANGE_THRESHOLD = env_float('POLL_CHANGE_THRESHOLD', 0.02)
+BACKOFF = env_float('POLL_BACKOFF', 1.5)
+DEMAND_FILE = os.environ.get('POLL_DEMAND_FILE', '/tmp/lowimpact-demand')
+
+
+class AdaptiveScheduler:
+    """Chooses the delay before the next poll from signal change and client demand."""
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 idle_after=IDLE_AFTER, change_threshold=CHANGE_THRESHOLD,
+                 backoff=BACKOFF, demand_file=DEMAND_FILE):
+        self.min_interval = max(0.05, float(min_interval))
+        self.max_interval = max(self.min_interval, float(max_interval))
+        self.idle_after = float(idle_after)
+        self.change_threshold = float(change_threshold)
+        self.backoff = max(1.0, float(backoff))
+        self.demand_file = demand_file
+        self.interval = self.min_interval
+        self._last_values = {}
+        self._last_demand = 0.0
+        self._last_touch = 0.0
+        self._wake = threading.Event()
+
+    # --- client demand ---
+    def note_demand(self, now=None):
+        """Record that a client is watching; wakes a sleeping poller."""
+        now = time.time() if now is None else now
+        was_idle = not self.has_demand(now)
+        self._last_demand = now
+        if was_idle:
+            self._wake.set()
+        # Share with other processes, but touch the file at most once a second
+        if self.demand_file and now - self._last_touch >= 1.0:
+            self._last_touch = now
+            try:
+                with open(self.demand_file, 'a'):
+                    pass
+                os.utime(self.demand_file, (now, now))
+            except Exception:
+                pass
+
+    def wake(self):
+        """Cut a current sleep short (e.g. to stop the poller promptly)."""
+        self._wake.set()
+
+    def _demand_time(self):
+        t = self._last_demand
+        if self.demand_file:
+            try:
+                t = max(t, os.stat(self.demand_file).st_mtime)
+            except Exception:
+                pass
+        return t
+
+    def has_demand(self, now=None):
+        now = time.time() if now is None else now
+        return now - self._demand_time() < self.idle_after
+
+    # --- signal change ---
+    def observe(self, values):
+        """Feed the latest readings; returns True if any field moved noticeably."""
+        changed = False
+        for key, val in (values or {}).items():
+            if key == 'timestamp' or not isinstance(val, (int, float)) or isinstance(val, bool):
+                continue
+            prev = self._last_values.get(key)
+            self._last_values[key] = val
+            if prev is None:
+                continue
+            scale = max(abs(prev), abs(val), 1.0)
+            if abs(val - prev) / scale > self.change_threshold:
+                changed = True
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return changed
+
+    def next_interval(self, now=None):
+        """Delay before the next poll: fast when watched or moving, heartbeat otherwise."""
+        if self.has_demand(now):
+            return self.min_interval
+        return self.interval
+
+    def sleep(self, stop_event=None):
+        """Sleep for next_interval(), returning early on stop or new client demand."""
+        return self.sleep_until(time.monotonic() + self.next_interval(), stop_event)
+
+    def sleep_until(self, deadline, stop_event=None):
+        """Sleep until the monotonic `deadline`; True if woken early (stop or new demand)."""
+        idle = not self.has_demand()
+        self._wake.clear()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # re-check the shared demand file every few seconds while backed off
+            step = min(remaining, max(self.min_interval, 5.0))
+            if stop_event is not None and stop_event.is_set():
+                return True
+            if self._wake.wait(step):
+                return True
+            if idle and self.has_demand():
+                return True
+
+
+class Ticker:
+    """Drift-free poll ticks on the monotonic clock.
+
+    Deadlines advance by the scheduler's interval from the previous deadline,
+    not from the end of the previous poll, so read time never accumulates as
+    drift. A poll that overruns one or more deadlines skips them (no burst of
+    catch-up polls) and reports them through on_missed(count, seconds_late).
+    """
+
+    def __init__(self, scheduler, on_missed=None):
+        self.scheduler = scheduler
+        self.on_missed = on_missed
+        self.deadline = None
+        self.missed = 0
+        self.max_late = 0.0
+
+    def wait(self, stop_event=None):
+        """Block until the next tick; returns False once stop_event is set."""
+        interval = self.scheduler.next_interval()
+        now = time.monotonic()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += interval
+        if self.deadline <= now:
+            late = now - self.deadline
+            skipped = int(late // interval) + 1
+            self.deadline += skipped * interval
+            self.missed += skipped
+            self.max_late = max(self.max_late, late)
+            if self.on_missed is not None:
+                self.on_missed(skipped, late)
+        if self.scheduler.sleep_until(self.deadline, stop_event):
+            # woken early (a client started watching): re-anchor on this tick
+            self.deadline = time.monotonic()
+        return stop_event is None or not stop_event.is_set()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Environment-variable parsing shared by the server modules.
+
+A missing or malformed variable falls back to the default, so a typo in a
+unit file degrades to the built-in setting instead of a crash at import:
+
+    PORT = env_int('PORT', 8000)
+    TTL = env_float('WEATHER_TTL', 1800.0)
+    WIDTHS = env_ints('IMAGE_WIDTHS', (320, 480))   # "320,480"
+"""
+import os
+
+
+def env_int(name, default=None):
+    try:
+        return int(os.environ.get(name)) if os.environ.get(name) is not None else default
+    except Exception:
+        return default
+
+
+def env_float(name, default=None):
+    try:
+        return float(os.environ.get(name)) if os.environ.get(name) is not None else default
+    except Exception:
+        return default
+
+
+def env_ints(name, default=()):
+    """Comma-separated integers as a tuple."""
+    try:
+        return tuple(int(v) for v in os.environ.get(name).split(',') if v.strip()) \
+            if os.environ.get(name) is not None else tuple(default)
+    except Exception:
+        return tuple(default)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Resized and re-encoded image derivatives, negotiated per request.
+
+The photos in assets/ are sent to every device at full size as JPEG. With
+Pillow installed the server instead answers /assets/<name>.jpg with the best
+variant for the client:
+
+- width: the smallest of IMAGE_WIDTHS that covers the hint (?w=, or the
+  Sec-CH-Width / Width client hint), never wider than the source
+- format: AVIF or WebP when the Accept header lists them (and this Pillow can
+  encode them), JPEG otherwise
+- quality tier: 'normal' by default, 'low' with Save-Data: on or in
+  low-power mode, or explicitly with ?q=high|normal|low
+
+Derivatives are built the first time they are asked for and stored in
+IMAGE_CACHE_DIR under a name that includes the source's size and mtime, so
+editing a source simply makes new ones. The directory is kept below
+IMAGE_CACHE_MAX_BYTES by deleting the least recently served files. If a
+variant comes out larger than its source, the source is served instead.
+
+    variants = ImageVariants()
+    path, ctype = variants.negotiate('assets/Color.jpg', accept, width=480)
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+
+from env_config import env_int, env_ints
+from state_store import write_atomic
+
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None
+
+try:
+    import pillow_avif  # noqa: F401  (registers the AVIF encoder on older Pillow)
+except Exception:
+    pass
+
+CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', '/var/tmp/lowimpact-images')
+CACHE_MAX_BYTES = env_int('IMAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+WIDTHS = tuple(sorted(env_ints('IMAGE_WIDTHS', (320, 480, 640, 960))))
+
+SOURCE_EXTS = ('.jpg', '.jpeg', '.png')
+
+# format -> (Pillow name, MIME type, extension, quality per tier)
+FORMATS = {
+    'avif': ('AVIF', 'image/avif', '.avif', {'high': 70, 'normal': 50, 'low': 35}),
+    'webp': ('WEBP', 'image/webp', '.webp', {'high': 85, 'normal': 72, 'low': 50}),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg', {'high': 85, 'normal': 75, 'low': 55}),
+}
+TIERS = ('high', 'normal', 'low')
+
+
+def encoders():
+    """Formats this Pillow can write, best first."""
+    if Image is None:
+        return []
+    try:
+        Image.init()
+    except Exception:
+        pass
+    return [fmt for fmt in ('avif', 'webp', 'jpeg') if FORMATS[fmt][0] in Image.SAVE]
+
+
+class ImageVariants:
+    """Builds, caches and picks image derivatives."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, widths=WIDTHS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.widths = tuple(widths)
+        self.formats = encoders()
+        self.stats = {'built': 0, 'served': 0, 'original': 0, 'evicted': 0}
+        self._sources = {}      # source path -> ((size, mtime), (width, tag))
+        self._index = {}        # derivative path -> [size, last served (monotonic)]
+        self._index_bytes = 0
+        self._build_lock = threading.Lock()   # one encode at a time on the Pi
+        self._lock = threading.Lock()
+        self._scan()
+
+    def enabled(self):
+        return bool(self.formats)
+
+    def pick_format(self, accept):
+        accept = (accept or '').lower()
+        for fmt in self.formats:
+            if fmt == 'jpeg' or FORMATS[fmt][1] in accept:
+                return fmt
+        return None
+
+    def pick_width(self, hint, source_width):
+        """Smallest configured width covering `hint`, capped at the source width."""
+        if not hint:
+            return source_width
+        for width in self.widths:
+            if width >= hint:
+                return min(width, source_width)
+        return source_width
+
+    def negotiate(self, source, accept, width=None, tier='normal'):
+        """(path, content type) of the file to send for `source`, or None for the original."""
+        fmt = self.pick_format(accept)
+        if fmt is None:
+            return None
+        try:
+            st = os.stat(source)
+        except OSError:
+            return None
+        tier = tier if tier in TIERS else 'normal'
+        probe = self._probe(source, st)
+        if probe is None:
+            return None
+        source_width, tag = probe
+        target = self.pick_width(width, source_width)
+        stem = os.path.splitext(os.path.basename(source))[0]
+        path = os.path.join(self.cache_dir, '%s-%s-%d-%s%s' % (stem, tag, target, tier, FORMATS[fmt][2]))
+        entry = self._index.get(path)
+        if entry is None:
+            with self._build_lock:
+                entry = self._index.get(path)
+                if entry is None:
+                    try:
+                        self._build(source, path, fmt, target, tier)
+                    except Exception:
+                        return None
+                    entry = self._index.get(path)
+        with self._lock:
+            if entry is None:
+                return None
+            entry[1] = time.monotonic()
+            if entry[0] >= st.st_size:
+                self.stats['original'] += 1
+                return None
+            self.stats['served'] += 1
+        return path, FORMATS[fmt][1]
+
+    def _probe(self, source, st):
+        """(width, version tag) of a source, re-read only when it changes."""
+        key = os.path.abspath(source)
+        version = (st.st_size, st.st_mtime_ns)
+        cached = self._sources.get(key)
+        if cached is None or cached[0] != version:
+            try:
+                with Image.open(source) as img:
+                    width = ImageOps.exif_transpose(img).size[0]
+            except Exception:
+                return None
+            tag = hashlib.sha1(('%s:%d:%d' % ((key,) + version)).encode()).hexdigest()[:12]
+            cached = self._sources[key] = (version, (width, tag))
+        return cached[1]
+
+    def _build(self, source, path, fmt, width, tier):
+        name, _mime, _ext, quality = FORMATS[fmt]
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.size[0] > width:
+                img = img.resize((width, max(1, round(img.size[1] * width / img.size[0]))), Image.LANCZOS)
+            if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            elif img.mode not in ('RGB', 'RGBA', 'L'):
+                img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+            out = io.BytesIO()
+            options = {'quality': quality[tier]}
+            if fmt == 'jpeg':
+                options.update(optimize=True, progressive=True)
+            elif fmt == 'webp':
+                options['method'] = 4
+            img.save(out, name, **options)
+        data = out.getvalue()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(path, data)
+        with self._lock:
+            self._index[path] = [len(data), time.monotonic()]
+            self._index_bytes += len(data)
+            self.stats['built'] += 1
+        self._evict()
+
+    # --- size-bounded disk cache ---
+    def _scan(self):
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        now = time.monotonic()
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.startswith('.'):
+                continue
+            # older files first out: map mtime onto the monotonic clock
+            self._index[path] = [st.st_size, now - (time.time() - st.st_mtime)]
+            self._index_bytes += st.st_size
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            if self._index_bytes <= self.max_bytes:
+                return
+            victims = sorted(self._index.items(), key=lambda item: item[1][1])
+            for path, (size, _used) in victims:
+                if self._index_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                del self._index[path]
+                self._index_bytes -= size
+                self.stats['evicted'] += 1
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Live telemetry fan-out over WebSocket (RFC 6455) for kiosks and home hubs.
+
+Each new sample is encoded once into a small binary frame and queued for
+every subscriber of its topic; one background thread writes all subscriber
+sockets without blocking, so a slow client never delays the sampler or the
+other clients.
+
+On connect the server sends a JSON text frame describing the layout:
+
+    {"type": "schema", "header": "<BxHd", "value": "f",
+     "topics": {"system": {"id": 1, "fields": ["cpu_percent", ...]},
+                "mppt":   {"id": 2, "fields": ["panel_voltage", ...]}},
+     "subscribed": ["system", "mppt"]}
+
+and then one binary frame per sample, little-endian:
+
+    topic id u8 | pad | seq u16 | timestamp f64 | one float32 per field (NaN = missing)
+
+`seq` counts samples per topic, so a gap tells the client frames were dropped.
+Clients pick topics with /live?topics=mppt or later by sending
+{"subscribe": ["system"]} as a text frame.
+
+Backpressure: each subscriber has a queue of LIVE_QUEUE frames; when it is
+full the oldest sample is dropped (live data only needs the latest values).
+A client that has not accepted a byte for LIVE_STALL_TIMEOUT seconds is
+disconnected.
+"""
+import base64
+import collections
+import hashlib
+import json
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from env_config import env_float
+
+QUEUE_FRAMES = int(env_float('LIVE_QUEUE', 16))           # queued samples per subscriber
+STALL_TIMEOUT = env_float('LIVE_STALL_TIMEOUT', 10.0)     # seconds without send progress
+PING_INTERVAL = env_float('LIVE_PING_INTERVAL', 25.0)     # keeps proxies from idling us out
+MAX_SUBSCRIBERS = int(env_float('LIVE_MAX_SUBSCRIBERS', 32))
+MAX_CLIENT_FRAME = 4096
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+HEADER = struct.Struct('<BxHd')
+
+OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def accept_key(key):
+    """Sec-WebSocket-Accept value for a client's Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1(key.strip().encode('ascii') + GUID).digest()).decode('ascii')
+
+
+def encode_frame(opcode, payload=b''):
+    """One unmasked, unfragmented server frame."""
+    n = len(payload)
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return head + payload
+
+
+def _decode_frame(buf):
+    """(opcode, payload, consumed) for the first complete client frame, or None."""
+    if len(buf) < 2:
+        return None
+    opcode = buf[0] & 0x0F
+    masked = buf[1] & 0x80
+    n = buf[1] & 0x7F
+    pos = 2
+    if n == 126:
+        if len(buf) < 4:
+            return None
+        n = struct.unpack_from('!H', buf, 2)[0]
+        pos = 4
+    elif n == 127:
+        if len(buf) < 10:
+            return None
+        n = struct.unpack_from('!Q', buf, 2)[0]
+        pos = 10
+    if not masked or n > MAX_CLIENT_FRAME:
+        raise ValueError('bad client frame')
+    if len(buf) < pos + 4 + n:
+        return None
+    mask = buf[pos:pos + 4]
+    pos += 4
+    data = bytes(b ^ mask[i & 3] for i, b in enumerate(buf[pos:pos + n]))
+    return opcode, data, pos + n
+
+
+class _Topic:
+    """Fixed field list plus the precompiled struct for one topic."""
+
+    def __init__(self, name, ident, fields):
+        self.name = name
+        self.id = ident
+        self.fields = tuple(fields)
+        self.struct = struct.Struct(HEADER.format + 'f' * len(self.fields))
+        self.seq = 0
+
+    def encode(self, values, ts):
+        nan = float('nan')
+        row = []
+        for name in self.fields:
+            v = values.get(name)
+            row.append(float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else nan)
+        self.seq = (self.seq + 1) & 0xFFFF
+        return encode_frame(OP_BINARY, self.struct.pack(self.id, self.seq, ts, *row))
+
+
+class _Subscriber:
+    def __init__(self, sock, addr, topics):
+        self.sock = sock
+        self.addr = addr
+        self.topics = set(topics)
+        self.frames = collections.deque()   # data frames (droppable)
+        self.control = collections.deque()  # schema / pong / close (never dropped)
+        self.out = b''
+        self.inbuf = bytearray()
+        self.dropped = 0
+        self.last_progress = time.monotonic()
+        self.last_ping = time.monotonic()
+        self.closing = False
+        self.events = 0
+
+    def pending(self):
+        return bool(self.out or self.control or self.frames)
+
+
+class LiveHub:
+    """Registry of WebSocket subscribers plus the thread that writes to them."""
+
+    def __init__(self, topics, queue_frames=QUEUE_FRAMES, max_subscribers=MAX_SUBSCRIBERS):
+        self.topics = {name: _Topic(name, i + 1, fields) for i, (name, fields) in enumerate(topics.items())}
+        self.queue_frames = max(1, queue_frames)
+        self.max_subscribers = max_subscribers
+        self.stats = {'published': 0, 'sent': 0, 'dropped': 0, 'disconnected': 0}
+        self._subs = []
+        self._lock = threading.Lock()
+        self._sel = None
+        self._wake_r = self._wake_w = None
+        self._thread = None
+        self._closed = False
+
+    # --- called from server threads ---
+    def subscribers(self):
+        return len(self._subs)
+
+    def full(self):
+        return len(self._subs) >= self.max_subscribers
+
+    def schema(self, subscribed=None):
+        return {
+            'type': 'schema',
+            'header': HEADER.format,
+            'value': 'f',
+            'topics': {t.name: {'id': t.id, 'fields': list(t.fields)} for t in self.topics.values()},
+            'subscribed': sorted(subscribed if subscribed is not None else self.topics),
+        }
+
+    def parse_topics(self, names):
+        """Validate a topic list ('' or None = all topics)."""
+        names = [n for n in (names or []) if n]
+        unknown = [n for n in names if n not in self.topics]
+        if unknown:
+            raise ValueError('unknown topic %s (available: %s)' % (', '.join(unknown), ', '.join(self.topics)))
+        return names or list(self.topics)
+
+    def add(self, sock, addr, topics):
+        """Take ownership of an upgraded socket; False if the hub is full."""
+        sub = _Subscriber(sock, addr, topics)
+        sub.control.append(encode_frame(OP_TEXT, json.dumps(self.schema(sub.topics)).encode('utf-8')))
+        with self._lock:
+            if self._closed or len(self._subs) >= self.max_subscribers:
+                return False
+            sock.setblocking(False)
+            self._subs.append(sub)
+            self._ensure_thread()
+        self._wake()
+        return True
+
+    def publish(self, topic, values, ts=None):
+        """Encode one sample once and queue it for every subscriber of `topic`."""
+        if not self._subs:
+            return
+        t = self.topics.get(topic)
+        if t is None:
+            return
+        with self._lock:
+            frame = t.encode(values, time.time() if ts is None else float(ts))
+            self.stats['published'] += 1
+            for sub in self._subs:
+                if topic not in sub.topics or sub.closing:
+                    continue
+                if len(sub.frames) >= self.queue_frames:
+                    sub.frames.popleft()
+                    sub.dropped += 1
+                    self.stats['dropped'] += 1
+                sub.frames.append(frame)
+        self._wake()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._wake()
+
+    # --- writer thread ---
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._run, name='live-feed', daemon=True)
+        self._thread.start()
+
+    def _wake(self):
+        try:
+            if self._wake_w is not None:
+                self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # a wake-up is already pending
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    subs, self._subs = self._subs, []
+                    break
+                subs = list(self._subs)
+                for sub in subs:
+                    want = selectors.EVENT_READ | (selectors.EVENT_WRITE if sub.pending() else 0)
+                    if want != sub.events:
+                        try:
+                            if sub.events:
+                                self._sel.modify(sub.sock, want, sub)
+                            else:
+                                self._sel.register(sub.sock, want, sub)
+                            sub.events = want
+                        except Exception:
+                            sub.closing = True
+            try:
+                ready = self._sel.select(timeout=1.0)
+            except Exception:
+                ready = []
+            for key, mask in ready:
+                sub = key.data
+                if sub is None:
+                    try:
+                        while self._wake_r.recv(512):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ:
+                    self._on_read(sub)
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(sub)
+            self._housekeeping(subs)
+        for sub in subs:
+            self._drop(sub)
+        with self._lock:
+            wake_r, wake_w, self._wake_r, self._wake_w = self._wake_r, self._wake_w, None, None
+        for s in (self._sel, wake_r, wake_w):
+            try:
+                s.close()
+            except Exception:
+                pass
+
+    def _on_read(self, sub):
+        try:
+            data = sub.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(sub)
+            return
+        sub.inbuf += data
+        try:
+            while True:
+                frame = _decode_frame(sub.inbuf)
+                if frame is None:
+                    break
+                opcode, payload, used = frame
+                del sub.inbuf[:used]
+                if opcode == OP_CLOSE:
+                    sub.control.append(encode_frame(OP_CLOSE, payload[:2]))
+                    sub.closing = True
+                elif opcode == OP_PING:
+                    sub.control.append(encode_frame(OP_PONG, payload))
+                elif opcode == OP_TEXT:
+                    self._on_message(sub, payload)
+        except ValueError:
+            sub.control.append(encode_frame(OP_CLOSE, struct.pack('!H', 1002)))
+            sub.closing = True
+        if len(sub.inbuf) > MAX_CLIENT_FRAME * 2:
+            self._drop(sub)
+
+    def _on_message(self, sub, payload):
+        """Text frames: {"subscribe": [topic, ...]} changes the topic filter."""
+        try:
+            msg = json.loads(payload.decode('utf-8'))
+            topics = self.parse_topics(msg.get('subscribe'))
+        except Exception as e:
+            reply = {'type': 'error', 'error': str(e)}
+        else:
+            with self._lock:
+                sub.topics = set(topics)
+                # frames queued for topics the client just left are stale
+                sub.frames.clear()
+            reply = self.schema(sub.topics)
+        sub.control.append(encode_frame(OP_TEXT, json.dumps(reply).encode('utf-8')))
+
+    def _flush(self, sub):
+        while True:
+            if not sub.out:
+                with self._lock:
+                    if sub.control:
+                        sub.out = sub.control.popleft()
+                    elif sub.frames and not sub.closing:
+                        sub.out = sub.frames.popleft()
+                        self.stats['sent'] += 1
+                    else:
+                        break
+            try:
+                n = sub.sock.send(sub.out)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self._drop(sub)
+                return
+            sub.out = sub.out[n:]
+            sub.last_progress = time.monotonic()
+            if sub.out:
+                return
+        if sub.closing:
+            self._drop(sub)
+
+    def _housekeeping(self, subs):
+        now = time.monotonic()
+        for sub in subs:
+            if sub.closing and not sub.pending():
+                self._drop(sub)
+            elif sub.pending() and now - sub.last_progress > STALL_TIMEOUT:
+                # the client stopped reading; free its buffers
+                self._drop(sub)
+            elif PING_INTERVAL and now - sub.last_ping > PING_INTERVAL:
+                sub.last_ping = now
+                sub.control.append(encode_frame(OP_PING))
+                self._wake()
+
+    def _drop(self, sub):
+        with self._lock:
+            if sub not in self._subs and not self._closed:
+                return
+            if sub in self._subs:
+                self._subs.remove(sub)
+            self.stats['disconnected'] += 1
+        try:
+            if sub.events:
+                self._sel.unregister(sub.sock)
+        except Exception:
+            pass
+        try:
+            sub.sock.close()
+        except Exception:
+            pass
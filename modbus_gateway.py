@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Local Modbus gateway / cache daemon.
+
+Owns the RS485 serial port and serves cached register values to any number of
+local clients over a Unix socket, so `serve_with_info.py`, `rs485_server.py`
+and `mppt_reader.py` no longer fight over `/dev/ttyACM0`.
+
+Run on the Pi (same settings as the other entry points):
+
+    SERIAL_PORT=/dev/ttyACM0 BAUDRATE=115200 python3 modbus_gateway.py
+
+Protocol: one JSON object per line in each direction, e.g.
+
+    -> {"op": "read", "addr": 12546, "count": 1, "ttl": 1.0}
+    <- {"ok": true, "registers": [1234], "age": 0.12}
+
+Every register has its own TTL (`MODBUS_GATEWAY_TTL` default, per-register
+overrides in `MODBUS_GATEWAY_TTLS="12550=30,12556=10"`, or per request).
+Missing/expired registers are merged into contiguous block reads and
+concurrent requests for the same registers share a single bus transaction.
+"""
+import grp
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from env_config import env_float
+
+try:
+    from pymodbus.client.sync import ModbusSerialClient as ModbusClient
+except Exception:
+    ModbusClient = None
+
+try:
+    import minimalmodbus
+    import serial
+except Exception:
+    minimalmodbus = None
+    serial = None
+
+# --------------------- Configuration ---------------------
+SERIAL_PORT = os.environ.get('SERIAL_PORT', '/dev/ttyACM0')
+BAUDRATE = int(os.environ.get('BAUDRATE', '115200'))
+MODBUS_UNIT = int(os.environ.get('MODBUS_UNIT', '1'))
+SOCKET_PATH = os.environ.get('MODBUS_GATEWAY_SOCKET', '/run/lowimpact/modbus.sock')
+SOCKET_GROUP = os.environ.get('MODBUS_GATEWAY_GROUP')   # group allowed to connect (default: ours)
+
+def _parse_ttls(spec):
+    """Parse "addr=seconds,addr=seconds" into a dict."""
+    ttls = {}
+    for part in (spec or '').split(','):
+        try:
+            addr, ttl = part.split('=', 1)
+            ttls[int(addr.strip())] = float(ttl.strip())
+        except Exception:
+            continue
+    return ttls
+
+DEFAULT_TTL = env_float('MODBUS_GATEWAY_TTL', 1.0)
+REGISTER_TTLS = _parse_ttls(os.environ.get('MODBUS_GATEWAY_TTLS'))
+# Registers closer than this are fetched in one block read (gap is discarded)
+MERGE_GAP = int(env_float('MODBUS_GATEWAY_MERGE_GAP', 4))
+MAX_BLOCK = 120  # stay under the 125-register Modbus limit
+MAX_COUNT = 125  # registers one request may ask for (one Modbus read)
+CLIENT_TIMEOUT = env_float('MODBUS_GATEWAY_CLIENT_TIMEOUT', 3.0)
+
+
+# --------------------- Bus access ---------------------
+class _Bus:
+    """Serialised access to the physical RS485 link (pymodbus or minimalmodbus)."""
+
+    def __init__(self):
+        self._client = None
+        self._instrument = None
+
+    def _connect(self):
+        if ModbusClient is not None:
+            try:
+                client = ModbusClient(method='rtu', port=SERIAL_PORT, baudrate=BAUDRATE, timeout=1)
+                if client.connect():
+                    self._client = client
+                    return True
+            except Exception:
+                pass
+        if minimalmodbus is not None:
+            try:
+                inst = minimalmodbus.Instrument(SERIAL_PORT, MODBUS_UNIT)
+                inst.serial.baudrate = BAUDRATE
+                inst.serial.bytesize = 8
+                inst.serial.parity = serial.PARITY_NONE
+                inst.serial.stopbits = 1
+                inst.serial.timeout = 1
+                inst.mode = minimalmodbus.MODE_RTU
+                self._instrument = inst
+                return True
+            except Exception:
+                pass
+        return False
+
+    def close(self):
+        try:
+            if self._client:
+                self._client.close()
+        except Exception:
+            pass
+        try:
+            if self._instrument:
+                self._instrument.serial.close()
+        except Exception:
+            pass
+        self._client = None
+        self._instrument = None
+
+    def read_block(self, addr, count):
+        """Read `count` raw 16-bit registers starting at `addr` (or None)."""
+        try:
+            if self._client is None and self._instrument is None:
+                if not self._connect():
+                    return None
+            if self._client is not None:
+                # Try input registers first, then holding registers
+                rr = self._client.read_input_registers(address=addr, count=count, unit=MODBUS_UNIT)
+                if getattr(rr, 'isError', lambda: True)():
+                    rr = self._client.read_holding_registers(address=addr, count=count, unit=MODBUS_UNIT)
+                    if getattr(rr, 'isError', lambda: True)():
+                        return None
+                if not hasattr(rr, 'registers') or len(rr.registers) < count:
+                    return None
+                return [int(r) for r in rr.registers[:count]]
+            try:
+                regs = self._instrument.read_registers(addr, count, functioncode=4)
+            except Exception:
+                regs = self._instrument.read_registers(addr, count, functioncode=3)
+            return [int(r) for r in regs]
+        except Exception:
+            self.close()
+            return None
+
+
+# --------------------- Register cache ---------------------
+class RegisterCache:
+    """Per-register TTL cache in front of a bus reader with merged block reads."""
+
+    def __init__(self, read_block, default_ttl=DEFAULT_TTL, ttls=None):
+        self._read_block = read_block
+        self._default_ttl = default_ttl
+        self._ttls = dict(ttls or {})
+        self._values = {}  # addr -> (raw, monotonic timestamp)
+        self._lock = threading.Lock()      # protects _values and stats
+        self._bus_lock = threading.Lock()  # one transaction on the wire at a time
+        self.stats = {'hits': 0, 'misses': 0, 'bus_reads': 0, 'bus_errors': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def snapshot_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _ttl(self, addr, ttl):
+        if ttl is not None:
+            return ttl
+        return self._ttls.get(addr, self._default_ttl)
+
+    def _stale(self, addrs, ttl, now):
+        with self._lock:
+            return [a for a in addrs
+                    if a not in self._values or now - self._values[a][1] > self._ttl(a, ttl)]
+
+    @staticmethod
+    def _blocks(addrs):
+        """Group sorted addresses into (start, count) reads, bridging small gaps."""
+        blocks = []
+        for a in sorted(set(addrs)):
+            if blocks:
+                start, count = blocks[-1]
+                end = start + count
+                if a - end <= MERGE_GAP and a - start + 1 <= MAX_BLOCK:
+                    blocks[-1] = (start, a - start + 1)
+                    continue
+            blocks.append((a, 1))
+        return blocks
+
+    def read(self, addr, count=1, ttl=None):
+        """Return (registers, age_seconds) for a register range, or (None, None).
+
+        Raises ValueError for a range one Modbus read could not cover.
+        """
+        addr, count = int(addr), int(count)
+        if not 1 <= count <= MAX_COUNT:
+            raise ValueError('count must be 1..%d' % MAX_COUNT)
+        if not 0 <= addr <= 0xFFFF - count + 1:
+            raise ValueError('addr out of range')
+        addrs = list(range(addr, addr + count))
+        now = time.monotonic()
+        if self._stale(addrs, ttl, now):
+            with self._bus_lock:
+                # Re-check after waiting: a concurrent request may have
+                # fetched the same registers while we were queued.
+                missing = self._stale(addrs, ttl, time.monotonic())
+                if missing:
+                    self._count('misses')
+                    for start, n in self._blocks(missing):
+                        regs = self._read_block(start, n)
+                        self._count('bus_reads')
+                        if regs is None and n > 1:
+                            # A bridged gap may contain unmapped registers; fall back to singles
+                            regs = []
+                            for a in range(start, start + n):
+                                if a not in missing:
+                                    regs.append(None)
+                                    continue
+                                one = self._read_block(a, 1)
+                                self._count('bus_reads')
+                                regs.append(one[0] if one else None)
+                        if regs is None:
+                            self._count('bus_errors')
+                            continue
+                        stamp = time.monotonic()
+                        with self._lock:
+                            for i, raw in enumerate(regs):
+                                if raw is not None:
+                                    self._values[start + i] = (raw, stamp)
+                else:
+                    self._count('hits')
+        else:
+            self._count('hits')
+        now = time.monotonic()
+        with self._lock:
+            if not all(a in self._values for a in addrs):
+                return None, None
+            regs = [self._values[a][0] for a in addrs]
+            age = max(now - self._values[a][1] for a in addrs)
+        return regs, age
+
+
+# --------------------- Unix socket server ---------------------
+class _GatewayHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        cache = self.server.cache
+        for line in self.rfile:
+            try:
+                req = json.loads(line.decode('utf-8'))
+                op = req.get('op', 'read')
+                if op == 'read':
+                    regs, age = cache.read(int(req['addr']), int(req.get('count', 1)), req.get('ttl'))
+                    if regs is None:
+                        resp = {'ok': False, 'error': 'read failed'}
+                    else:
+                        resp = {'ok': True, 'registers': regs, 'age': round(age, 3)}
+                elif op == 'stats':
+                    resp = {'ok': True, 'stats': cache.snapshot_stats()}
+                else:
+                    resp = {'ok': False, 'error': 'unknown op'}
+            except Exception as e:
+                resp = {'ok': False, 'error': str(e)}
+            try:
+                self.wfile.write((json.dumps(resp) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            except Exception:
+                return
+
+
+class GatewayServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, cache):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self.cache = cache
+        super().__init__(path, _GatewayHandler)
+        # owner and group only: anyone who can connect can drive the bus
+        try:
+            if SOCKET_GROUP:
+                os.chown(path, -1, grp.getgrnam(SOCKET_GROUP).gr_gid)
+            os.chmod(path, 0o660)
+        except Exception as e:
+            sys.stderr.write('Could not set permissions on %s: %s\n' % (path, e))
+
+
+# --------------------- Client helper ---------------------
+class GatewayClient:
+    """Persistent client used by the other entry points; thread-safe."""
+
+    def __init__(self, path=SOCKET_PATH, timeout=CLIENT_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        """True if the gateway accepts connections (a stale socket file does not count)."""
+        with self._lock:
+            if self._sock is not None:
+                return True
+            try:
+                self._connect()
+                return True
+            except OSError:
+                self._close()
+                return False
+
+    def _connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock = s
+        s.settimeout(self.timeout)
+        s.connect(self.path)
+        self._file = s.makefile('rb')
+
+    def _close(self):
+        # the makefile() reader holds a reference that keeps the fd open
+        try:
+            if self._file:
+                self._file.close()
+        except Exception:
+            pass
+        try:
+            if self._sock:
+                self._sock.close()
+        except Exception:
+            pass
+        self._sock = None
+        self._file = None
+
+    def _call(self, req):
+        with self._lock:
+            for _ in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall((json.dumps(req) + '\n').encode('utf-8'))
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError('gateway closed connection')
+                    return json.loads(line.decode('utf-8'))
+                except Exception:
+                    # reconnect once (gateway may have restarted)
+                    self._close()
+            return None
+
+    def read_registers(self, addr, count=1, ttl=None):
+        """Return a list of raw 16-bit registers or None."""
+        req = {'op': 'read', 'addr': int(addr), 'count': int(count)}
+        if ttl is not None:
+            req['ttl'] = float(ttl)
+        resp = self._call(req)
+        if not resp or not resp.get('ok'):
+            return None
+        return resp.get('registers')
+
+    def read_register_scaled(self, addr, scale, ttl=None, signed=True):
+        """Read one register and apply the same two's-complement/scale decode as the servers."""
+        if addr is None:
+            return None
+        regs = self.read_registers(addr, 1, ttl)
+        if not regs:
+            return None
+        raw = regs[0]
+        if signed and raw >= 0x8000:
+            raw = raw - 0x10000
+        val = float(raw)
+        if scale not in (None, 0):
+            val = val / float(scale)
+        return val
+
+    def stats(self):
+        resp = self._call({'op': 'stats'})
+        return resp.get('stats') if resp and resp.get('ok') else None
+
+
+_default_client = None
+
+def get_client():
+    """Return a shared GatewayClient if the gateway is accepting connections, else None.
+
+    The socket file alone is not enough: one left behind by a gateway that
+    died refuses connections, and callers must fall back to the serial port.
+    """
+    global _default_client
+    if not os.path.exists(SOCKET_PATH):
+        return None
+    if _default_client is None:
+        _default_client = GatewayClient(SOCKET_PATH)
+    return _default_client if _default_client.available() else None
+
+
+# --------------------- Main ---------------------
+def main():
+    if ModbusClient is None and minimalmodbus is None:
+        sys.stderr.write('Error: neither pymodbus nor minimalmodbus is installed\n')
+        return 1
+    bus = _Bus()
+    cache = RegisterCache(bus.read_block, DEFAULT_TTL, REGISTER_TTLS)
+    server = GatewayServer(SOCKET_PATH, cache)
+    print(f"Modbus gateway on {SERIAL_PORT} @ {BAUDRATE} serving {SOCKET_PATH} (ttl {DEFAULT_TTL}s)")
+
+    # systemd stop: unwind like Ctrl-C so the socket file is removed
+    def _terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nShutting down gateway')
+    finally:
+        server.server_close()
+        bus.close()
+        try:
+            os.unlink(SOCKET_PATH)
+        except Exception:
+            pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,102 +2,477 @@
 """
 Read MPPT data via minimalmodbus and write to JSON file for serve_with_info.py to use.
 Runs in background and updates /tmp/mppt_data.json every second.
+
+The JSON file is replaced atomically and only when values change (see
+state_store.py); energy counters and last-known-good values are
+checkpointed to MPPT_STATE_FILE and restored on restart.
+
+Also usable as a library, e.g. inside serve_with_info.py (MPPT_IN_PROCESS=1)
+so no separate process or file hand-off is needed:
+
+    poller = MpptPoller(sinks=[CallbackSink(handle_sample)])
+    poller.start()          # background thread, drift-free 1 s ticks
+    ...
+    poller.stop()
+
+Polls run on a monotonic, drift-free tick (adaptive_poll.Ticker); a poll that
+overruns its deadline is reported as missed instead of shifting later ones.
+Each sample goes to every sink: FileSink (the JSON file), SharedMemorySink
+(fixed binary layout in /dev/shm), HttpPushSink (POST to a URL) or
+CallbackSink (any function).
 """
 import json
-import time
-import sys
 import os
-from pathlib import Path
+import signal
+import struct
+import sys
+import threading
+import time
+import urllib.request
+
+from adaptive_poll import AdaptiveScheduler, Ticker
+from env_config import env_float
+import register_map
+from sample_log import SampleLog
+from state_store import Checkpoint, EnergyCounter, OutputWriter
+
+try:
+    import modbus_gateway
+except Exception:
+    modbus_gateway = None
 
 try:
     import minimalmodbus
     import serial
 except ImportError:
-    print("Error: minimalmodbus or serial not installed")
-    sys.exit(1)
+    minimalmodbus = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 
 # MPPT Configuration
 PORT = '/dev/ttyACM0'
 SLAVE_ID = 1
 BAUDRATE = 115200
 OUTPUT_FILE = '/tmp/mppt_data.json'
+# Fields missing from one poll are filled from the last good reading this young
+LAST_GOOD_MAX_AGE = env_float('MPPT_LAST_GOOD_MAX_AGE', 60.0)
+# Optional extra outputs for the standalone reader
+SHM_NAME = os.environ.get('MPPT_SHM_NAME', '')      # e.g. lowimpact-mppt
+PUSH_URL = os.environ.get('MPPT_PUSH_URL', '')      # e.g. http://hub.local/api/mppt
 
-# MPPT Register addresses
-PANEL_V_REG = 12546      # Panel voltage (scale 100)
-PANEL_A_REG = 12553      # Panel current (scale 100)
-BATTERY_V_REG = 12544    # Battery voltage (scale 100)
-BATTERY_SOC_REG = 12550  # Battery SOC % (scale 10)
-BATTERY_TEMP_REG = 12556 # Battery temperature (scale 100)
-LOAD_V_REG = 12548       # Load voltage (scale 100)
-LOAD_A_REG = 12549       # Load current (scale 100)
+# Register map field -> key in OUTPUT_FILE
+OUTPUT_KEYS = {
+    'panel_v': 'panel_voltage',
+    'panel_a': 'panel_current',
+    'battery_v': 'battery_voltage',
+    'battery_soc': 'battery_soc',
+    'battery_temp': 'battery_temperature',
+    'load_v': 'load_voltage',
+    'load_a': 'load_current',
+}
+# Every numeric field of a sample, in a fixed order (shared memory layout)
+SAMPLE_FIELDS = ('panel_voltage', 'panel_current', 'panel_power', 'battery_voltage',
+                 'battery_soc', 'battery_temperature', 'load_voltage', 'load_current',
+                 'load_power', 'panel_energy_wh', 'load_energy_wh')
 
-# Try to connect to MPPT
-try:
-    instrument = minimalmodbus.Instrument(PORT, SLAVE_ID)
-    instrument.serial.baudrate = BAUDRATE
+
+def open_instrument(port=PORT, slave_id=SLAVE_ID, baudrate=BAUDRATE):
+    """Open the MPPT directly over RS485 (raises if unavailable)."""
+    if minimalmodbus is None:
+        raise RuntimeError('minimalmodbus or serial not installed')
+    instrument = minimalmodbus.Instrument(port, slave_id)
+    instrument.serial.baudrate = baudrate
     instrument.serial.bytesize = 8
     instrument.serial.parity = serial.PARITY_NONE
     instrument.serial.stopbits = 1
     instrument.serial.timeout = 1
     instrument.mode = minimalmodbus.MODE_RTU
-    print(f"Connected to MPPT on {PORT}")
-except Exception as e:
-    print(f"Error: Could not open {PORT}: {e}")
-    sys.exit(1)
-
-def read_register(register, number_of_decimals=2, retries=2):
-    """Read a register from MPPT with error handling and retries."""
-    for attempt in range(retries):
+    return instrument
+
+
+def make_block_reader(gateway=None, instrument=None, retries=2):
+    """read_block(start, count) through the gateway or a minimalmodbus instrument."""
+    def read_block(start, count):
+        """Read `count` raw registers from MPPT with error handling and retries."""
+        for attempt in range(retries):
+            try:
+                if gateway is not None:
+                    regs = gateway.read_registers(start, count)
+                    if regs is None:
+                        raise IOError("gateway read failed")
+                    return regs
+                return instrument.read_registers(start, count, functioncode=4)
+            except Exception as e:
+                if attempt == retries - 1:
+                    print(f"Error reading registers {start}+{count} after {retries} attempts: {e}")
+                    return None
+                time.sleep(0.1)  # Brief pause before retry
+        return None
+    return read_block
+
+
+# --------------------- sinks ---------------------
+class FileSink:
+    """The JSON snapshot file read by serve_with_info.py (atomic, change-aware)."""
+
+    def __init__(self, path=OUTPUT_FILE):
+        self.path = path
+        self.writer = OutputWriter(path)
+
+    def restore(self, data):
+        # after a reboot /tmp is empty: serve the last snapshot until the first poll
+        if not os.path.exists(self.path):
+            self.writer.update(data)
+
+    def write(self, data):
+        self.writer.update(data)
+
+    def close(self):
+        self.writer.flush()
+
+
+class CallbackSink:
+    """Hands every sample to a function (in-process consumers)."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def write(self, data):
+        self.fn(data)
+
+
+# after the u32 sequence: timestamp + one f64 per SAMPLE_FIELDS
+_SHM_BODY = struct.Struct('<d' + 'd' * len(SAMPLE_FIELDS))
+_SHM_SIZE = 4 + _SHM_BODY.size
+
+
+class SharedMemorySink:
+    """Latest sample in a POSIX shared memory block (see read_shared_memory()).
+
+    Layout (little-endian, packed): seq u32 | timestamp f64 | one f64 per
+    SAMPLE_FIELDS (NaN = missing).
+    seq is odd while an update is in progress (a seqlock), so readers retry
+    instead of seeing a torn sample.
+    """
+
+    def __init__(self, name=SHM_NAME or 'lowimpact-mppt'):
+        if shared_memory is None:
+            raise RuntimeError('multiprocessing.shared_memory needs Python 3.8+')
         try:
-            value = instrument.read_register(register, number_of_decimals=number_of_decimals, functioncode=4)
-            return float(value)
-        except Exception as e:
-            if attempt == retries - 1:
-                print(f"Error reading register {register} after {retries} attempts: {e}")
-                return None
-            time.sleep(0.1)  # Brief pause before retry
-    return None
-
-# Main loop
-while True:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=_SHM_SIZE)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.seq = 0
+
+    def write(self, data):
+        nan = float('nan')
+        values = [nan if data.get(k) is None else float(data[k]) for k in SAMPLE_FIELDS]
+        buf = self.shm.buf
+        self.seq = (self.seq + 1) & 0xFFFFFFFF       # odd: update in progress
+        struct.pack_into('<I', buf, 0, self.seq)
+        _SHM_BODY.pack_into(buf, 4, data.get('timestamp') or time.time(), *values)
+        self.seq = (self.seq + 1) & 0xFFFFFFFF       # even: consistent
+        struct.pack_into('<I', buf, 0, self.seq)
+
+    def close(self):
+        try:
+            self.shm.close()
+        except Exception:
+            pass
+
+
+def read_shared_memory(name=SHM_NAME or 'lowimpact-mppt', retries=5):
+    """Latest sample written by a SharedMemorySink, or None."""
+    if shared_memory is None:
+        return None
     try:
-        # Read all MPPT values
-        # Read battery temperature from main register
-        battery_temp = read_register(BATTERY_TEMP_REG, 2)
-        
-        # If temperature is None (read error), set to 0 for JSON
-        if battery_temp is None:
-            battery_temp = 0.0
-        
-        data = {
-            'timestamp': time.time(),
-            'panel_voltage': read_register(PANEL_V_REG, 2),
-            'panel_current': read_register(PANEL_A_REG, 2),
-            'panel_power': None,
-            'battery_voltage': read_register(BATTERY_V_REG, 2),
-            'battery_soc': read_register(BATTERY_SOC_REG, 1),
-            'battery_temperature': battery_temp,
-            'load_voltage': read_register(LOAD_V_REG, 2),
-            'load_current': read_register(LOAD_A_REG, 2),
-            'load_power': None,
-        }
-        
+        # track=False (3.13+): a reader must not unlink the block when it exits
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            return None
+    except Exception:
+        return None
+    try:
+        for _ in range(retries):
+            seq = struct.unpack_from('<I', shm.buf, 0)[0]
+            row = _SHM_BODY.unpack_from(shm.buf, 4)
+            if not seq & 1 and struct.unpack_from('<I', shm.buf, 0)[0] == seq:
+                data = {'timestamp': row[0]}
+                data.update((k, v) for k, v in zip(SAMPLE_FIELDS, row[1:]) if v == v)
+                return data
+            time.sleep(0.001)
+        return None
+    finally:
+        shm.close()
+
+
+class HttpPushSink:
+    """POSTs samples as JSON to `url` from a background thread.
+
+    Only the newest unsent sample is kept, so a slow or unreachable endpoint
+    never delays polling; at most one push per `min_interval` seconds.
+    """
+
+    def __init__(self, url=PUSH_URL, timeout=3.0, min_interval=1.0):
+        self.url = url
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.stats = {'pushed': 0, 'errors': 0, 'replaced': 0}
+        self._pending = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='mppt-push', daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        with self._cond:
+            if self._pending is not None:
+                self.stats['replaced'] += 1
+            self._pending = data
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                data, self._pending = self._pending, None
+            try:
+                req = urllib.request.Request(self.url, data=json.dumps(data).encode('utf-8'),
+                                             headers={'Content-Type': 'application/json'})
+                with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                    resp.read()
+                self.stats['pushed'] += 1
+            except Exception:
+                self.stats['errors'] += 1
+            time.sleep(self.min_interval)
+
+
+# --------------------- poller ---------------------
+class MpptPoller:
+    """Polls the MPPT on a drift-free tick and fans each sample out to sinks.
+
+    read_block: read_block(start, count) -> registers; by default connects
+    through the Modbus gateway, or the serial port, when started.
+    on_start / on_stop: lists of callables run in the poll thread.
+    """
+
+    def __init__(self, read_block=None, sinks=None, registers=None, scheduler=None,
+                 checkpoint=None, sample_log=None, on_start=(), on_stop=()):
+        self.read_block = read_block
+        self.registers = registers
+        self.sinks = list(sinks) if sinks is not None else [FileSink()]
+        # Poll every second while values move or clients are watching /sysinfo,
+        # back off to a slow heartbeat otherwise (see adaptive_poll.py)
+        self.scheduler = scheduler or AdaptiveScheduler(min_interval=1.0)
+        self.ticker = Ticker(self.scheduler, on_missed=self._on_missed)
+        self.checkpoint = checkpoint if checkpoint is not None else Checkpoint()
+        # Raw history for offline analysis (served by serve_with_info.py at /export)
+        self.sample_log = sample_log if sample_log is not None else SampleLog(source='mppt')
+        self.on_start = list(on_start)
+        self.on_stop = list(on_stop)
+        self.latest = None
+        self.stats = {'polls': 0, 'errors': 0, 'missed': 0, 'max_late': 0.0}
+        self._stop = threading.Event()
+        self._thread = None
+        self._state = {}
+        self._last_good = {}   # key -> [value, timestamp]
+        self._panel_energy = self._load_energy = None
+
+    # --- lifecycle ---
+    def connect(self):
+        """Open the register map and the bus (gateway preferred); raises on failure."""
+        if self.registers is None:
+            # MPPT register addresses, types and scales (register_map.json / REGISTER_MAP)
+            self.registers = register_map.load_default()
+        if self.read_block is None:
+            # Prefer the shared gateway daemon (modbus_gateway.py) when it owns the port
+            gateway = modbus_gateway.get_client() if modbus_gateway else None
+            if gateway is not None:
+                print(f"Using Modbus gateway at {gateway.path}")
+                self.read_block = make_block_reader(gateway=gateway)
+            else:
+                try:
+                    instrument = open_instrument()
+                except Exception as e:
+                    raise RuntimeError(f"Could not open {PORT}: {e}")
+                print(f"Connected to MPPT on {PORT}")
+                self.read_block = make_block_reader(instrument=instrument)
+
+    def _restore(self):
+        self._state = self.checkpoint.load()
+        self._panel_energy = EnergyCounter(self._state.get('panel_energy_wh'))
+        self._load_energy = EnergyCounter(self._state.get('load_energy_wh'))
+        self._last_good = self._state.get('last_good') or {}
+        last = self._state.get('last_output')
+        if last:
+            for sink in self.sinks:
+                if hasattr(sink, 'restore'):
+                    try:
+                        sink.restore(last)
+                    except Exception as e:
+                        print(f"Could not restore {getattr(sink, 'path', sink)}: {e}")
+
+    def start(self):
+        """Connect and poll in a background thread."""
+        self.connect()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='mppt-poller', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self.scheduler.wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def run(self):
+        """Poll until stop(); runs the start/stop hooks around the loop."""
+        if self.read_block is None or self.registers is None:
+            self.connect()
+        self._restore()
+        for hook in self.on_start:
+            hook(self)
+        try:
+            while not self._stop.is_set():
+                self.poll_once()
+                if not self.ticker.wait(self._stop):
+                    break
+        finally:
+            for hook in self.on_stop:
+                try:
+                    hook(self)
+                except Exception:
+                    pass
+            self._shutdown()
+
+    def _shutdown(self):
+        # persist everything still buffered
+        for sink in self.sinks:
+            try:
+                if hasattr(sink, 'close'):
+                    sink.close()
+            except Exception:
+                pass
+        self.checkpoint.save()
+        self.sample_log.flush()
+
+    def _on_missed(self, count, late):
+        self.stats['missed'] += count
+        self.stats['max_late'] = max(self.stats['max_late'], late)
+        print(f"[{time.strftime('%H:%M:%S')}] Poll overran: missed {count} tick(s), {late:.2f}s late")
+
+    # --- one poll ---
+    def _fill_from_last_good(self, data):
+        """Remember good readings; fill failed ones from recent good values."""
+        now = data['timestamp']
+        for key in OUTPUT_KEYS.values():
+            if data.get(key) is not None:
+                self._last_good[key] = [data[key], now]
+            elif key in self._last_good and now - self._last_good[key][1] <= LAST_GOOD_MAX_AGE:
+                data[key] = self._last_good[key][0]
+
+    @staticmethod
+    def _derive_power(data):
         # Calculate panel power if we have V and A
-        if data['panel_voltage'] is not None and data['panel_current'] is not None:
+        if data['panel_power'] is None and data['panel_voltage'] is not None and data['panel_current'] is not None:
             data['panel_power'] = round(data['panel_voltage'] * data['panel_current'], 2)
-        
         # Calculate load power if we have V and A
-        if data['load_voltage'] is not None and data['load_current'] is not None:
+        if data['load_power'] is None and data['load_voltage'] is not None and data['load_current'] is not None:
             data['load_power'] = round(data['load_voltage'] * data['load_current'], 2)
-        
-        # Write to JSON file
-        with open(OUTPUT_FILE, 'w') as f:
-            json.dump(data, f)
-        
+
+    def poll_once(self):
+        """Read the MPPT once, update state and write the sample to every sink."""
+        if self._panel_energy is None:
+            self._restore()
+        data = None
+        try:
+            # Read all MPPT values (one merged block read for the default map)
+            values = self.registers.read(self.read_block)
+
+            data = {'timestamp': time.time(), 'panel_power': None, 'load_power': None}
+            for field, key in OUTPUT_KEYS.items():
+                data[key] = values.get(field)
+            self._derive_power(data)
+
+            # Append the raw readings to the compressed history log
+            self.sample_log.append({k: v for k, v in data.items() if k != 'timestamp' and v is not None}, data['timestamp'])
+
+            self._fill_from_last_good(data)
+            self._derive_power(data)
+            # If temperature is None (read error), set to 0 for JSON
+            if data['battery_temperature'] is None:
+                data['battery_temperature'] = 0.0
+
+            # Lifetime energy counters (restored from the checkpoint)
+            data['panel_energy_wh'] = round(self._panel_energy.add(data['timestamp'], data['panel_power']), 3)
+            data['load_energy_wh'] = round(self._load_energy.add(data['timestamp'], data['load_power']), 3)
+
+            self.latest = data
+            for sink in self.sinks:
+                try:
+                    sink.write(data)
+                except Exception as e:
+                    print(f"Error in sink {type(sink).__name__}: {e}")
+            self._state.update({
+                'panel_energy_wh': self._panel_energy.total_wh,
+                'load_energy_wh': self._load_energy.total_wh,
+                'last_good': self._last_good,
+                'last_output': data,
+            })
+            self.checkpoint.state = self._state
+            self.checkpoint.mark_dirty()
+            self.checkpoint.maybe_save()
+            self.stats['polls'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Error in main loop: {e}")
+
+        self.scheduler.observe(data)
+        return data
+
+
+def main():
+    sinks = [FileSink(OUTPUT_FILE)]
+    if SHM_NAME:
+        sinks.append(SharedMemorySink(SHM_NAME))
+    if PUSH_URL:
+        sinks.append(HttpPushSink(PUSH_URL))
+
+    def _print(data):
         # Print for debugging
         print(f"[{time.strftime('%H:%M:%S')}] Panel: {data['panel_voltage']}V, Batt: {data['battery_soc']}% {data['battery_temperature']}°C")
-        
+    sinks.append(CallbackSink(_print))
+
+    poller = MpptPoller(sinks=sinks)
+    try:
+        poller.connect()
     except Exception as e:
-        print(f"Error in main loop: {e}")
-    
-    time.sleep(1)
+        print(f"Error: {e}")
+        sys.exit(1)
+    # SIGTERM / Ctrl-C: leave the loop so buffered state is persisted
+    signal.signal(signal.SIGTERM, lambda signum, frame: poller.stop(timeout=0))
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Page-weight manifest for the footer widget (served at /page-weight).
+
+The widget used to re-download every stylesheet and script just to measure
+them. The server measures them once instead: it parses the page for
+<link rel="stylesheet" href> and <script src>, and records for each local
+file its raw, gzip and (with `brotli` installed) brotli size and a sha256:
+
+    {"page": "index.html",
+     "files": [{"path": "index.html", "type": "html", "raw": 98304, "gzip": 20480,
+                "br": 17408, "sha256": "..."}, ...],
+     "total": {"raw": ..., "gzip": ..., "br": ...},
+     "by_type": {"html": {...}, "css": {...}, "js": {...}},
+     "external": 0, "generated": 1714567890.0, "etag": "..."}
+
+The manifest is rebuilt when the page or any file it references changes
+(checked with stat() at most every PAGE_WEIGHT_CHECK_INTERVAL seconds), so
+the answer is cacheable and costs one small request.
+
+    weight = PageWeight('.', 'index.html')
+    manifest = weight.get()
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from html.parser import HTMLParser
+from urllib.parse import urlparse, unquote
+
+from env_config import env_float
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+PAGE = os.environ.get('PAGE_WEIGHT_PAGE', 'index.html')
+CHECK_INTERVAL = env_float('PAGE_WEIGHT_CHECK_INTERVAL', 10.0)
+
+
+class _AssetParser(HTMLParser):
+    """Collects stylesheet hrefs and script srcs in document order."""
+
+    def __init__(self):
+        super().__init__()
+        self.assets = []   # (type, url)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'link' and 'stylesheet' in (attrs.get('rel') or '').lower().split() and attrs.get('href'):
+            self.assets.append(('css', attrs['href']))
+        elif tag == 'script' and attrs.get('src'):
+            self.assets.append(('js', attrs['src']))
+
+
+def measure(data):
+    """Raw/compressed sizes and hash of one file's bytes."""
+    entry = {
+        'raw': len(data),
+        'gzip': len(gzip.compress(data, 6, mtime=0)),
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+    if brotli is not None:
+        entry['br'] = len(brotli.compress(data, quality=11))
+    return entry
+
+
+class PageWeight:
+    """Builds the manifest for one page and keeps it current."""
+
+    def __init__(self, root='.', page=PAGE, check_interval=CHECK_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.page = page
+        self.check_interval = check_interval
+        self.manifest = None
+        self._signature = None     # ((path, size, mtime_ns), ...) the manifest was built from
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Current manifest, rebuilt if the page or its assets changed."""
+        now = time.monotonic()
+        if self.manifest is not None and now - self._checked < self.check_interval:
+            return self.manifest
+        with self._lock:
+            if self.manifest is None or time.monotonic() - self._checked >= self.check_interval:
+                if self._signature is None or self._stat(self._signature) != self._signature:
+                    self._build()
+                self._checked = time.monotonic()
+        return self.manifest
+
+    def _resolve(self, url):
+        """Filesystem path of a same-site asset URL, or None for external ones."""
+        parsed = urlparse(url)
+        if parsed.scheme or parsed.netloc:
+            return None
+        path = unquote(parsed.path)
+        base = self.root if path.startswith('/') else os.path.dirname(os.path.join(self.root, self.page))
+        full = os.path.normpath(os.path.join(base, path.lstrip('/')))
+        if not full.startswith(self.root + os.sep):
+            return None
+        return full
+
+    def _stat(self, signature):
+        current = []
+        for path, _size, _mtime in signature:
+            try:
+                st = os.stat(path)
+                current.append((path, st.st_size, st.st_mtime_ns))
+            except OSError:
+                current.append((path, None, None))
+        return tuple(current)
+
+    def _build(self):
+        page_path = os.path.join(self.root, self.page)
+        # stat before reading: an edit in between is picked up by the next check
+        st = os.stat(page_path)
+        with open(page_path, 'rb') as f:
+            html = f.read()
+        parser = _AssetParser()
+        parser.feed(html.decode('utf-8', 'replace'))
+        files = [dict(path=self.page, type='html', **measure(html))]
+        signature = [(page_path, st.st_size, st.st_mtime_ns)]
+        seen = {page_path}
+        external = 0
+        for kind, url in parser.assets:
+            path = self._resolve(url)
+            if path is None:
+                external += 1
+                continue
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                st = os.stat(path)
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                # missing file: watch for it to appear
+                signature.append((path, None, None))
+                continue
+            signature.append((path, st.st_size, st.st_mtime_ns))
+            files.append(dict(path=os.path.relpath(path, self.root), type=kind, **measure(data)))
+        keys = ('raw', 'gzip', 'br') if brotli is not None else ('raw', 'gzip')
+        total = {k: sum(f[k] for f in files) for k in keys}
+        by_type = {}
+        for f in files:
+            bucket = by_type.setdefault(f['type'], {k: 0 for k in keys})
+            for k in keys:
+                bucket[k] += f[k]
+        etag = hashlib.sha256(''.join(f['sha256'] for f in files).encode('ascii')).hexdigest()[:16]
+        self.manifest = {
+            'page': self.page,
+            'files': files,
+            'total': total,
+            'by_type': by_type,
+            'external': external,
+            'generated': time.time(),
+            'etag': etag,
+        }
+        self._signature = tuple(signature)
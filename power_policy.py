@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Battery-aware runtime policy ("low-power mode") for the solar-powered server.
+
+The battery state of charge picks one of three levels, each with a profile
+the server applies at runtime:
+
+    level     SOC (default)   sampling   /sysinfo cache   connections   static
+    normal    > 40 %          1x         live             unlimited     full
+    saver     <= 40 %         5x slower  10 s             8             lite
+    critical  <= 20 %         15x slower 30 s             4             lite
+
+Expensive collectors (disk usage, temperature scans, sysfs power probes)
+are re-run only every `collectors[name]` seconds in the lower levels and
+their last values reused in between. A level is left again only once SOC has
+recovered POWER_HYSTERESIS points above its threshold, so the mode does not
+flap around a boundary.
+
+Tune with POWER_SAVER_SOC, POWER_CRITICAL_SOC, POWER_HYSTERESIS,
+POWER_SAVER_SLOWDOWN and POWER_CRITICAL_SLOWDOWN; POWER_MODE forces a level.
+"""
+import os
+import threading
+import time
+
+from env_config import env_float
+
+SAVER_SOC = env_float('POWER_SAVER_SOC', 40.0)
+CRITICAL_SOC = env_float('POWER_CRITICAL_SOC', 20.0)
+HYSTERESIS = env_float('POWER_HYSTERESIS', 5.0)
+FORCED_MODE = os.environ.get('POWER_MODE') or None
+
+LEVELS = ('normal', 'saver', 'critical')
+
+PROFILES = {
+    'normal': {
+        'slowdown': 1.0,          # multiplier for sampler and poll intervals
+        'sysinfo_ttl': 0.0,       # seconds a rendered /sysinfo is reused
+        'max_connections': None,  # admitted connections (None = server limits)
+        'lite': False,            # serve the lighter static variants
+        'collectors': {'disk': 0.0, 'temperature': 0.0, 'power': 0.0},
+    },
+    'saver': {
+        'slowdown': env_float('POWER_SAVER_SLOWDOWN', 5.0),
+        'sysinfo_ttl': 10.0,
+        'max_connections': 8,
+        'lite': True,
+        'collectors': {'disk': 600.0, 'temperature': 60.0, 'power': 60.0},
+    },
+    'critical': {
+        'slowdown': env_float('POWER_CRITICAL_SLOWDOWN', 15.0),
+        'sysinfo_ttl': 30.0,
+        'max_connections': 4,
+        'lite': True,
+        'collectors': {'disk': 3600.0, 'temperature': 600.0, 'power': 600.0},
+    },
+}
+
+
+class PowerPolicy:
+    """Tracks the current level from SOC readings and caches collector output."""
+
+    def __init__(self, saver_soc=SAVER_SOC, critical_soc=CRITICAL_SOC,
+                 hysteresis=HYSTERESIS, forced=FORCED_MODE, profiles=PROFILES):
+        self.thresholds = {'saver': saver_soc, 'critical': critical_soc}
+        self.hysteresis = hysteresis
+        self.forced = forced if forced in LEVELS else None
+        self.profiles = profiles
+        self.level = self.forced or 'normal'
+        self.soc = None
+        self.changed_at = time.time()
+        self._listeners = []
+        self._collected = {}   # name -> (monotonic time, {key: value})
+        self._lock = threading.Lock()
+
+    @property
+    def profile(self):
+        return self.profiles[self.level]
+
+    def on_change(self, fn):
+        """Call fn(level, profile) whenever the level changes."""
+        self._listeners.append(fn)
+
+    def _target(self, soc):
+        level = LEVELS.index(self.level)
+        if soc <= self.thresholds['critical']:
+            lower = 2
+        elif soc <= self.thresholds['saver']:
+            lower = 1
+        else:
+            lower = 0
+        if lower >= level:
+            return LEVELS[lower]
+        # leave a level only once SOC is back above its threshold + hysteresis
+        while level > lower and soc > self.thresholds[LEVELS[level]] + self.hysteresis:
+            level -= 1
+        return LEVELS[level]
+
+    def update(self, soc):
+        """Feed a battery SOC (%) reading; returns the (possibly new) level."""
+        try:
+            soc = float(soc)
+        except (TypeError, ValueError):
+            return self.level
+        with self._lock:
+            self.soc = soc
+            if self.forced:
+                return self.level
+            level = self._target(soc)
+            if level == self.level:
+                return level
+            self.level = level
+            self.changed_at = time.time()
+        for fn in self._listeners:
+            try:
+                fn(level, self.profiles[level])
+            except Exception:
+                pass
+        return level
+
+    # --- collector caching ---
+    def due(self, name):
+        """True if collector `name` should run now (always, at the normal level)."""
+        every = self.profile['collectors'].get(name, 0.0)
+        last = self._collected.get(name)
+        return not every or last is None or time.monotonic() - last[0] >= every
+
+    def remember(self, name, info, keys):
+        self._collected[name] = (time.monotonic(), {k: info[k] for k in keys if k in info})
+
+    def recall(self, name):
+        last = self._collected.get(name)
+        return dict(last[1]) if last else {}
+
+    def status(self):
+        return {'power_mode': self.level, 'power_mode_since': int(self.changed_at)}
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Cheap CPU / memory sampler reading /proc directly (Linux only, no psutil).
+
+The /proc files are opened once and re-read from offset 0 on each sample, and
+CPU usage is computed from the jiffy deltas between two samples, so a sample
+costs a few syscalls and never blocks:
+
+    sampler = ProcSampler()
+    sampler.sample()   # first call primes the counters
+    time.sleep(1)
+    sampler.sample()   # -> {'cpu_percent': 7.5, 'cpu_per_core': [...], ...}
+"""
+import os
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def available():
+    return os.path.exists('/proc/stat') and os.path.exists('/proc/meminfo')
+
+
+class ProcSampler:
+    """Keeps /proc descriptors open and turns counter deltas into percentages."""
+
+    def __init__(self):
+        self._fds = {}
+        for name, path in (('stat', '/proc/stat'), ('meminfo', '/proc/meminfo'),
+                           ('self_stat', '/proc/self/stat'), ('self_statm', '/proc/self/statm'),
+                           ('uptime', '/proc/uptime')):
+            try:
+                self._fds[name] = os.open(path, os.O_RDONLY)
+            except OSError:
+                pass
+        self._prev_cpu = None   # {'cpu': [..], 'cpu0': [..], ...}
+        self._prev_self = None  # (process jiffies, uptime seconds)
+
+    def close(self):
+        for fd in self._fds.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds = {}
+
+    def _read(self, name):
+        fd = self._fds.get(name)
+        if fd is None:
+            return None
+        os.lseek(fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(fd, 8192)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    @staticmethod
+    def _usage(prev, cur):
+        """Percentages from two /proc/stat rows (user nice system idle iowait irq softirq steal)."""
+        delta = [c - p for c, p in zip(cur, prev)]
+        total = sum(delta[:8]) or 1
+        idle = delta[3] + delta[4]
+        return {
+            'busy': 100.0 * (total - idle) / total,
+            'iowait': 100.0 * delta[4] / total,
+            'steal': 100.0 * delta[7] / total if len(delta) > 7 else 0.0,
+        }
+
+    def sample(self):
+        """Return the current readings; CPU fields appear from the second call on."""
+        out = {}
+        uptime = None
+        try:
+            raw = self._read('uptime')
+            if raw:
+                uptime = float(raw.split()[0])
+                out['uptime_seconds'] = int(uptime)
+        except Exception:
+            pass
+
+        try:
+            raw = self._read('stat')
+            cpus = {}
+            for line in raw.split(b'\n'):
+                if not line.startswith(b'cpu'):
+                    break
+                parts = line.split()
+                vals = [int(v) for v in parts[1:9]]
+                vals += [0] * (8 - len(vals))
+                cpus[parts[0].decode()] = vals
+            prev, self._prev_cpu = self._prev_cpu, cpus
+            if prev and 'cpu' in prev and 'cpu' in cpus:
+                agg = self._usage(prev['cpu'], cpus['cpu'])
+                out['cpu_percent'] = round(agg['busy'], 1)
+                out['cpu_iowait'] = round(agg['iowait'], 1)
+                out['cpu_steal'] = round(agg['steal'], 1)
+                per_core = []
+                n = 0
+                while ('cpu%d' % n) in cpus:
+                    key = 'cpu%d' % n
+                    per_core.append(round(self._usage(prev[key], cpus[key])['busy'], 1) if key in prev else 0.0)
+                    n += 1
+                out['cpu_per_core'] = per_core
+        except Exception:
+            pass
+
+        try:
+            raw = self._read('meminfo')
+            mem = {}
+            for line in raw.split(b'\n'):
+                key, _, rest = line.partition(b':')
+                if key in (b'MemTotal', b'MemAvailable', b'MemFree', b'Buffers', b'Cached'):
+                    mem[key] = int(rest.split()[0]) * 1024
+            total = mem.get(b'MemTotal')
+            if total:
+                avail = mem.get(b'MemAvailable')
+                if avail is None:
+                    avail = mem.get(b'MemFree', 0) + mem.get(b'Buffers', 0) + mem.get(b'Cached', 0)
+                used = total - avail
+                out['memory_total'] = total
+                out['memory_used'] = used
+                out['memory_percent'] = round(100.0 * used / total, 1)
+        except Exception:
+            pass
+
+        try:
+            raw = self._read('self_statm')
+            if raw:
+                out['server_rss'] = int(raw.split()[1]) * _PAGE_SIZE
+            raw = self._read('self_stat')
+            if raw and uptime is not None:
+                # fields after the parenthesised command name; utime/stime are 14/15
+                fields = raw[raw.rindex(b')') + 2:].split()
+                jiffies = int(fields[11]) + int(fields[12])
+                prev, self._prev_self = self._prev_self, (jiffies, uptime)
+                if prev and uptime > prev[1]:
+                    out['server_cpu_percent'] = round(
+                        100.0 * (jiffies - prev[0]) / _CLK_TCK / (uptime - prev[1]), 1)
+        except Exception:
+            pass
+        return out
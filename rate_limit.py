@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Per-client rate limiting for the API routes.
+
+Every client gets a token bucket: RATE_LIMIT_BURST tokens, refilled at
+RATE_LIMIT_RATE per second, one token per request. A client with an empty
+bucket gets 429 with a Retry-After of the time until its next token, so a
+script polling /sysinfo hundreds of times a second costs a few cheap
+rejections instead of get_sysinfo() calls and Modbus lock contention.
+
+Fairness: the worker pool is shared by everyone, so a client may also hold
+at most RATE_LIMIT_CONCURRENCY workers at once. Further requests from it are
+turned away while others are still served, rather than queueing behind it.
+
+Clients are identified by the connecting address, or, when that address is
+one of TRUSTED_PROXIES (nginx on the same host by default), by X-Real-IP or
+the right-most untrusted X-Forwarded-For entry. Headers from anyone else are
+ignored, so they cannot be used to dodge the limit. Since an untrusted proxy
+would put all of its visitors in one bucket, the first forwarded request
+from each such address is logged as a warning.
+
+Buckets are small slotted objects in an LRU map capped at
+RATE_LIMIT_CLIENTS; the least recently seen client is evicted first (an
+idle client's bucket has refilled anyway, so nothing is lost).
+
+    limiter = RateLimiter()
+    key = limiter.client_key(peer_ip, headers)
+    allowed, retry_after = limiter.acquire(key)
+    ...
+    limiter.release(key)
+"""
+import collections
+import ipaddress
+import os
+import sys
+import threading
+import time
+
+from env_config import env_float
+
+ENABLED = os.environ.get('RATE_LIMIT', '1') not in ('', '0')
+RATE = env_float('RATE_LIMIT_RATE', 5.0)          # sustained requests per second per client
+BURST = env_float('RATE_LIMIT_BURST', 20.0)       # requests a client may make back to back
+# workers one client may hold; the page itself fetches /page-weight, /weather
+# and /sysinfo at once, and a weather miss holds its worker for the upstream
+CONCURRENCY = int(env_float('RATE_LIMIT_CONCURRENCY', 4))
+MAX_CLIENTS = int(env_float('RATE_LIMIT_CLIENTS', 4096))
+TRUSTED_PROXIES = os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1')
+
+
+def parse_networks(spec):
+    """'127.0.0.1, 10.0.0.0/8' -> list of ip_network objects."""
+    networks = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if part:
+            networks.append(ipaddress.ip_network(part, strict=False))
+    return networks
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'stamp', 'inflight')
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+        self.inflight = 0
+
+
+class RateLimiter:
+    """Token buckets plus in-flight caps, keyed by client address."""
+
+    def __init__(self, rate=RATE, burst=BURST, concurrency=CONCURRENCY, max_clients=MAX_CLIENTS,
+                 trusted=TRUSTED_PROXIES):
+        self.rate = max(0.001, rate)
+        self.burst = max(1.0, burst)
+        self.concurrency = concurrency
+        self.max_clients = max(1, max_clients)
+        self.trusted = parse_networks(trusted)
+        self.stats = {'allowed': 0, 'limited': 0, 'busy': 0, 'evicted': 0}
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._warned = set()   # untrusted peers seen sending forwarding headers
+
+    def _trusted(self, addr):
+        try:
+            ip = ipaddress.ip_address(addr)
+        except ValueError:
+            return False
+        return any(ip in net for net in self.trusted)
+
+    def client_key(self, peer, headers):
+        """Address to account a request to (see module docstring)."""
+        if not self._trusted(peer):
+            if len(self._warned) < 16 and peer not in self._warned and (
+                    headers.get('X-Real-IP') or headers.get('X-Forwarded-For')):
+                self._warned.add(peer)
+                sys.stderr.write('[rate-limit] ignoring forwarding headers from %s; if it is your '
+                                 'proxy, add it to TRUSTED_PROXIES or all its visitors share one '
+                                 'bucket\n' % peer)
+            return peer
+        real_ip = (headers.get('X-Real-IP') or '').strip()
+        if real_ip:
+            return real_ip
+        forwarded = [h.strip() for h in (headers.get('X-Forwarded-For') or '').split(',') if h.strip()]
+        # right to left: the first hop not added by one of our proxies
+        for hop in reversed(forwarded):
+            if not self._trusted(hop):
+                return hop
+        return forwarded[0] if forwarded else peer
+
+    def acquire(self, key, cost=1.0):
+        """(True, 0) if the request may run, else (False, seconds to wait).
+
+        Every allowed request must be paired with release(key).
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(self.burst, now)
+                excess = len(self._buckets) - self.max_clients
+                if excess > 0:
+                    # least recently seen first; buckets still being served stay
+                    victims = []
+                    for old, b in self._buckets.items():
+                        if not b.inflight and old != key:
+                            victims.append(old)
+                            if len(victims) >= excess:
+                                break
+                    for old in victims:
+                        del self._buckets[old]
+                    self.stats['evicted'] += len(victims)
+            else:
+                self._buckets.move_to_end(key)
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.stamp) * self.rate)
+                bucket.stamp = now
+            if self.concurrency and bucket.inflight >= self.concurrency:
+                self.stats['busy'] += 1
+                return False, 1.0
+            if bucket.tokens < cost:
+                self.stats['limited'] += 1
+                return False, (cost - bucket.tokens) / self.rate
+            bucket.tokens -= cost
+            bucket.inflight += 1
+            self.stats['allowed'] += 1
+            return True, 0.0
+
+    def release(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None and bucket.inflight > 0:
+                bucket.inflight -= 1
+
+    def clients(self):
+        return len(self._buckets)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Shared Modbus register map and compiled decoders.
+
+All three entry points (serve_with_info.py, rs485_server.py, mppt_reader.py)
+describe the MPPT registers with one file, `register_map.json` by default or
+the path in REGISTER_MAP:
+
+    {
+      "word_order": "big",
+      "fields": {
+        "panel_v":      {"addr": 12546, "type": "uint16", "scale": 100, "unit": "V",  "round": 2},
+        "battery_temp": {"addr": 12556, "type": "int16",  "scale": 100, "unit": "C",  "round": 1},
+        "energy_total": {"addr": 12560, "type": "uint32", "scale": 10,  "unit": "Wh", "word_order": "little"}
+      }
+    }
+
+Types: int16, uint16, int32, uint32, float32 (32-bit types span two registers,
+`word_order` says which register holds the high word). Values are divided by
+`scale` and rounded to `round` decimals.
+
+At load time the map is compiled into block reads (nearby registers merged
+into one request) and, per block, a register gather list plus one
+struct.Struct covering every field in the block, so a raw block response is
+decoded into all of its fields with a single unpack.
+
+When no map file is configured but the legacy PANEL_V_ADDR / BATTERY_*_ADDR
+environment variables are set, an equivalent map is built from them.
+"""
+import json
+import operator
+import os
+import struct
+
+MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'register_map.json')
+MERGE_GAP = 4     # unused registers tolerated inside one block read
+MAX_BLOCK = 120   # stay under the 125-register Modbus limit
+
+# type -> (struct code, registers)
+TYPES = {
+    'int16': ('h', 1),
+    'uint16': ('H', 1),
+    'int32': ('i', 2),
+    'uint32': ('I', 2),
+    'float32': ('f', 2),
+}
+
+# (field, env address, env scale, default scale, round) for the legacy env configuration
+_LEGACY_ENV = (
+    ('panel_v', 'PANEL_V_ADDR', 'PANEL_V_SCALE', None, 2),
+    ('panel_a', 'PANEL_A_ADDR', 'PANEL_A_SCALE', 100.0, 2),
+    ('panel_w', 'PANEL_W_ADDR', 'PANEL_W_SCALE', 100.0, 2),
+    ('battery_soc', 'BATTERY_SOC_ADDR', 'BATTERY_SOC_SCALE', 10.0, 1),
+    ('battery_v', 'BATTERY_V_ADDR', 'BATTERY_V_SCALE', 10.0, 2),
+    ('battery_a', 'BATTERY_A_ADDR', 'BATTERY_A_SCALE', 100.0, 2),
+    ('battery_w', 'BATTERY_W_ADDR', 'BATTERY_W_SCALE', 10.0, 2),
+    ('battery_temp', 'BATTERY_TEMP_ADDR', 'BATTERY_TEMP_SCALE', 10.0, 1),
+    ('load_v', 'LOAD_V_ADDR', 'LOAD_V_SCALE', 100.0, 2),
+    ('load_a', 'LOAD_A_ADDR', 'LOAD_A_SCALE', 100.0, 2),
+)
+
+
+class _Block:
+    """One merged read plus its precompiled decoder."""
+
+    def __init__(self, start, count, fields, default_order):
+        self.start = start
+        self.count = count
+        order = []
+        fmt = '>'
+        names, scales, rounds = [], [], []
+        pos = start
+        for f in fields:
+            code, width = TYPES[f['type']]
+            fmt += 'xx' * (f['addr'] - pos)
+            order.extend(range(pos - start, f['addr'] - start))
+            offs = list(range(f['addr'] - start, f['addr'] - start + width))
+            if width == 2 and f.get('word_order', default_order) == 'little':
+                offs.reverse()
+            order.extend(offs)
+            fmt += code
+            names.append(f['name'])
+            scales.append(float(f.get('scale') or 1.0))
+            rounds.append(f.get('round'))
+            pos = f['addr'] + width
+        self._gather = operator.itemgetter(*order) if len(order) > 1 else (lambda regs, i=order[0]: (regs[i],))
+        self._pack = struct.Struct('>%dH' % len(order))
+        self._unpack = struct.Struct(fmt)
+        self._post = list(zip(names, scales, rounds))
+        self.fields = names
+
+    def decode(self, regs):
+        """Raw 16-bit registers for this block -> {field: value}."""
+        raw = self._pack.pack(*[r & 0xFFFF for r in self._gather(regs)])
+        out = {}
+        for (name, scale, rnd), val in zip(self._post, self._unpack.unpack(raw)):
+            val = val / scale
+            out[name] = round(val, rnd) if rnd is not None else val
+        return out
+
+
+class RegisterMap:
+    """Compiled register map: field specs -> block reads + decoders."""
+
+    def __init__(self, fields, word_order='big', source=None):
+        self.source = source
+        self.specs = {}
+        for name, spec in fields.items():
+            spec = dict(spec)
+            spec['name'] = name
+            spec['addr'] = int(spec['addr'])
+            spec.setdefault('type', 'int16')
+            if spec['type'] not in TYPES:
+                raise ValueError('%s: unknown type %r' % (name, spec['type']))
+            self.specs[name] = spec
+        self.word_order = word_order
+        self._singles = {}
+        self.blocks = self._compile(word_order)
+
+    def _compile(self, word_order):
+        ordered = sorted(self.specs.values(), key=lambda f: f['addr'])
+        groups = []
+        for f in ordered:
+            width = TYPES[f['type']][1]
+            if groups:
+                start, end, members = groups[-1]
+                if f['addr'] < end:
+                    raise ValueError('%s overlaps %s' % (f['name'], members[-1]['name']))
+                if f['addr'] - end <= MERGE_GAP and f['addr'] + width - start <= MAX_BLOCK:
+                    members.append(f)
+                    groups[-1] = (start, f['addr'] + width, members)
+                    continue
+            groups.append((f['addr'], f['addr'] + width, [f]))
+        return [_Block(start, end - start, members, word_order) for start, end, members in groups]
+
+    def fields(self):
+        return list(self.specs)
+
+    def _single(self, name):
+        """Decoder for one field on its own (fallback when a merged read fails)."""
+        block = self._singles.get(name)
+        if block is None:
+            spec = self.specs[name]
+            block = self._singles[name] = _Block(spec['addr'], TYPES[spec['type']][1], [spec], self.word_order)
+        return block
+
+    def read(self, read_block):
+        """Read every field via read_block(start, count) -> [regs] or None.
+
+        If a merged block read fails (some devices reject reads that include
+        unmapped registers), its fields are retried one by one. When any of
+        those single reads succeeds the device is answering, so the merged
+        read is what it rejects: the block is split for good and later polls
+        go straight to the single reads.
+        """
+        values = {}
+        blocks = []
+        split = False
+        for block in self.blocks:
+            regs = read_block(block.start, block.count)
+            if regs is not None and len(regs) >= block.count:
+                values.update(block.decode(regs))
+                blocks.append(block)
+                continue
+            if len(block.fields) == 1:
+                blocks.append(block)
+                continue
+            singles = [self._single(name) for name in block.fields]
+            answered = False
+            for single in singles:
+                regs = read_block(single.start, single.count)
+                if regs is not None and len(regs) >= single.count:
+                    values.update(single.decode(regs))
+                    answered = True
+            if answered:
+                blocks.extend(singles)
+                split = True
+            else:
+                # nothing answered: the bus is down, keep the block
+                blocks.append(block)
+        if split:
+            self.blocks = blocks
+        return values
+
+
+def load(path):
+    """Load and compile a map file (.json, or .toml with Python 3.11+)."""
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            doc = tomllib.load(f)
+    else:
+        with open(path, 'r') as f:
+            doc = json.load(f)
+    return RegisterMap(doc.get('fields', {}), doc.get('word_order', 'big'), source=path)
+
+
+def from_env(environ=os.environ):
+    """Build a map from the legacy *_ADDR / *_SCALE variables (or None if none set)."""
+    def _get(name, conv, default=None):
+        try:
+            return conv(environ[name]) if environ.get(name) is not None else default
+        except Exception:
+            return default
+    if not any(environ.get(addr) is not None for _, addr, _, _, _ in _LEGACY_ENV) \
+            and environ.get('REGISTER_ADDR') is None:
+        return None
+    register_addr = _get('REGISTER_ADDR', int, 0)
+    default_scale = _get('SCALE', float, 100.0)
+    fields = {}
+    for name, addr_var, scale_var, scale_default, rnd in _LEGACY_ENV:
+        addr = _get(addr_var, int, register_addr if name == 'panel_v' else None)
+        if addr is None:
+            continue
+        scale = _get(scale_var, float, scale_default if scale_default is not None else default_scale)
+        # the servers always decoded these registers as signed 16-bit
+        fields[name] = {'addr': addr, 'type': 'int16', 'scale': scale, 'round': rnd}
+    return RegisterMap(fields, source='environment')
+
+
+def load_default():
+    """REGISTER_MAP file, else the legacy environment variables, else register_map.json."""
+    path = os.environ.get('REGISTER_MAP')
+    if path:
+        return load(path)
+    env_map = from_env()
+    if env_map is not None:
+        return env_map
+    return load(MAP_FILE)
@@ -11,14 +11,20 @@ Features:
 - Optional CORS support (requires flask-cors)
 - Can serve the static site from the same process to avoid CORS issues
 
-Edit SERIAL_PORT, BAUDRATE, REGISTER_ADDR, SCALE to match your device.
+Edit SERIAL_PORT, BAUDRATE and register_map.json (or REGISTER_MAP) to match
+your device.
 """
 
 import os
+import sys
 import time
 import threading
 import argparse
-from flask import Flask, jsonify, send_from_directory, abort
+from flask import Flask, jsonify, send_from_directory, abort, request
+
+from adaptive_poll import AdaptiveScheduler
+import register_map
+import telemetry_window
 
 try:
     from pymodbus.client.sync import ModbusSerialClient as ModbusClient
@@ -30,49 +36,30 @@ try:
 except Exception:
     CORS = None
 
+try:
+    import modbus_gateway
+except Exception:
+    modbus_gateway = None
+
 app = Flask(__name__, static_folder='.')
 
 # --------------------- Configuration ---------------------
 SERIAL_PORT = os.environ.get('SERIAL_PORT', '/dev/ttyUSB0')
 BAUDRATE = int(os.environ.get('BAUDRATE', '9600'))
 MODBUS_UNIT = int(os.environ.get('MODBUS_UNIT', '1'))
-REGISTER_ADDR = int(os.environ.get('REGISTER_ADDR', '0'))
-REGISTER_COUNT = int(os.environ.get('REGISTER_COUNT', '1'))
-SCALE = float(os.environ.get('SCALE', '100.0'))
-
-# Optional addresses/scales for richer telemetry (panel and battery)
-def _env_int(name, default=None):
-    try:
-        return int(os.environ.get(name)) if os.environ.get(name) is not None else default
-    except Exception:
-        return default
-
-def _env_float(name, default=None):
-    try:
-        return float(os.environ.get(name)) if os.environ.get(name) is not None else default
-    except Exception:
-        return default
-
-PANEL_V_ADDR = _env_int('PANEL_V_ADDR', REGISTER_ADDR)
-PANEL_V_SCALE = _env_float('PANEL_V_SCALE', SCALE)
-PANEL_A_ADDR = _env_int('PANEL_A_ADDR', None)
-PANEL_A_SCALE = _env_float('PANEL_A_SCALE', 100.0)
-PANEL_W_ADDR = _env_int('PANEL_W_ADDR', None)
-PANEL_W_SCALE = _env_float('PANEL_W_SCALE', 100.0)
-
-BATTERY_SOC_ADDR = _env_int('BATTERY_SOC_ADDR', None)
-BATTERY_SOC_SCALE = _env_float('BATTERY_SOC_SCALE', 10.0)
-BATTERY_V_ADDR = _env_int('BATTERY_V_ADDR', None)
-BATTERY_V_SCALE = _env_float('BATTERY_V_SCALE', 10.0)
-BATTERY_A_ADDR = _env_int('BATTERY_A_ADDR', None)
-BATTERY_A_SCALE = _env_float('BATTERY_A_SCALE', 100.0)
-BATTERY_W_ADDR = _env_int('BATTERY_W_ADDR', None)
-BATTERY_W_SCALE = _env_float('BATTERY_W_SCALE', 10.0)
-BATTERY_TEMP_ADDR = _env_int('BATTERY_TEMP_ADDR', None)
-BATTERY_TEMP_SCALE = _env_float('BATTERY_TEMP_SCALE', 10.0)
+# Register addresses/types/scales shared with serve_with_info.py and
+# mppt_reader.py: REGISTER_MAP file, else the legacy PANEL_V_ADDR /
+# BATTERY_*_ADDR variables, else register_map.json (see register_map.py).
+try:
+    REGISTER_MAP = register_map.load_default()
+except Exception as e:
+    sys.stderr.write('Could not load register map: %s\n' % e)
+    REGISTER_MAP = None
 BATTERY_STATUS_TEXT = os.environ.get('BATTERY_STATUS_TEXT')
 
 POLL_INTERVAL = float(os.environ.get('POLL_INTERVAL', '2.0'))
+# Fastest rate is POLL_INTERVAL; backs off towards POLL_MAX_INTERVAL when idle
+_scheduler = AdaptiveScheduler(min_interval=POLL_INTERVAL)
 
 # --------------------- Runtime state ---------------------
 _client = None
@@ -80,8 +67,17 @@ _last_panel_voltage = None
 _last_read_time = 0
 _last_values = {}
 _stop_flag = threading.Event()
+# Preallocated columnar history of every poll (queried via /query)
+_history = telemetry_window.TelemetryWindow()
 
 # --------------------- Modbus functions ---------------------
+def _gateway_client():
+    """Return the shared modbus_gateway client when the gateway daemon is running."""
+    try:
+        return modbus_gateway.get_client() if modbus_gateway else None
+    except Exception:
+        return None
+
 def connect_modbus():
     global _client
     if ModbusClient is None:
@@ -97,9 +93,12 @@ def connect_modbus():
             pass
         return None
 
-def read_panel_voltage_from_device():
-    """Read configured Modbus registers and return a float (or None)."""
+def read_block(addr, count):
+    """Read `count` raw registers starting at `addr` (gateway or direct RTU)."""
     global _client
+    gw = _gateway_client()
+    if gw is not None:
+        return gw.read_registers(addr, count)
     if ModbusClient is None:
         return None
     if _client is None:
@@ -107,49 +106,14 @@ def read_panel_voltage_from_device():
         if _client is None:
             return None
     try:
-        rr = _client.read_input_registers(address=REGISTER_ADDR, count=REGISTER_COUNT, unit=MODBUS_UNIT)
+        rr = _client.read_input_registers(address=addr, count=count, unit=MODBUS_UNIT)
         if getattr(rr, 'isError', lambda: True)():
-            rr = _client.read_holding_registers(address=REGISTER_ADDR, count=REGISTER_COUNT, unit=MODBUS_UNIT)
+            rr = _client.read_holding_registers(address=addr, count=count, unit=MODBUS_UNIT)
             if getattr(rr, 'isError', lambda: True)():
                 return None
-        if not hasattr(rr, 'registers') or not rr.registers:
+        if not hasattr(rr, 'registers') or len(rr.registers) < count:
             return None
-        raw = rr.registers[0]
-        if raw >= 0x8000:
-            raw = raw - 0x10000
-        return float(raw) / SCALE
-    except Exception:
-        try:
-            _client.close()
-        except Exception:
-            pass
-        _client = None
-        return None
-
-def read_register_scaled(addr, scale):
-    """Generic helper to read a single register and scale it."""
-    global _client
-    if addr is None:
-        return None
-    if _client is None:
-        _client = connect_modbus()
-        if _client is None:
-            return None
-    try:
-        rr = _client.read_input_registers(address=addr, count=1, unit=MODBUS_UNIT)
-        if getattr(rr, 'isError', lambda: True)():
-            rr = _client.read_holding_registers(address=addr, count=1, unit=MODBUS_UNIT)
-            if getattr(rr, 'isError', lambda: True)():
-                return None
-        if not hasattr(rr, 'registers') or not rr.registers:
-            return None
-        raw = rr.registers[0]
-        if raw >= 0x8000:
-            raw = raw - 0x10000
-        val = float(raw)
-        if scale not in (None, 0):
-            val = val / float(scale)
-        return val
+        return rr.registers
     except Exception:
         try:
             _client.close()
@@ -162,61 +126,27 @@ def poll_loop():
     global _last_panel_voltage, _last_read_time, _last_values
     while not _stop_flag.is_set():
         try:
-            updated = False
-            panel_v = read_panel_voltage_from_device()
-            if panel_v is None:
-                panel_v = read_register_scaled(PANEL_V_ADDR, PANEL_V_SCALE)
-            if panel_v is not None:
-                _last_panel_voltage = panel_v
-                _last_values['panel_v'] = panel_v
-                updated = True
-
-            panel_a = read_register_scaled(PANEL_A_ADDR, PANEL_A_SCALE)
-            if panel_a is not None:
-                _last_values['panel_a'] = panel_a
-                updated = True
-
-            panel_w = read_register_scaled(PANEL_W_ADDR, PANEL_W_SCALE)
-            if panel_w is not None:
-                _last_values['panel_w'] = panel_w
-                updated = True
-
-            soc = read_register_scaled(BATTERY_SOC_ADDR, BATTERY_SOC_SCALE)
-            if soc is not None:
-                _last_values['battery_soc'] = soc
-                updated = True
-
-            batt_v = read_register_scaled(BATTERY_V_ADDR, BATTERY_V_SCALE)
-            if batt_v is not None:
-                _last_values['battery_v'] = batt_v
-                updated = True
-
-            batt_a = read_register_scaled(BATTERY_A_ADDR, BATTERY_A_SCALE)
-            if batt_a is not None:
-                _last_values['battery_a'] = batt_a
-                updated = True
-
-            batt_w = read_register_scaled(BATTERY_W_ADDR, BATTERY_W_SCALE)
-            if batt_w is not None:
-                _last_values['battery_w'] = batt_w
-                updated = True
-
-            batt_temp = read_register_scaled(BATTERY_TEMP_ADDR, BATTERY_TEMP_SCALE)
-            if batt_temp is not None:
-                _last_values['battery_temp_c'] = batt_temp
-                updated = True
-
+            values = REGISTER_MAP.read(read_block) if REGISTER_MAP is not None else {}
+            if 'battery_temp' in values:
+                values['battery_temp_c'] = values.pop('battery_temp')
+            _last_values.update(values)
+            if values.get('panel_v') is not None:
+                _last_panel_voltage = values['panel_v']
+            updated = bool(values)
             if updated:
                 _last_read_time = time.time()
+                _history.append(_last_values, _last_read_time)
+            _scheduler.observe(_last_values)
         except Exception:
             # Swallow exceptions to keep the loop alive
             pass
-        time.sleep(POLL_INTERVAL)
+        _scheduler.sleep(_stop_flag)
 
 # --------------------- Flask routes ---------------------
 @app.route('/sysinfo')
 def sysinfo():
     """Return JSON with panel output and uptime."""
+    _scheduler.note_demand()
     panel_v = _last_values.get('panel_v', _last_panel_voltage)
     battery_status_text = _last_values.get('battery_status_text') or BATTERY_STATUS_TEXT
     if not battery_status_text:
@@ -242,6 +172,23 @@ def sysinfo():
     }
     return jsonify(resp)
 
+@app.route('/query', methods=['GET', 'POST'])
+def query():
+    """Batch history queries with columnar results (see telemetry_window.py)."""
+    if request.method == 'POST':
+        body = request.get_json(force=True, silent=True)
+        queries = body.get('queries') if isinstance(body, dict) else body
+    else:
+        args = request.args
+        metrics = [m for m in (args.get('metric') or args.get('metrics') or '').split(',') if m]
+        queries = [{'metric': m, 'from': args.get('from'), 'to': args.get('to'),
+                    'agg': args.get('agg') or 'raw', 'step': args.get('step'),
+                    'window': args.get('window')} for m in metrics]
+    try:
+        return jsonify(telemetry_window.run_queries(_history, queries))
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/', defaults={'path': 'index.html'})
 @app.route('/<path:path>')
 def static_proxy(path):
@@ -278,6 +225,7 @@ def main():
                     'battery_temp_c': 23.0,
                 })
                 _last_read_time = time.time()
+                _history.append(_last_values, _last_read_time)
                 time.sleep(POLL_INTERVAL)
         t = threading.Thread(target=mock_loop, daemon=True)
         t.start()
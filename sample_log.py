@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Compact on-disk sample log for raw telemetry history.
+
+Samples (a timestamp plus a dict of numeric fields) are buffered in memory and
+appended to daily segment files as compressed blocks:
+
+    magic b'LIS1' | t_first_ms u64 | t_last_ms u64 | length u32 | crc32 u32 | zlib(payload)
+
+Inside a block, timestamps are stored delta-of-delta and every field is a
+column of fixed-point integers, also delta-of-delta, all as zigzag varints.
+Flat readings (night time, idle load) collapse to runs of zero bytes that zlib
+squeezes to almost nothing; noisy readings cost about one byte per value, so
+a day of 1 s data from the default map is ~130 KB steady and 400-700 KB with
+1-5 LSB of sensor noise.
+
+Readers seek over block headers outside the requested time range and decode
+one block at a time, so exports run in constant memory. A damaged or torn
+block is skipped by scanning ahead for the next magic, and the writer trims a
+torn tail off a segment before appending to it again:
+
+    log = SampleLog(source='mppt')
+    for ts, values in log.iter_rows(start, end):
+        ...
+
+Configure with SAMPLE_LOG_DIR (empty disables logging), SAMPLE_LOG_BLOCK,
+SAMPLE_LOG_FLUSH and SAMPLE_LOG_RETENTION_DAYS.
+"""
+import glob
+import itertools
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from env_config import env_float
+
+LOG_DIR = os.environ.get('SAMPLE_LOG_DIR', '/var/tmp/lowimpact-samples')
+BLOCK_SAMPLES = int(env_float('SAMPLE_LOG_BLOCK', 300))      # samples per block
+FLUSH_INTERVAL = env_float('SAMPLE_LOG_FLUSH', 60.0)         # max seconds buffered
+RETENTION_DAYS = env_float('SAMPLE_LOG_RETENTION_DAYS', 365.0)
+DECIMALS = 3  # fixed-point precision stored per field
+HEADER_PEEK = 1000  # rows scanned for CSV column names
+
+MAGIC = b'LIS1'
+_HEADER = struct.Struct('<4sQQII')
+
+
+# --------------------- varint helpers ---------------------
+def _put_uvarint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _put_svarint(out, n):
+    _put_uvarint(out, (n << 1) if n >= 0 else ((-n) << 1) - 1)
+
+def _get_uvarint(buf, pos):
+    shift = 0
+    result = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+def _get_svarint(buf, pos):
+    n, pos = _get_uvarint(buf, pos)
+    return (n >> 1) if not (n & 1) else -((n + 1) >> 1), pos
+
+def _put_dod(out, ints):
+    """Encode a list of ints as first value, first delta, then delta-of-deltas."""
+    prev = prev_delta = 0
+    for i, v in enumerate(ints):
+        if i == 0:
+            _put_svarint(out, v)
+        else:
+            delta = v - prev
+            _put_svarint(out, delta if i == 1 else delta - prev_delta)
+            prev_delta = delta
+        prev = v
+
+def _get_dod(buf, pos, count):
+    ints = []
+    prev = prev_delta = 0
+    for i in range(count):
+        n, pos = _get_svarint(buf, pos)
+        if i == 0:
+            v = n
+        else:
+            delta = n if i == 1 else prev_delta + n
+            v = prev + delta
+            prev_delta = delta
+        ints.append(v)
+        prev = v
+    return ints, pos
+
+
+# --------------------- block codec ---------------------
+def encode_block(samples):
+    """Encode [(ts_seconds, {field: number|None}), ...] into one framed block."""
+    fields = sorted({k for _, vals in samples for k, v in vals.items()
+                     if isinstance(v, (int, float)) and not isinstance(v, bool)})
+    scale = 10 ** DECIMALS
+    out = bytearray()
+    _put_uvarint(out, len(samples))
+    _put_uvarint(out, len(fields))
+    _put_uvarint(out, DECIMALS)
+    for name in fields:
+        raw = name.encode('utf-8')
+        _put_uvarint(out, len(raw))
+        out += raw
+    ts_ms = [int(round(ts * 1000)) for ts, _ in samples]
+    _put_dod(out, ts_ms)
+    for name in fields:
+        present = bytearray((len(samples) + 7) // 8)
+        ints = []
+        for i, (_, vals) in enumerate(samples):
+            v = vals.get(name)
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and v == v:
+                present[i >> 3] |= 1 << (i & 7)
+                ints.append(int(round(v * scale)))
+        out += present
+        _put_uvarint(out, len(ints))
+        _put_dod(out, ints)
+    payload = zlib.compress(bytes(out), 6)
+    return _HEADER.pack(MAGIC, ts_ms[0], ts_ms[-1], len(payload), zlib.crc32(payload)) + payload
+
+def decode_block(payload):
+    """Decode a block payload into a list of (ts_seconds, {field: float})."""
+    buf = zlib.decompress(payload)
+    pos = 0
+    count, pos = _get_uvarint(buf, pos)
+    nfields, pos = _get_uvarint(buf, pos)
+    decimals, pos = _get_uvarint(buf, pos)
+    scale = float(10 ** decimals)
+    fields = []
+    for _ in range(nfields):
+        n, pos = _get_uvarint(buf, pos)
+        fields.append(buf[pos:pos + n].decode('utf-8'))
+        pos += n
+    ts_ms, pos = _get_dod(buf, pos, count)
+    rows = [(t / 1000.0, {}) for t in ts_ms]
+    nbytes = (count + 7) // 8
+    for name in fields:
+        present = buf[pos:pos + nbytes]
+        pos += nbytes
+        n, pos = _get_uvarint(buf, pos)
+        ints, pos = _get_dod(buf, pos, n)
+        it = iter(ints)
+        for i in range(count):
+            if present[i >> 3] & (1 << (i & 7)):
+                rows[i][1][name] = round(next(it) / scale, decimals)
+    return rows
+
+def _find_magic(f, pos, chunk=65536):
+    """Offset of the next MAGIC at or after `pos`, or None."""
+    while True:
+        f.seek(pos)
+        buf = f.read(chunk)
+        if len(buf) < len(MAGIC):
+            return None
+        i = buf.find(MAGIC)
+        if i >= 0:
+            return pos + i
+        pos += len(buf) - len(MAGIC) + 1
+
+def _scan_blocks(f, start_ms=None, end_ms=None):
+    """Yield (offset after block, payload) for each intact block overlapping [start, end].
+
+    Blocks outside the range are skipped by their header's length without
+    reading them. A bad magic or CRC (a torn write, followed by blocks
+    appended later) resyncs at the next MAGIC; the search restarts just past
+    the last header that was not verified, since its length may be wrong.
+    """
+    pos = 0
+    anchor = None   # start of the last block skipped unverified
+    while True:
+        f.seek(pos)
+        head = f.read(_HEADER.size)
+        if len(head) < _HEADER.size:
+            return
+        magic, t0, t1, length, crc = _HEADER.unpack(head)
+        if magic == MAGIC:
+            end = pos + _HEADER.size + length
+            if (start_ms is not None and t1 < start_ms) or (end_ms is not None and t0 > end_ms):
+                anchor, pos = pos, end
+                continue
+            payload = f.read(length)
+            if len(payload) == length and zlib.crc32(payload) == crc:
+                anchor, pos = None, end
+                yield end, payload
+                continue
+        pos = _find_magic(f, (pos if anchor is None else anchor) + 1)
+        anchor = None
+        if pos is None:
+            return
+
+def iter_blocks(path, start_ms=None, end_ms=None):
+    """Yield decoded rows for each intact block in a segment overlapping [start, end]."""
+    try:
+        f = open(path, 'rb')
+    except Exception:
+        return
+    with f:
+        for _end, payload in _scan_blocks(f, start_ms, end_ms):
+            yield decode_block(payload)
+
+def repair_segment(path):
+    """Truncate a torn block off the end of a segment; returns bytes removed."""
+    try:
+        with open(path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = 0
+            for end, _payload in _scan_blocks(f):
+                pass
+            if end < size:
+                f.truncate(end)
+            return size - end
+    except FileNotFoundError:
+        return 0
+
+
+# --------------------- log writer / reader ---------------------
+class SampleLog:
+    """Buffered, day-rotated sample log for one source (e.g. 'mppt', 'modbus')."""
+
+    def __init__(self, source='mppt', directory=LOG_DIR, block_samples=BLOCK_SAMPLES,
+                 flush_interval=FLUSH_INTERVAL, retention_days=RETENTION_DAYS):
+        self.source = source
+        self.directory = directory
+        self.block_samples = max(1, int(block_samples))
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._buf = []
+        self._buf_started = None
+        self._lock = threading.Lock()
+        self._last_prune_day = None
+        self._repaired = set()   # segments checked for a torn tail before appending
+
+    def enabled(self):
+        return bool(self.directory)
+
+    def _segment_path(self, ts):
+        day = time.strftime('%Y%m%d', time.gmtime(ts))
+        return os.path.join(self.directory, f"{self.source}-{day}.seg")
+
+    def segments(self):
+        if not self.directory:
+            return []
+        return sorted(glob.glob(os.path.join(self.directory, f"{self.source}-*.seg")))
+
+    def append(self, values, ts=None):
+        """Buffer one sample; writes a block when full or after flush_interval."""
+        if not self.directory or not values:
+            return
+        ts = time.time() if ts is None else float(ts)
+        with self._lock:
+            # never let one block straddle two daily segments
+            if self._buf and self._segment_path(self._buf[0][0]) != self._segment_path(ts):
+                self._flush_locked()
+            if not self._buf:
+                self._buf_started = time.monotonic()
+            self._buf.append((ts, dict(values)))
+            if (len(self._buf) >= self.block_samples
+                    or time.monotonic() - self._buf_started >= self.flush_interval):
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    close = flush
+
+    def _flush_locked(self):
+        if not self._buf:
+            return
+        samples, self._buf = self._buf, []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            block = encode_block(samples)
+            path = self._segment_path(samples[0][0])
+            if path not in self._repaired:
+                # a crash mid-write leaves a torn block; appending after it
+                # would bury the blocks that follow
+                repair_segment(path)
+                self._repaired.add(path)
+            try:
+                with open(path, 'ab') as f:
+                    f.write(block)
+            except Exception:
+                self._repaired.discard(path)
+                raise
+        except Exception:
+            pass
+        self._prune(samples[-1][0])
+
+    def _prune(self, now):
+        day = int(now // 86400)
+        if self._last_prune_day == day or not self.retention_days:
+            return
+        self._last_prune_day = day
+        cutoff = time.strftime('%Y%m%d', time.gmtime(now - self.retention_days * 86400))
+        for path in self.segments():
+            stamp = os.path.basename(path)[len(self.source) + 1:-4]
+            if stamp < cutoff:
+                try:
+                    os.unlink(path)
+                except Exception:
+                    pass
+
+    def iter_rows(self, start=None, end=None, fields=None):
+        """Yield (ts, values) in time order between start and end (unix seconds)."""
+        start_ms = int(start * 1000) if start is not None else None
+        end_ms = int(end * 1000) if end is not None else None
+        first_day = time.strftime('%Y%m%d', time.gmtime(start)) if start is not None else None
+        last_day = time.strftime('%Y%m%d', time.gmtime(end)) if end is not None else None
+        for path in self.segments():
+            stamp = os.path.basename(path)[len(self.source) + 1:-4]
+            if (first_day and stamp < first_day) or (last_day and stamp > last_day):
+                continue
+            for rows in iter_blocks(path, start_ms, end_ms):
+                for row in _filter_rows(rows, start, end, fields):
+                    yield row
+        # samples still buffered in this process
+        with self._lock:
+            pending = list(self._buf)
+        for row in _filter_rows(pending, start, end, fields):
+            yield row
+
+
+def _filter_rows(rows, start, end, fields):
+    for ts, vals in rows:
+        if (start is not None and ts < start) or (end is not None and ts > end):
+            continue
+        if fields:
+            vals = {k: vals[k] for k in fields if k in vals}
+        yield ts, vals
+
+
+def sources(directory=LOG_DIR):
+    """Names of the sources that have segments on disk."""
+    names = set()
+    for path in glob.glob(os.path.join(directory or '', '*-*.seg')):
+        names.add(os.path.basename(path).rsplit('-', 1)[0])
+    return sorted(names)
+
+
+# --------------------- export formats ---------------------
+def export_lines(rows, fmt='csv', fields=None):
+    """Turn an iterator of (ts, values) into CSV or NDJSON text lines.
+
+    CSV needs a fixed header; without explicit `fields` it is taken from the
+    union of keys in the first HEADER_PEEK rows (a bounded look-ahead).
+    """
+    if fmt == 'ndjson':
+        for ts, vals in rows:
+            rec = {'timestamp': ts}
+            rec.update(vals)
+            yield json.dumps(rec) + '\n'
+        return
+    rows = iter(rows)
+    head = list(itertools.islice(rows, HEADER_PEEK))
+    if not head:
+        return
+    header = list(fields) if fields else sorted({k for _, vals in head for k in vals})
+    yield ','.join(['timestamp'] + header) + '\n'
+    for ts, vals in itertools.chain(head, rows):
+        yield ','.join([repr(ts)] + ['' if vals.get(k) is None else repr(vals[k]) for k in header]) + '\n'
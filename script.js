@@ -180,6 +180,8 @@ document.addEventListener('DOMContentLoaded', function() {
   }
 
   // --- PAGE WEIGHT CALCULATOR ---
+  // The server measures the page and its stylesheets/scripts (see page_weight.py)
+  // and serves the totals as one small, cacheable manifest.
   async function updatePageWeight() {
     const weightEl = document.getElementById('page-weight');
     if (!weightEl) return;
@@ -191,36 +193,10 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     try {
-      // Get HTML size
-      const htmlSize = new Blob([document.documentElement.outerHTML]).size;
-      
-      // Get CSS size
-      let cssSize = 0;
-      const stylesheets = document.querySelectorAll('link[rel="stylesheet"]');
-      for (const link of stylesheets) {
-        try {
-          const response = await fetch(link.href);
-          const text = await response.text();
-          cssSize += new Blob([text]).size;
-        } catch (e) {
-          console.warn('Could not fetch CSS:', link.href);
-        }
-      }
-      
-      // Get JavaScript size
-      let jsSize = 0;
-      const scripts = document.querySelectorAll('script[src]');
-      for (const script of scripts) {
-        try {
-          const response = await fetch(script.src);
-          const text = await response.text();
-          jsSize += new Blob([text]).size;
-        } catch (e) {
-          console.warn('Could not fetch JS:', script.src);
-        }
-      }
-      
-      const totalSize = htmlSize + cssSize + jsSize;
+      const response = await fetch('/page-weight');
+      if (!response.ok) throw new Error('Page weight fetch failed');
+      const manifest = await response.json();
+      const totalSize = (manifest.total && manifest.total.raw) || 0;
       const sizeKB = (totalSize / 1024).toFixed(0);
       weightEl.textContent = sizeKB;
     } catch (error) {
@@ -1066,7 +1042,8 @@ document.addEventListener('DOMContentLoaded', function() {
   const lon = LOCATION.lon;
       const now = new Date();
       const dateStr = now.toISOString().slice(0, 10); // YYYY-MM-DD
-      const res = await fetch(`https://api.brightsky.dev/weather?lat=${lat}&lon=${lon}&date=${dateStr}`);
+      // served by serve_with_info.py's caching proxy for Bright Sky (api.brightsky.dev)
+      const res = await fetch(`/weather?lat=${lat}&lon=${lon}&date=${dateStr}`);
       if (!res.ok) throw new Error('Weather fetch failed');
       const data = await res.json();
 
@@ -1453,7 +1430,9 @@ document.addEventListener('DOMContentLoaded', function() {
   let currentActiveKey = null;
     if (!crossboxImage || !crossboxSVG || !crossboxSize) return;
 
-    const BASE_URL = 'assets/Color.jpg';
+    // ?w= lets the server send a resized WebP/AVIF variant (see image_variants.py)
+    const IMAGE_WIDTH_HINT = Math.round(Math.min(800, window.innerWidth || 800) * (window.devicePixelRatio || 1));
+    const BASE_URL = `assets/Color.jpg?w=${IMAGE_WIDTH_HINT}`;
   const cache = {}; // { color: {url, size}, bw: {url,size}, dithered: {url,size} }
   // map of exact URL (blob: or asset path) -> size in bytes
   const urlToSize = {};
@@ -1821,7 +1800,7 @@ document.addEventListener('DOMContentLoaded', function() {
       const solarSVG = document.getElementById('solar-svg');
       const solarSize = document.getElementById('solar-size');
       if (solarImage && solarSVG && solarSize) {
-        const SOLAR_BASE_URL = 'assets/test.jpg';
+        const SOLAR_BASE_URL = `assets/test.jpg?w=${Math.round(Math.min(700, window.innerWidth || 700) * (window.devicePixelRatio || 1))}`;
 
         const sNo = document.getElementById('solar-noimage');
         const sDith = document.getElementById('solar-dithered');
@@ -11,17 +11,26 @@ import json
 import os
 import sys
 import time
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
 from http.server import SimpleHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
 import multiprocessing
 import threading
 import glob
 import subprocess
 import shutil
 import plistlib
+import hmac
+import math
+import select
+import signal
 
-# cached value updated by background sampler
+from env_config import env_float, env_int
+
+# cached values updated by background sampler
 _cached_cpu_percent = 0.0
+_cached_proc_sample = {}
 _sampler_thread = None
 _stop_sampler = threading.Event()
 
@@ -35,62 +44,148 @@ try:
 except Exception:
     ModbusClient = None
 
+from adaptive_poll import AdaptiveScheduler
+import proc_sampler
+import image_variants
+import live_feed
+import rate_limit
+import page_weight
+import power_policy
+import register_map
+import sample_log
+import snapshot_publisher
+import stack_profiler
+import telemetry_window
+import weather_cache
+
+try:
+    import modbus_gateway
+except Exception:
+    modbus_gateway = None
+
 # By default bind to localhost for development. Override via environment
 # variables when running on a networked device (e.g. Raspberry Pi):
 #   SERVE_HOST=0.0.0.0 SERVE_PORT=8000 python3 serve_with_info.py
 HOST = os.environ.get('SERVE_HOST', '127.0.0.1')
-try:
-    PORT = int(os.environ.get('SERVE_PORT', '8000'))
-except Exception:
-    PORT = 8000
+PORT = env_int('SERVE_PORT', 8000)
 
 # --------- RS485 / Modbus Configuration ---------
 # When running on Raspberry Pi with RS485 hardware, set these environment variables:
-#   SERIAL_PORT=/dev/ttyUSB0 REGISTER_ADDR=0 SCALE=100 python3 serve_with_info.py
+#   SERIAL_PORT=/dev/ttyACM0 BAUDRATE=115200 python3 serve_with_info.py
+# Register addresses, types and scales come from one whole map: the file in
+# REGISTER_MAP if set, else one built from the legacy PANEL_V_ADDR /
+# BATTERY_*_ADDR variables if any are set, else register_map.json. The maps
+# are never merged field by field.
 SERIAL_PORT = os.environ.get('SERIAL_PORT')  # e.g. /dev/ttyUSB0 (None = disabled)
 BAUDRATE = int(os.environ.get('BAUDRATE', '9600'))
 MODBUS_UNIT = int(os.environ.get('MODBUS_UNIT', '1'))
-REGISTER_ADDR = int(os.environ.get('REGISTER_ADDR', '0'))
-REGISTER_COUNT = int(os.environ.get('REGISTER_COUNT', '1'))
-SCALE = float(os.environ.get('SCALE', '100.0'))
 
-# Optional additional Modbus addresses for panel and battery
-def _env_int(name, default=None):
-    try:
-        return int(os.environ.get(name)) if os.environ.get(name) is not None else default
-    except Exception:
-        return default
+try:
+    _register_map = register_map.load_default()
+except Exception as e:
+    sys.stderr.write('Could not load register map: %s\n' % e)
+    _register_map = None
 
-def _env_float(name, default=None):
-    try:
-        return float(os.environ.get(name)) if os.environ.get(name) is not None else default
-    except Exception:
-        return default
-
-PANEL_V_ADDR = _env_int('PANEL_V_ADDR', REGISTER_ADDR)
-PANEL_V_SCALE = _env_float('PANEL_V_SCALE', SCALE)
-PANEL_A_ADDR = _env_int('PANEL_A_ADDR', None)
-PANEL_A_SCALE = _env_float('PANEL_A_SCALE', 100.0)
-PANEL_W_ADDR = _env_int('PANEL_W_ADDR', None)
-PANEL_W_SCALE = _env_float('PANEL_W_SCALE', 100.0)
-
-BATTERY_SOC_ADDR = _env_int('BATTERY_SOC_ADDR', None)
-BATTERY_SOC_SCALE = _env_float('BATTERY_SOC_SCALE', 10.0)
-BATTERY_V_ADDR = _env_int('BATTERY_V_ADDR', None)
-BATTERY_V_SCALE = _env_float('BATTERY_V_SCALE', 10.0)
-BATTERY_A_ADDR = _env_int('BATTERY_A_ADDR', None)
-BATTERY_A_SCALE = _env_float('BATTERY_A_SCALE', 100.0)
-BATTERY_W_ADDR = _env_int('BATTERY_W_ADDR', None)
-BATTERY_W_SCALE = _env_float('BATTERY_W_SCALE', 10.0)
-BATTERY_TEMP_ADDR = _env_int('BATTERY_TEMP_ADDR', None)
-BATTERY_TEMP_SCALE = _env_float('BATTERY_TEMP_SCALE', 10.0)
+# Seconds between background CPU/memory samples
+SAMPLER_INTERVAL = env_float('SAMPLER_INTERVAL', 1.0)
+
+# --------- Self-profiling ---------
+# /debug/profile?seconds=30&format=collapsed|speedscope is only enabled when
+# DEBUG_TOKEN is set (pass it as ?token= or an X-Debug-Token header).
+# `kill -USR1 <pid>` toggles a profile that is written to PROFILE_DIR.
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/lowimpact-profiles')
+PROFILE_MAX_SECONDS = env_float('PROFILE_MAX_SECONDS', 120.0)
+_profiler = None
+_profiler_lock = threading.Lock()
+
+# --------- HTTP server limits ---------
+# A bounded pool keeps slow or stalled clients from pinning unbounded threads;
+# connections beyond workers + queue are shed immediately with a 503.
+MAX_WORKERS = env_int('SERVE_MAX_WORKERS', 8)
+MAX_QUEUE = env_int('SERVE_MAX_QUEUE', 16)          # accepted connections waiting for a worker
+READ_TIMEOUT = env_float('SERVE_READ_TIMEOUT', 10.0)   # seconds to receive a request
+WRITE_TIMEOUT = env_float('SERVE_WRITE_TIMEOUT', 15.0) # seconds per blocked send
+RETRY_AFTER = env_int('SERVE_RETRY_AFTER', 2)
+MAX_BODY = env_int('SERVE_MAX_BODY', 64 * 1024)
+# HTTP/1.1 persistent connections: idle sockets are reaped after this many
+# seconds, and each connection serves at most KEEPALIVE_MAX requests. An idle
+# connection is checked every KEEPALIVE_POLL seconds and closed early as soon
+# as other connections are queued, so idle clients never hold workers hostage.
+KEEPALIVE_TIMEOUT = env_float('SERVE_KEEPALIVE_TIMEOUT', 5.0)
+KEEPALIVE_POLL = env_float('SERVE_KEEPALIVE_POLL', 0.1)
+KEEPALIVE_MAX = env_int('SERVE_KEEPALIVE_MAX', 100)
+
+# Per-client token buckets for the API routes (see rate_limit.py); RATE_LIMIT=0 disables
+_limiter = rate_limit.RateLimiter() if rate_limit.ENABLED else None
+# Dynamic routes: matched exactly (sub-paths fall through to static files and
+# 404) by the same lookup that applies the rate limit, so they cannot diverge
+API_ROUTES = ('/sysinfo', '/query', '/export', '/weather', '/page-weight', '/live',
+              '/debug/profile')
+
+def _api_route(target):
+    """API route named by a request target ('/sysinfo?x=1' -> '/sysinfo'), or None."""
+    path = target.split('?', 1)[0].split('#', 1)[0]
+    return path if path in API_ROUTES else None
 
 # Runtime state for Modbus
 _modbus_client = None
 _last_modbus_values = {}
 _modbus_lock = threading.Lock()
+_last_modbus_poll = 0.0
+# Requests only trigger a bus poll when the adaptive interval has elapsed
+_poll_scheduler = AdaptiveScheduler()
+# History of polled Modbus values (exported at /export?source=modbus)
+_sample_log = sample_log.SampleLog(source='modbus')
+# Recent in-memory history, one ring per source, queried via /query
+_history = telemetry_window.TelemetryHistory(sources=('system', 'mppt', 'modbus'))
+_mppt_file_mtime = None
+
+# System metrics recorded into _history by the background sampler
+HISTORY_SYSTEM_FIELDS = ('cpu_percent', 'cpu_iowait', 'cpu_steal', 'memory_percent',
+                         'memory_used', 'server_rss', 'server_cpu_percent')
+# MPPT fields broadcast on the /live 'mppt' topic (mppt_reader.py key names)
+LIVE_MPPT_FIELDS = ('panel_voltage', 'panel_current', 'panel_power', 'battery_voltage',
+                    'battery_soc', 'battery_temperature', 'load_voltage', 'load_current',
+                    'load_power')
+# register map field -> LIVE_MPPT_FIELDS name for directly polled Modbus values
+_MODBUS_LIVE_KEYS = {'panel_v': 'panel_voltage', 'panel_a': 'panel_current', 'panel_w': 'panel_power',
+                     'battery_v': 'battery_voltage', 'battery_soc': 'battery_soc',
+                     'battery_temp': 'battery_temperature', 'load_v': 'load_voltage',
+                     'load_a': 'load_current'}
+# MPPT_IN_PROCESS=1: run the MPPT poller (mppt_reader.MpptPoller) inside this
+# server instead of the separate mppt-reader service and /tmp/mppt_data.json
+MPPT_IN_PROCESS = os.environ.get('MPPT_IN_PROCESS', '') not in ('', '0')
+# /tmp/mppt_data.json younger than this means mppt_reader.py is running
+MPPT_FILE_FRESH = env_float('MPPT_FILE_FRESH', 90.0)
+_mppt_poller = None
+_mppt_latest = None
+# Low-power mode: battery SOC picks a runtime profile (see power_policy.py)
+_power = power_policy.PowerPolicy()
+_poll_base_interval = {}    # scheduler -> its normal min_interval
+_sysinfo_cache = (0.0, None)
+_lite_pages = {}            # path -> (mtime, body) with heavy scripts stripped
+# Dropped from HTML pages in low-power mode (not needed to read the site)
+LITE_STRIP = ('<script src="assets/html2canvas.min.js"></script>',)
+# Resized WebP/AVIF/JPEG variants of the assets/ photos (needs Pillow)
+_images = image_variants.ImageVariants()
+IMAGE_MAX_AGE = env_int('IMAGE_MAX_AGE', 86400)
+# /page-weight: asset sizes measured once on the server, not refetched by every visitor
+_page_weight = page_weight.PageWeight()
+PAGE_WEIGHT_MAX_AGE = env_int('PAGE_WEIGHT_MAX_AGE', 300)
+# /weather: one upstream Bright Sky fetch per query and TTL serves every visitor
+_weather = weather_cache.WeatherCache()
+# WebSocket subscribers (kiosks, home automation) fed one binary frame per sample
+_live_hub = live_feed.LiveHub({'system': HISTORY_SYSTEM_FIELDS, 'mppt': LIVE_MPPT_FIELDS})
 
 # --------- Modbus Helper Functions ---------
+def _gateway_client():
+    """Return the shared modbus_gateway client when the gateway daemon is running."""
+    try:
+        return modbus_gateway.get_client() if modbus_gateway else None
+    except Exception:
+        return None
+
 def _connect_modbus():
     """Establish Modbus RTU connection if configured."""
     global _modbus_client
@@ -104,32 +199,27 @@ def _connect_modbus():
         pass
     return None
 
-def _read_register_scaled(addr, scale):
-    """Read a single Modbus register and apply scaling."""
+def _read_block(addr, count):
+    """Read `count` raw registers starting at `addr` (gateway or direct RTU)."""
     global _modbus_client
-    if addr is None:
-        return None
+    gw = _gateway_client()
+    if gw is not None:
+        # The gateway owns the serial port; never open it ourselves
+        return gw.read_registers(addr, count)
     try:
         if _modbus_client is None:
             _modbus_client = _connect_modbus()
         if _modbus_client is None:
             return None
         # Try input registers first, then holding registers
-        rr = _modbus_client.read_input_registers(address=addr, count=1, unit=MODBUS_UNIT)
+        rr = _modbus_client.read_input_registers(address=addr, count=count, unit=MODBUS_UNIT)
         if getattr(rr, 'isError', lambda: True)():
-            rr = _modbus_client.read_holding_registers(address=addr, count=1, unit=MODBUS_UNIT)
+            rr = _modbus_client.read_holding_registers(address=addr, count=count, unit=MODBUS_UNIT)
             if getattr(rr, 'isError', lambda: True)():
                 return None
-        if not hasattr(rr, 'registers') or not rr.registers:
+        if not hasattr(rr, 'registers') or len(rr.registers) < count:
             return None
-        raw = rr.registers[0]
-        # Handle signed integers (two's complement for 16-bit)
-        if raw >= 0x8000:
-            raw = raw - 0x10000
-        val = float(raw)
-        if scale not in (None, 0):
-            val = val / float(scale)
-        return val
+        return rr.registers
     except Exception:
         try:
             if _modbus_client:
@@ -140,51 +230,256 @@ def _read_register_scaled(addr, scale):
         return None
 
 def _poll_modbus_once():
-    """Poll all configured Modbus registers once."""
-    global _last_modbus_values
-    if not SERIAL_PORT or ModbusClient is None:
+    """Poll all configured Modbus registers once (rate-limited by the adaptive scheduler)."""
+    global _last_modbus_values, _last_modbus_poll
+    if _register_map is None or _mppt_poller is not None:
+        # the in-process MPPT poller owns the bus; its samples arrive via _on_mppt_sample
+        return
+    if _gateway_client() is None and (not SERIAL_PORT or ModbusClient is None or _mppt_file_fresh()):
+        # no gateway to share the port through, and mppt_reader.py owns it
         return
     try:
         with _modbus_lock:
-            panel_v = _read_register_scaled(PANEL_V_ADDR, PANEL_V_SCALE)
-            if panel_v is not None:
-                _last_modbus_values['panel_v'] = round(panel_v, 2)
-            panel_a = _read_register_scaled(PANEL_A_ADDR, PANEL_A_SCALE)
-            if panel_a is not None:
-                _last_modbus_values['panel_a'] = round(panel_a, 2)
-            panel_w = _read_register_scaled(PANEL_W_ADDR, PANEL_W_SCALE)
-            if panel_w is not None:
-                _last_modbus_values['panel_w'] = round(panel_w, 2)
-            battery_soc = _read_register_scaled(BATTERY_SOC_ADDR, BATTERY_SOC_SCALE)
-            if battery_soc is not None:
-                _last_modbus_values['battery_soc'] = round(battery_soc, 1)
-            battery_v = _read_register_scaled(BATTERY_V_ADDR, BATTERY_V_SCALE)
-            if battery_v is not None:
-                _last_modbus_values['battery_v'] = round(battery_v, 2)
-            battery_a = _read_register_scaled(BATTERY_A_ADDR, BATTERY_A_SCALE)
-            if battery_a is not None:
-                _last_modbus_values['battery_a'] = round(battery_a, 2)
-            battery_w = _read_register_scaled(BATTERY_W_ADDR, BATTERY_W_SCALE)
-            if battery_w is not None:
-                _last_modbus_values['battery_w'] = round(battery_w, 2)
-            battery_temp = _read_register_scaled(BATTERY_TEMP_ADDR, BATTERY_TEMP_SCALE)
-            if battery_temp is not None:
-                _last_modbus_values['battery_temp'] = round(battery_temp, 1)
+            now = time.monotonic()
+            if now - _last_modbus_poll < _poll_scheduler.next_interval():
+                return
+            _last_modbus_poll = now
+            # one block read + one struct unpack per register group
+            _last_modbus_values.update(_register_map.read(_read_block))
+            _poll_scheduler.observe(_last_modbus_values)
+            _sample_log.append(_last_modbus_values)
+            _history.append('modbus', _last_modbus_values)
+            _publish_modbus(_last_modbus_values)
+            _note_soc(_last_modbus_values)
+    except Exception:
+        pass
+
+def _modbus_configured():
+    """True if this process may poll the bus directly (gateway or serial port)."""
+    if _register_map is None or _mppt_poller is not None:
+        return False
+    if modbus_gateway is not None and os.path.exists(modbus_gateway.SOCKET_PATH):
+        return True
+    return bool(SERIAL_PORT) and ModbusClient is not None
+
+def _mppt_file_fresh():
+    """True while mppt_reader.py keeps /tmp/mppt_data.json current (it rewrites
+    unchanged data every MPPT_OUTPUT_HEARTBEAT, 30 s by default)."""
+    try:
+        return time.time() - os.stat('/tmp/mppt_data.json').st_mtime < MPPT_FILE_FRESH
+    except OSError:
+        return False
+
+def _note_demand():
+    """A client is watching: poll at the fast rate (both pollers)."""
+    _poll_scheduler.note_demand()
+    if _mppt_poller is not None:
+        _mppt_poller.scheduler.note_demand()
+
+def _modbus_poll_loop():
+    """Poll the bus on the scheduler's clock rather than on /sysinfo requests,
+    so /live subscribers and the sample log get data when nobody polls."""
+    while not _stop_sampler.is_set():
+        _poll_modbus_once()
+        _poll_scheduler.sleep(_stop_sampler)
+
+def _note_live_demand():
+    # an open /live socket counts as demand, like a /sysinfo request
+    if _live_hub.subscribers():
+        _note_demand()
+
+def _publish_modbus(values):
+    """Broadcast polled Modbus values on the /live 'mppt' topic."""
+    if not _live_hub.subscribers():
+        return
+    live = {_MODBUS_LIVE_KEYS[k]: v for k, v in values.items() if k in _MODBUS_LIVE_KEYS}
+    if 'load_power' not in live and live.get('load_voltage') is not None and live.get('load_current') is not None:
+        live['load_power'] = round(live['load_voltage'] * live['load_current'], 2)
+    _live_hub.publish('mppt', live)
+
+def _apply_power_profile(level, profile):
+    """Slow the pollers down (or back up) for a new power level."""
+    schedulers = [_poll_scheduler] + ([_mppt_poller.scheduler] if _mppt_poller is not None else [])
+    for sched in schedulers:
+        base = _poll_base_interval.setdefault(sched, sched.min_interval)
+        sched.min_interval = base * profile['slowdown']
+        sched.max_interval = max(sched.max_interval, sched.min_interval)
+        sched.interval = max(sched.interval, sched.min_interval)
+    sys.stderr.write('[power] %s mode (battery %s%%)\n' % (level, _power.soc))
+
+_power.on_change(_apply_power_profile)
+
+def _note_soc(values):
+    if values and values.get('battery_soc') is not None:
+        _power.update(values['battery_soc'])
+
+def _on_mppt_sample(data):
+    """Sink for the in-process MPPT poller: no file, no IPC."""
+    global _mppt_latest
+    _mppt_latest = data
+    _note_soc(data)
+    _history.append('mppt', {k: v for k, v in data.items() if k != 'timestamp'}, data.get('timestamp'))
+    _live_hub.publish('mppt', data, data.get('timestamp'))
+
+def _start_mppt_poller():
+    global _mppt_poller
+    import mppt_reader
+    try:
+        _mppt_poller = mppt_reader.MpptPoller(sinks=[mppt_reader.CallbackSink(_on_mppt_sample)]).start()
+        print("MPPT poller running in-process")
+    except Exception as e:
+        _mppt_poller = None
+        sys.stderr.write('Could not start in-process MPPT poller: %s\n' % e)
+
+def _read_mppt_data():
+    """Latest MPPT sample: from the in-process poller, else /tmp/mppt_data.json."""
+    if _mppt_poller is not None:
+        return _mppt_latest
+    if os.path.exists('/tmp/mppt_data.json'):
+        with open('/tmp/mppt_data.json', 'r') as f:
+            return json.load(f)
+    return None
+
+def _record_mppt_file():
+    """Add a new /tmp/mppt_data.json sample (from mppt_reader.py) to _history."""
+    global _mppt_file_mtime
+    if _mppt_poller is not None:
+        return
+    try:
+        mtime = os.stat('/tmp/mppt_data.json').st_mtime
+        if mtime == _mppt_file_mtime:
+            return
+        _mppt_file_mtime = mtime
+        with open('/tmp/mppt_data.json', 'r') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            _history.append('mppt', {k: v for k, v in data.items() if k != 'timestamp'}, data.get('timestamp'))
+            _live_hub.publish('mppt', data, data.get('timestamp'))
+            _note_soc(data)
     except Exception:
         pass
 
 class Handler(SimpleHTTPRequestHandler):
+    # Persistent connections; every response must carry Content-Length
+    # (or chunked encoding) so the client/proxy knows where it ends.
+    protocol_version = 'HTTP/1.1'
+    # applied to the socket in setup(); tightened/loosened per phase below
+    timeout = READ_TIMEOUT
+
+    def setup(self):
+        super().setup()
+        self._requests_served = 0
+        self._rate_key = None
+        self._route = None
+
+    def log_error(self, format, *args):
+        # reaping an idle keep-alive connection is routine, not an error
+        if self._requests_served and format.startswith('Request timed out'):
+            return
+        return super().log_error(format, *args)
+
     def log_message(self, format, *args):
         # keep logs concise
         sys.stderr.write("%s - - [%s] %s\n" % (self.client_address[0], self.log_date_time_string(), format%args))
 
+    def handle_one_request(self):
+        # Waiting for a follow-up request on a kept-alive connection is bounded
+        # by the idle timeout and gives up early when the pool is needed; once
+        # a request starts arriving it gets the normal read timeout.
+        if self._requests_served and not self._await_next_request():
+            self.close_connection = True
+            return
+        try:
+            self.connection.settimeout(READ_TIMEOUT)
+        except Exception:
+            pass
+        try:
+            super().handle_one_request()
+        except (TimeoutError, OSError):
+            # idle keep-alive connection reaped (or client went away)
+            self.close_connection = True
+            return
+        finally:
+            if self._rate_key is not None:
+                _limiter.release(self._rate_key)
+                self._rate_key = None
+        self._requests_served += 1
+        if self._requests_served >= KEEPALIVE_MAX or self.server.saturated():
+            # free this worker for queued connections
+            self.close_connection = True
+
+    def _await_next_request(self):
+        """True once the next request is readable; False if the connection
+        stayed idle for KEEPALIVE_TIMEOUT or other connections are queued."""
+        try:
+            # a pipelined request may already sit in the read buffer
+            self.connection.settimeout(0)
+            try:
+                if self.rfile.peek(1):
+                    return True
+            finally:
+                self.connection.settimeout(READ_TIMEOUT)
+            deadline = time.monotonic() + KEEPALIVE_TIMEOUT
+            self.server.note_idle(1)
+            try:
+                while not self.server.saturated():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    ready, _, _ = select.select([self.connection], [], [], min(KEEPALIVE_POLL, remaining))
+                    if ready:
+                        return True
+            finally:
+                self.server.note_idle(-1)
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY:
+            self.send_error(413 if length > 0 else 400, 'Request body too large or invalid')
+            return False
+        # Headers are in; the rest of the exchange is bounded by the write timeout
+        try:
+            self.connection.settimeout(WRITE_TIMEOUT)
+        except Exception:
+            pass
+        self._route = _api_route(self.path)
+        if _limiter is not None and self.command in ('GET', 'POST') and self._route is not None:
+            key = _limiter.client_key(self.client_address[0], self.headers)
+            allowed, retry_after = _limiter.acquire(key)
+            if not allowed:
+                self.send_rate_limited(retry_after, length)
+                return False
+            self._rate_key = key
+        return True
+
+    def send_rate_limited(self, retry_after, body_length):
+        body = b'rate limited\n'
+        self.send_response(429)
+        self.send_header('Retry-After', str(max(1, int(math.ceil(retry_after)))))
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        if body_length:
+            # the unread request body would desync a kept-alive connection
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
     def end_headers(self):
         # Add CORS header to allow cross-origin requests to /sysinfo
         try:
             allow_origin = os.environ.get('SERVE_ALLOW_ORIGIN', '*')
             # set permissive CORS by default for convenience; can be restricted
             self.send_header('Access-Control-Allow-Origin', allow_origin)
-            self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         except Exception:
             pass
@@ -196,45 +491,384 @@ class Handler(SimpleHTTPRequestHandler):
             allow_origin = os.environ.get('SERVE_ALLOW_ORIGIN', '*')
             self.send_response(200)
             self.send_header('Access-Control-Allow-Origin', allow_origin)
-            self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+            self.send_header('Content-Length', '0')
             self.end_headers()
         except Exception:
             try:
                 self.send_response(200)
+                self.send_header('Content-Length', '0')
                 self.end_headers()
             except Exception:
                 pass
 
     def do_GET(self):
-        if self.path.startswith('/sysinfo'):
+        route = self._route
+        if route == '/sysinfo':
             try:
                 # Log each /sysinfo request with client IP and timestamp
                 ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
                 sys.stderr.write(f"[sysinfo] {ts} request from {self.client_address[0]}\n")
             except Exception:
                 pass
-            info = self.get_sysinfo()
+            _note_demand()
+            info = self.cached_sysinfo()
+            ttl = _power.profile['sysinfo_ttl']
             body = json.dumps(info).encode('utf-8')
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(body)))
+            if ttl:
+                # low-power mode: let browsers and proxies reuse the snapshot
+                self.send_header('Cache-Control', 'public, max-age=%d' % ttl)
+            else:
+                self.send_header('Cache-Control', 'no-store')
             self.end_headers()
             self.wfile.write(body)
             return
+        if route == '/export':
+            return self.send_export()
+        if route == '/debug/profile':
+            return self.send_profile()
+        if route == '/live':
+            return self.upgrade_live()
+        if route == '/weather':
+            return self.send_weather()
+        if route == '/page-weight':
+            return self.send_page_weight()
+        if route == '/query':
+            # GET convenience form: /query?metric=a,b&from=-3600&agg=avg&step=60
+            qs = parse_qs(urlparse(self.path).query)
+            first = lambda k: qs.get(k, [None])[0]
+            metrics = [m for m in (first('metric') or first('metrics') or '').split(',') if m]
+            queries = [{'metric': m, 'from': first('from'), 'to': first('to'),
+                        'agg': first('agg') or 'raw', 'step': first('step'),
+                        'window': first('window')} for m in metrics]
+            return self.send_query(queries)
+        if _images.enabled() and self.send_image_variant():
+            return
+        if _power.profile['lite'] and self.send_lite_page():
+            return
         # fallback to normal static file serving
         return super().do_GET()
 
-    def get_sysinfo(self):
+    def send_image_variant(self):
+        """Best derivative of an assets/ photo for this client (?w= width hint, ?q= tier)."""
+        parsed = urlparse(self.path)
+        if not parsed.path.startswith('/assets/') or not parsed.path.lower().endswith(image_variants.SOURCE_EXTS):
+            return False
+        qs = parse_qs(parsed.query)
+        try:
+            hint = qs.get('w', [None])[0] or self.headers.get('Sec-CH-Width') or self.headers.get('Width')
+            hint = int(float(hint)) if hint else None
+        except ValueError:
+            hint = None
+        tier = qs.get('q', [None])[0]
+        if tier is None:
+            save_data = self.headers.get('Save-Data', '').lower() == 'on'
+            tier = 'low' if save_data or _power.profile['lite'] else 'normal'
+        picked = _images.negotiate(self.translate_path(parsed.path), self.headers.get('Accept'), hint, tier)
+        if picked is None:
+            return False
+        path, ctype = picked
+        etag = '"%s"' % os.path.basename(path)
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept, Save-Data, Sec-CH-Width, Width')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return False   # evicted meanwhile: send the original
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        # shared caches must key on what was negotiated
+        self.send_header('Vary', 'Accept, Save-Data, Sec-CH-Width, Width')
+        self.send_header('Cache-Control', 'public, max-age=%d' % IMAGE_MAX_AGE)
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def send_lite_page(self):
+        """Low-power mode: HTML pages without the LITE_STRIP scripts."""
+        path = urlparse(self.path).path
+        if path.endswith('/'):
+            path += 'index.html'
+        if not path.endswith('.html'):
+            return False
+        fs_path = self.translate_path(path)
+        try:
+            mtime = os.stat(fs_path).st_mtime
+            cached = _lite_pages.get(fs_path)
+            if cached is None or cached[0] != mtime:
+                with open(fs_path, 'rb') as f:
+                    html = f.read().decode('utf-8')
+                for snippet in LITE_STRIP:
+                    html = html.replace(snippet, '')
+                cached = _lite_pages[fs_path] = (mtime, html.encode('utf-8'))
+        except (OSError, UnicodeDecodeError):
+            return False
+        body = cached[1]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        # the full page comes back once the battery recovers
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def do_POST(self):
+        # always drain the body so a kept-alive connection stays in sync
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length > 0 else b''
+        except Exception:
+            self.send_error(400, 'Could not read request body')
+            return
+        if self._route == '/query':
+            try:
+                body = json.loads(raw.decode('utf-8') or '{}')
+                queries = body.get('queries') if isinstance(body, dict) else body
+            except Exception:
+                self.send_error(400, 'Body must be JSON')
+                return
+            return self.send_query(queries)
+        self.send_error(404)
+
+    def send_query(self, queries):
+        """Answer a batch of history queries with columnar t/v arrays."""
+        try:
+            result = telemetry_window.run_queries(_history, queries)
+        except (ValueError, TypeError) as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps(result, separators=(',', ':')).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_page_weight(self):
+        """Sizes (raw/gzip/br) and hashes of the page and its CSS/JS, rebuilt on change."""
+        try:
+            manifest = _page_weight.get()
+        except OSError:
+            self.send_error(404)
+            return
+        etag = '"%s"' % manifest['etag']
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'public, max-age=%d' % PAGE_WEIGHT_MAX_AGE)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_weather(self):
+        """Bright Sky /weather through the server-side cache: /weather?lat=&lon=&date="""
+        try:
+            body, state, age = _weather.get(parse_qs(urlparse(self.path).query))
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        except weather_cache.UpstreamError as e:
+            self.send_error(e.status, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'public, max-age=%d' % max(0, _weather.ttl - age))
+        self.send_header('Age', str(int(age)))
+        self.send_header('X-Cache', state.upper())
+        self.end_headers()
+        self.wfile.write(body)
+
+    def upgrade_live(self):
+        """Hand a WebSocket connection over to the live feed: /live?topics=system,mppt"""
+        key = self.headers.get('Sec-WebSocket-Key')
+        if (self.headers.get('Upgrade', '').lower() != 'websocket' or not key
+                or 'upgrade' not in self.headers.get('Connection', '').lower()):
+            self.send_error(400, 'Expected a WebSocket upgrade')
+            return
+        if self.headers.get('Sec-WebSocket-Version') != '13':
+            self.send_response(426)
+            self.send_header('Sec-WebSocket-Version', '13')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            qs = parse_qs(urlparse(self.path).query)
+            topics = _live_hub.parse_topics(qs.get('topics', [''])[0].split(','))
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        if _live_hub.full():
+            self.send_response(503)
+            self.send_header('Retry-After', str(RETRY_AFTER))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', live_feed.accept_key(key))
+        self.end_headers()
+        # the hub owns the socket from here on; this worker goes back to the pool
+        self.close_connection = True
+        if _live_hub.add(self.connection, self.client_address, topics):
+            self.server.detach(self.request)
+            _note_demand()
+
+    def send_profile(self):
+        """Run the sampling profiler for ?seconds= and return the result."""
+        global _profiler
+        qs = parse_qs(urlparse(self.path).query)
+        token = qs.get('token', [None])[0] or self.headers.get('X-Debug-Token') or ''
+        if not DEBUG_TOKEN or not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+            self.send_error(404)
+            return
+        try:
+            seconds = min(PROFILE_MAX_SECONDS, max(0.1, float(qs.get('seconds', ['10'])[0])))
+            fmt = qs.get('format', ['collapsed'])[0]
+            if fmt not in ('collapsed', 'speedscope'):
+                raise ValueError('format must be collapsed or speedscope')
+        except Exception as e:
+            self.send_error(400, str(e))
+            return
+        with _profiler_lock:
+            if _profiler is not None and _profiler.running:
+                self.send_error(409, 'A profile is already running')
+                return
+            prof = _profiler = stack_profiler.StackProfiler().start()
+        time.sleep(seconds)
+        prof.stop()
+        if fmt == 'speedscope':
+            body = json.dumps(prof.speedscope()).encode('utf-8')
+            ctype = 'application/json'
+        else:
+            body = prof.collapsed().encode('utf-8')
+            ctype = 'text/plain; charset=utf-8'
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_export(self):
+        """Stream logged samples: /export?from=&to=&format=csv|ndjson&source=&fields="""
+        def _parse_time(val):
+            if not val:
+                return None
+            try:
+                return float(val)
+            except ValueError:
+                return datetime.fromisoformat(val).timestamp()
+
+        try:
+            qs = parse_qs(urlparse(self.path).query)
+            start = _parse_time(qs.get('from', [None])[0])
+            end = _parse_time(qs.get('to', [None])[0])
+            fmt = qs.get('format', ['csv'])[0]
+            if fmt not in ('csv', 'ndjson'):
+                raise ValueError('format must be csv or ndjson')
+            available = sample_log.sources(_sample_log.directory)
+            source = qs.get('source', [None])[0] or ('mppt' if 'mppt' in available else 'modbus')
+            if source not in available and source != _sample_log.source:
+                raise ValueError('unknown source (available: %s)' % ', '.join(available))
+            fields = [f for f in qs.get('fields', [''])[0].split(',') if f] or None
+        except Exception as e:
+            self.send_error(400, str(e))
+            return
+        if source == _sample_log.source:
+            log = _sample_log
+        elif _mppt_poller is not None and source == _mppt_poller.sample_log.source:
+            log = _mppt_poller.sample_log   # includes samples not yet flushed
+        else:
+            log = sample_log.SampleLog(source=source)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv' if fmt == 'csv' else 'application/x-ndjson')
+        self.send_header('Content-Disposition', 'attachment; filename="%s.%s"' % (source, fmt))
+        # Length is unknown up front: chunked for HTTP/1.1 clients, close otherwise
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+
+        def _write(text):
+            data = text.encode('utf-8')
+            if chunked:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            else:
+                self.wfile.write(data)
+
+        # Write in small batches straight from the generator (constant memory)
+        batch = []
+        try:
+            for line in sample_log.export_lines(log.iter_rows(start, end, fields), fmt, fields):
+                batch.append(line)
+                if len(batch) >= 256:
+                    _write(''.join(batch))
+                    batch = []
+            if batch:
+                _write(''.join(batch))
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    @staticmethod
+    def cached_sysinfo():
+        """get_sysinfo(), reused for the power profile's sysinfo_ttl seconds."""
+        global _sysinfo_cache
+        ttl = _power.profile['sysinfo_ttl']
+        rendered_at, info = _sysinfo_cache
+        if ttl and info is not None and time.monotonic() - rendered_at < ttl:
+            return info
+        info = Handler.get_sysinfo()
+        _sysinfo_cache = (time.monotonic(), info)
+        return info
+
+    @staticmethod
+    def get_sysinfo():
         # Prefer the cached sampler value (keeps requests instant and stable)
         try:
             info = {
                 'cpu_percent': round(float(_cached_cpu_percent), 1),
                 'timestamp': time.time(),
             }
-            # Add memory info if psutil available
+            proc = _cached_proc_sample
+            # Add memory info: prefer the background /proc sample, else psutil
             try:
-                if psutil:
+                if proc.get('memory_total'):
+                    info.update({
+                        'memory_percent': proc['memory_percent'],
+                        'memory_used': proc['memory_used'],
+                        'memory_total': proc['memory_total'],
+                        'ram_percent': proc['memory_percent'],
+                        'mem_percent': proc['memory_percent'],
+                    })
+                elif psutil:
                     vm = psutil.virtual_memory()
                     info.update({
                         'memory_percent': round(float(vm.percent), 1),
@@ -252,324 +886,347 @@ class Handler(SimpleHTTPRequestHandler):
 
             # Add uptime if available
             try:
-                if psutil:
+                if 'uptime_seconds' in proc:
+                    info['uptime_seconds'] = proc['uptime_seconds']
+                elif psutil:
                     boot_time = psutil.boot_time()
                     uptime_seconds = time.time() - boot_time
                     info['uptime_seconds'] = int(uptime_seconds)
             except Exception:
                 pass
 
+            # Per-core / iowait / steal breakdown and this server's own footprint
+            for key in ('cpu_per_core', 'cpu_iowait', 'cpu_steal', 'server_rss', 'server_cpu_percent'):
+                if key in proc:
+                    info[key] = proc[key]
+
             # Add disk/storage usage for root (/) so clients can show SSD/HDD usage
-            try:
-                disk_total = None
-                disk_used = None
-                disk_percent = None
-                # macOS: try to match Disk Utility by using `diskutil info -plist /`
-                if sys.platform == 'darwin':
-                    try:
-                        out = subprocess.check_output(['diskutil', 'info', '-plist', '/'], stderr=subprocess.DEVNULL, timeout=2)
+            # (cached between runs in low-power mode, see power_policy.py)
+            if _power.due('disk'):
+                try:
+                    disk_total = None
+                    disk_used = None
+                    disk_percent = None
+                    # macOS: try to match Disk Utility by using `diskutil info -plist /`
+                    if sys.platform == 'darwin':
                         try:
-                            info_plist = plistlib.loads(out)
+                            out = subprocess.check_output(['diskutil', 'info', '-plist', '/'], stderr=subprocess.DEVNULL, timeout=2)
+                            try:
+                                info_plist = plistlib.loads(out)
+                            except Exception:
+                                info_plist = None
+                            if info_plist:
+                                # Candidate keys for total/available (varies by macOS version)
+                                total_keys = ['TotalSize', 'VolumeTotalSpace', 'DeviceSize', 'Size']
+                                avail_keys = ['FreeSpace', 'AvailableSize', 'VolumeAvailableSpace']
+                                total_val = None
+                                avail_val = None
+                                for k in total_keys:
+                                    if k in info_plist and isinstance(info_plist[k], int):
+                                        total_val = int(info_plist[k]); break
+                                for k in avail_keys:
+                                    if k in info_plist and isinstance(info_plist[k], int):
+                                        avail_val = int(info_plist[k]); break
+                                if total_val is not None:
+                                    disk_total = total_val
+                                    if avail_val is not None:
+                                        disk_used = total_val - avail_val
+                                        disk_percent = round((disk_used / total_val) * 100.0, 1) if total_val > 0 else None
                         except Exception:
-                            info_plist = None
-                        if info_plist:
-                            # Candidate keys for total/available (varies by macOS version)
-                            total_keys = ['TotalSize', 'VolumeTotalSpace', 'DeviceSize', 'Size']
-                            avail_keys = ['FreeSpace', 'AvailableSize', 'VolumeAvailableSpace']
-                            total_val = None
-                            avail_val = None
-                            for k in total_keys:
-                                if k in info_plist and isinstance(info_plist[k], int):
-                                    total_val = int(info_plist[k]); break
-                            for k in avail_keys:
-                                if k in info_plist and isinstance(info_plist[k], int):
-                                    avail_val = int(info_plist[k]); break
-                            if total_val is not None:
-                                disk_total = total_val
-                                if avail_val is not None:
-                                    disk_used = total_val - avail_val
-                                    disk_percent = round((disk_used / total_val) * 100.0, 1) if total_val > 0 else None
-                    except Exception:
-                        # fall through to other methods
-                        disk_total = disk_used = disk_percent = None
-                if disk_total is None and psutil and hasattr(psutil, 'disk_usage'):
-                    du = psutil.disk_usage('/')
-                    disk_total = int(du.total)
-                    disk_used = int(du.used)
-                    disk_percent = round(float(du.percent), 1)
-                else:
-                    # fallback to shutil.disk_usage
-                    try:
-                        usage = shutil.disk_usage('/')
-                        disk_total = int(usage.total)
-                        disk_used = int(usage.used)
-                        disk_percent = round((disk_used / disk_total) * 100.0, 1) if disk_total > 0 else None
-                    except Exception:
-                        disk_total = disk_used = disk_percent = None
-                if disk_total is not None:
-                    info.update({
-                        'disk_total': disk_total,
-                        'disk_used': disk_used,
-                        'disk_percent': disk_percent,
-                    })
-                else:
-                    # Ensure disk fields always present by falling back to shutil
-                    try:
-                        usage = shutil.disk_usage('/')
+                            # fall through to other methods
+                            disk_total = disk_used = disk_percent = None
+                    if disk_total is None and psutil and hasattr(psutil, 'disk_usage'):
+                        du = psutil.disk_usage('/')
+                        disk_total = int(du.total)
+                        disk_used = int(du.used)
+                        disk_percent = round(float(du.percent), 1)
+                    else:
+                        # fallback to shutil.disk_usage
+                        try:
+                            usage = shutil.disk_usage('/')
+                            disk_total = int(usage.total)
+                            disk_used = int(usage.used)
+                            disk_percent = round((disk_used / disk_total) * 100.0, 1) if disk_total > 0 else None
+                        except Exception:
+                            disk_total = disk_used = disk_percent = None
+                    if disk_total is not None:
                         info.update({
-                            'disk_total': int(usage.total),
-                            'disk_used': int(usage.used),
-                            'disk_percent': round((usage.used / usage.total) * 100.0, 1) if usage.total > 0 else None,
+                            'disk_total': disk_total,
+                            'disk_used': disk_used,
+                            'disk_percent': disk_percent,
                         })
-                    except Exception:
-                        # As a last resort, set None values so client can handle gracefully
+                    else:
+                        # Ensure disk fields always present by falling back to shutil
                         try:
-                            info.setdefault('disk_total', None)
-                            info.setdefault('disk_used', None)
-                            info.setdefault('disk_percent', None)
+                            usage = shutil.disk_usage('/')
+                            info.update({
+                                'disk_total': int(usage.total),
+                                'disk_used': int(usage.used),
+                                'disk_percent': round((usage.used / usage.total) * 100.0, 1) if usage.total > 0 else None,
+                            })
                         except Exception:
-                            pass
-            except Exception:
-                pass
+                            # As a last resort, set None values so client can handle gracefully
+                            try:
+                                info.setdefault('disk_total', None)
+                                info.setdefault('disk_used', None)
+                                info.setdefault('disk_percent', None)
+                            except Exception:
+                                pass
+                except Exception:
+                    pass
+                _power.remember('disk', info, ('disk_total', 'disk_used', 'disk_percent'))
+            else:
+                info.update(_power.recall('disk'))
 
             # Add CPU temperature if available via psutil.sensors_temperatures()
-            try:
-                if psutil and hasattr(psutil, 'sensors_temperatures'):
-                    temps = psutil.sensors_temperatures()
-                    cpu_temp_val = None
-                    # temps is a dict of sensor_name -> list of shwtemp objects
-                    if isinstance(temps, dict):
-                        # Prefer common keys, otherwise pick the first numeric reading
-                        prefer_keys = ['cpu-thermal', 'coretemp', 'acpitz', 'cpu_thermal', 'package-0', 'cpu']
-                        for k in prefer_keys:
-                            if k in temps and temps[k]:
-                                for entry in temps[k]:
-                                    try:
-                                        if getattr(entry, 'current', None) is not None:
-                                            cpu_temp_val = float(entry.current)
-                                            break
-                                    except Exception:
-                                        continue
-                            if cpu_temp_val is not None:
-                                break
-                        # fallback: iterate all entries
-                        if cpu_temp_val is None:
-                            for lst in temps.values():
-                                if not lst:
-                                    continue
-                                for entry in lst:
-                                    try:
-                                        if getattr(entry, 'current', None) is not None:
-                                            cpu_temp_val = float(entry.current)
-                                            break
-                                    except Exception:
-                                        continue
+            # (cached between runs in low-power mode)
+            if _power.due('temperature'):
+                try:
+                    if psutil and hasattr(psutil, 'sensors_temperatures'):
+                        temps = psutil.sensors_temperatures()
+                        cpu_temp_val = None
+                        # temps is a dict of sensor_name -> list of shwtemp objects
+                        if isinstance(temps, dict):
+                            # Prefer common keys, otherwise pick the first numeric reading
+                            prefer_keys = ['cpu-thermal', 'coretemp', 'acpitz', 'cpu_thermal', 'package-0', 'cpu']
+                            for k in prefer_keys:
+                                if k in temps and temps[k]:
+                                    for entry in temps[k]:
+                                        try:
+                                            if getattr(entry, 'current', None) is not None:
+                                                cpu_temp_val = float(entry.current)
+                                                break
+                                        except Exception:
+                                            continue
                                 if cpu_temp_val is not None:
                                     break
-                    if cpu_temp_val is not None:
-                        # round to one decimal
-                        info['cpu_temp'] = round(cpu_temp_val, 1)
-                        info['cpu_temp_c'] = round(cpu_temp_val, 1)
-                    else:
-                        # Try a macOS user-space helper if available (non-sudo)
-                        cpu_temp_val2 = None
-                        try:
-                            if sys.platform == 'darwin':
-                                cmd = shutil.which('osx-cpu-temp')
-                                if cmd:
-                                    out = subprocess.check_output([cmd], stderr=subprocess.DEVNULL, timeout=1)
-                                    s = out.decode().strip()
-                                    # typical output: "48.5°C" or "48.5C"
-                                    s = s.replace('\u00b0', '').replace('C', '').replace('c', '').strip()
-                                    try:
-                                        cpu_temp_val2 = float(s)
-                                    except Exception:
-                                        cpu_temp_val2 = None
-                        except Exception:
-                            cpu_temp_val2 = None
-                        if cpu_temp_val2 is not None:
-                            info['cpu_temp'] = round(cpu_temp_val2, 1)
-                            info['cpu_temp_c'] = round(cpu_temp_val2, 1)
+                            # fallback: iterate all entries
+                            if cpu_temp_val is None:
+                                for lst in temps.values():
+                                    if not lst:
+                                        continue
+                                    for entry in lst:
+                                        try:
+                                            if getattr(entry, 'current', None) is not None:
+                                                cpu_temp_val = float(entry.current)
+                                                break
+                                        except Exception:
+                                            continue
+                                    if cpu_temp_val is not None:
+                                        break
+                        if cpu_temp_val is not None:
+                            # round to one decimal
+                            info['cpu_temp'] = round(cpu_temp_val, 1)
+                            info['cpu_temp_c'] = round(cpu_temp_val, 1)
                         else:
-                            # If we're on Linux (Raspberry Pi), try reading thermal_zone files
-                            cpu_temp_val3 = None
+                            # Try a macOS user-space helper if available (non-sudo)
+                            cpu_temp_val2 = None
                             try:
-                                if sys.platform.startswith('linux'):
-                                    # common Pi thermal path: /sys/class/thermal/thermal_zone0/temp
-                                    for path in glob.glob('/sys/class/thermal/thermal_zone*/temp'):
+                                if sys.platform == 'darwin':
+                                    cmd = shutil.which('osx-cpu-temp')
+                                    if cmd:
+                                        out = subprocess.check_output([cmd], stderr=subprocess.DEVNULL, timeout=1)
+                                        s = out.decode().strip()
+                                        # typical output: "48.5°C" or "48.5C"
+                                        s = s.replace('\u00b0', '').replace('C', '').replace('c', '').strip()
                                         try:
-                                            with open(path, 'r') as f:
-                                                txt = f.read().strip()
-                                            if not txt:
-                                                continue
-                                            # value is usually millidegrees Celsius
-                                            v = int(txt)
-                                            # convert millidegree -> degree if value large
-                                            if v > 1000:
-                                                cpu_temp_val3 = v / 1000.0
-                                            else:
-                                                cpu_temp_val3 = float(v)
-                                            break
+                                            cpu_temp_val2 = float(s)
                                         except Exception:
-                                            continue
+                                            cpu_temp_val2 = None
                             except Exception:
-                                cpu_temp_val3 = None
-                            if cpu_temp_val3 is not None:
-                                info['cpu_temp'] = round(cpu_temp_val3, 1)
-                                info['cpu_temp_c'] = round(cpu_temp_val3, 1)
+                                cpu_temp_val2 = None
+                            if cpu_temp_val2 is not None:
+                                info['cpu_temp'] = round(cpu_temp_val2, 1)
+                                info['cpu_temp_c'] = round(cpu_temp_val2, 1)
                             else:
-                                info['cpu_temp'] = None
-                else:
+                                # If we're on Linux (Raspberry Pi), try reading thermal_zone files
+                                cpu_temp_val3 = None
+                                try:
+                                    if sys.platform.startswith('linux'):
+                                        # common Pi thermal path: /sys/class/thermal/thermal_zone0/temp
+                                        for path in glob.glob('/sys/class/thermal/thermal_zone*/temp'):
+                                            try:
+                                                with open(path, 'r') as f:
+                                                    txt = f.read().strip()
+                                                if not txt:
+                                                    continue
+                                                # value is usually millidegrees Celsius
+                                                v = int(txt)
+                                                # convert millidegree -> degree if value large
+                                                if v > 1000:
+                                                    cpu_temp_val3 = v / 1000.0
+                                                else:
+                                                    cpu_temp_val3 = float(v)
+                                                break
+                                            except Exception:
+                                                continue
+                                except Exception:
+                                    cpu_temp_val3 = None
+                                if cpu_temp_val3 is not None:
+                                    info['cpu_temp'] = round(cpu_temp_val3, 1)
+                                    info['cpu_temp_c'] = round(cpu_temp_val3, 1)
+                                else:
+                                    info['cpu_temp'] = None
+                    else:
+                        info['cpu_temp'] = None
+                except Exception:
                     info['cpu_temp'] = None
-            except Exception:
-                info['cpu_temp'] = None
+                _power.remember('temperature', info, ('cpu_temp', 'cpu_temp_c'))
+            else:
+                info.update(_power.recall('temperature'))
 
             # Add measured power (watts) when available from common sysfs files
-            try:
-                power_watts = None
-                # 1) Allow manual override via environment variable (useful for testing)
+            # (cached between runs in low-power mode)
+            if _power.due('power'):
                 try:
-                    env_pw = os.environ.get('POWER_WATTS') or os.environ.get('POWER_WATTS_OVERRIDE')
-                    if env_pw:
-                        power_watts = float(env_pw)
-                except Exception:
                     power_watts = None
-
-                # 2) Allow a simple runtime file to be dropped for environments that
-                # provide power info via a daemon (e.g. /var/run/power_watts.txt)
-                if power_watts is None:
+                    # 1) Allow manual override via environment variable (useful for testing)
                     try:
-                        if os.path.exists('/var/run/power_watts.txt'):
-                            with open('/var/run/power_watts.txt', 'r') as f:
-                                txt = f.read().strip()
-                            if txt:
-                                power_watts = float(txt)
+                        env_pw = os.environ.get('POWER_WATTS') or os.environ.get('POWER_WATTS_OVERRIDE')
+                        if env_pw:
+                            power_watts = float(env_pw)
                     except Exception:
                         power_watts = None
 
-                # 3) Inspect common Linux sysfs locations for power/current/voltage
-                if power_watts is None and sys.platform.startswith('linux'):
-                    # Try power_now (usually in microwatts)
-                    try:
-                        for path in glob.glob('/sys/class/power_supply/*/power_now'):
-                            try:
-                                with open(path, 'r') as f:
-                                    v = f.read().strip()
-                                if not v:
-                                    continue
-                                val = float(v)
-                                # many drivers report microwatts -> convert to watts
-                                # If value looks very small (<0.001) treat as watts already
-                                if val > 1000:  # >1000 uW -> convert
-                                    power_watts = val / 1e6
-                                else:
-                                    power_watts = val
-                                break
-                            except Exception:
-                                continue
-                    except Exception:
-                        pass
+                    # 2) Allow a simple runtime file to be dropped for environments that
+                    # provide power info via a daemon (e.g. /var/run/power_watts.txt)
+                    if power_watts is None:
+                        try:
+                            if os.path.exists('/var/run/power_watts.txt'):
+                                with open('/var/run/power_watts.txt', 'r') as f:
+                                    txt = f.read().strip()
+                                if txt:
+                                    power_watts = float(txt)
+                        except Exception:
+                            power_watts = None
 
-                # 4) Try current_now (uA) and voltage_now (uV) -> watts = (uA * uV) / 1e12
-                if power_watts is None and sys.platform.startswith('linux'):
-                    try:
-                        for base in glob.glob('/sys/class/power_supply/*'):
-                            curp = os.path.join(base, 'current_now')
-                            voltp = os.path.join(base, 'voltage_now')
-                            if os.path.exists(curp) and os.path.exists(voltp):
+                    # 3) Inspect common Linux sysfs locations for power/current/voltage
+                    if power_watts is None and sys.platform.startswith('linux'):
+                        # Try power_now (usually in microwatts)
+                        try:
+                            for path in glob.glob('/sys/class/power_supply/*/power_now'):
                                 try:
-                                    with open(curp, 'r') as f:
-                                        cur = f.read().strip()
-                                    with open(voltp, 'r') as f:
-                                        volt = f.read().strip()
-                                    if cur and volt:
-                                        curv = float(cur)
-                                        voltv = float(volt)
-                                        # Compute watts: (uA * uV) / 1e12
-                                        power_watts = (curv * voltv) / 1e12
-                                        break
+                                    with open(path, 'r') as f:
+                                        v = f.read().strip()
+                                    if not v:
+                                        continue
+                                    val = float(v)
+                                    # many drivers report microwatts -> convert to watts
+                                    # If value looks very small (<0.001) treat as watts already
+                                    if val > 1000:  # >1000 uW -> convert
+                                        power_watts = val / 1e6
+                                    else:
+                                        power_watts = val
+                                    break
                                 except Exception:
                                     continue
-                    except Exception:
-                        pass
+                        except Exception:
+                            pass
 
-                # 5) Try hwmon power inputs (e.g. /sys/class/hwmon/hwmon*/power1_input)
-                if power_watts is None and sys.platform.startswith('linux'):
-                    try:
-                        for path in glob.glob('/sys/class/hwmon/*/power*_input'):
-                            try:
-                                with open(path, 'r') as f:
-                                    v = f.read().strip()
-                                if not v:
+                    # 4) Try current_now (uA) and voltage_now (uV) -> watts = (uA * uV) / 1e12
+                    if power_watts is None and sys.platform.startswith('linux'):
+                        try:
+                            for base in glob.glob('/sys/class/power_supply/*'):
+                                curp = os.path.join(base, 'current_now')
+                                voltp = os.path.join(base, 'voltage_now')
+                                if os.path.exists(curp) and os.path.exists(voltp):
+                                    try:
+                                        with open(curp, 'r') as f:
+                                            cur = f.read().strip()
+                                        with open(voltp, 'r') as f:
+                                            volt = f.read().strip()
+                                        if cur and volt:
+                                            curv = float(cur)
+                                            voltv = float(volt)
+                                            # Compute watts: (uA * uV) / 1e12
+                                            power_watts = (curv * voltv) / 1e12
+                                            break
+                                    except Exception:
+                                        continue
+                        except Exception:
+                            pass
+
+                    # 5) Try hwmon power inputs (e.g. /sys/class/hwmon/hwmon*/power1_input)
+                    if power_watts is None and sys.platform.startswith('linux'):
+                        try:
+                            for path in glob.glob('/sys/class/hwmon/*/power*_input'):
+                                try:
+                                    with open(path, 'r') as f:
+                                        v = f.read().strip()
+                                    if not v:
+                                        continue
+                                    val = float(v)
+                                    # Many hwmon drivers report microwatts or milliwatts;
+                                    # attempt heuristics: if val > 1000 assume microwatts -> convert
+                                    if val > 1000:
+                                        power_watts = val / 1e6
+                                    else:
+                                        power_watts = val
+                                    break
+                                except Exception:
                                     continue
-                                val = float(v)
-                                # Many hwmon drivers report microwatts or milliwatts;
-                                # attempt heuristics: if val > 1000 assume microwatts -> convert
-                                if val > 1000:
-                                    power_watts = val / 1e6
-                                else:
-                                    power_watts = val
-                                break
-                            except Exception:
-                                continue
-                    except Exception:
-                        pass
+                        except Exception:
+                            pass
 
-                # Finalize value: normalize to float with sensible precision or None
-                if power_watts is not None:
-                    try:
-                        pw = float(power_watts)
-                        # discard negative or NaN
-                        if pw != pw or pw < 0:
+                    # Finalize value: normalize to float with sensible precision or None
+                    if power_watts is not None:
+                        try:
+                            pw = float(power_watts)
+                            # discard negative or NaN
+                            if pw != pw or pw < 0:
+                                pw = None
+                        except Exception:
                             pw = None
-                    except Exception:
-                        pw = None
-                    if pw is not None:
-                        # round to 3 decimal places for display
-                        info['power_watts'] = round(pw, 3)
+                        if pw is not None:
+                            # round to 3 decimal places for display
+                            info['power_watts'] = round(pw, 3)
+                        else:
+                            info['power_watts'] = None
                     else:
                         info['power_watts'] = None
-                else:
-                    info['power_watts'] = None
-            except Exception:
-                try:
-                    info['power_watts'] = None
                 except Exception:
-                    pass
+                    try:
+                        info['power_watts'] = None
+                    except Exception:
+                        pass
+                _power.remember('power', info, ('power_watts',))
+            else:
+                info.update(_power.recall('power'))
 
-            # Add MPPT data from /tmp/mppt_data.json if available (from mppt_reader.py)
+            # Add MPPT data from mppt_reader.py (in-process poller or /tmp/mppt_data.json)
             try:
-                if os.path.exists('/tmp/mppt_data.json'):
-                    with open('/tmp/mppt_data.json', 'r') as f:
-                        mppt_data = json.load(f)
-                    if isinstance(mppt_data, dict):
-                        if 'panel_voltage' in mppt_data:
-                            info['panel_voltage'] = mppt_data['panel_voltage']
-                            info['panel_v'] = mppt_data['panel_voltage']
-                        if 'panel_current' in mppt_data:
-                            info['panel_current'] = mppt_data['panel_current']
-                            info['panel_a'] = mppt_data['panel_current']
-                        if 'panel_power' in mppt_data:
-                            info['panel_power'] = mppt_data['panel_power']
-                            info['panel_w'] = mppt_data['panel_power']
-                        if 'battery_voltage' in mppt_data:
-                            info['battery_voltage'] = mppt_data['battery_voltage']
-                            info['battery_v'] = mppt_data['battery_voltage']
-                        if 'battery_soc' in mppt_data:
-                            info['battery_soc'] = mppt_data['battery_soc']
-                            info['battery_level'] = mppt_data['battery_soc']
-                            info['battery_percent'] = mppt_data['battery_soc']
-                        if 'battery_temperature' in mppt_data:
-                            info['battery_temp'] = mppt_data['battery_temperature']
-                            info['battery_temp_c'] = mppt_data['battery_temperature']
-                            info['battery_temperature'] = mppt_data['battery_temperature']
-                        if 'load_voltage' in mppt_data:
-                            info['load_voltage'] = mppt_data['load_voltage']
-                        if 'load_current' in mppt_data:
-                            info['load_current'] = mppt_data['load_current']
-                        if 'load_power' in mppt_data:
-                            info['load_power'] = mppt_data['load_power']
-                            info['power_watts'] = mppt_data['load_power']  # Use RS485 load power for Power Load display
+                mppt_data = _read_mppt_data()
+                if isinstance(mppt_data, dict):
+                    if 'panel_voltage' in mppt_data:
+                        info['panel_voltage'] = mppt_data['panel_voltage']
+                        info['panel_v'] = mppt_data['panel_voltage']
+                    if 'panel_current' in mppt_data:
+                        info['panel_current'] = mppt_data['panel_current']
+                        info['panel_a'] = mppt_data['panel_current']
+                    if 'panel_power' in mppt_data:
+                        info['panel_power'] = mppt_data['panel_power']
+                        info['panel_w'] = mppt_data['panel_power']
+                    if 'battery_voltage' in mppt_data:
+                        info['battery_voltage'] = mppt_data['battery_voltage']
+                        info['battery_v'] = mppt_data['battery_voltage']
+                    if 'battery_soc' in mppt_data:
+                        info['battery_soc'] = mppt_data['battery_soc']
+                        info['battery_level'] = mppt_data['battery_soc']
+                        info['battery_percent'] = mppt_data['battery_soc']
+                    if 'battery_temperature' in mppt_data:
+                        info['battery_temp'] = mppt_data['battery_temperature']
+                        info['battery_temp_c'] = mppt_data['battery_temperature']
+                        info['battery_temperature'] = mppt_data['battery_temperature']
+                    if 'load_voltage' in mppt_data:
+                        info['load_voltage'] = mppt_data['load_voltage']
+                    if 'load_current' in mppt_data:
+                        info['load_current'] = mppt_data['load_current']
+                    if 'load_power' in mppt_data:
+                        info['load_power'] = mppt_data['load_power']
+                        info['power_watts'] = mppt_data['load_power']  # Use RS485 load power for Power Load display
+                    for key in ('panel_energy_wh', 'load_energy_wh'):
+                        if key in mppt_data:
+                            info[key] = mppt_data[key]
             except Exception:
                 # If MPPT JSON read fails, continue without it
                 pass
@@ -602,6 +1259,13 @@ class Handler(SimpleHTTPRequestHandler):
                     if 'battery_temp' in _last_modbus_values and 'battery_temp' not in info:
                         info['battery_temp'] = _last_modbus_values['battery_temp']
                         info['battery_temp_c'] = _last_modbus_values['battery_temp']
+                    if 'load_v' in _last_modbus_values and 'load_voltage' not in info:
+                        info['load_voltage'] = _last_modbus_values['load_v']
+                    if 'load_a' in _last_modbus_values and 'load_current' not in info:
+                        info['load_current'] = _last_modbus_values['load_a']
+                    if 'load_power' not in info and 'load_v' in _last_modbus_values and 'load_a' in _last_modbus_values:
+                        info['load_power'] = round(_last_modbus_values['load_v'] * _last_modbus_values['load_a'], 2)
+                        info['power_watts'] = info['load_power']
             except Exception:
                 # If Modbus fails, just skip it and return system info only
                 pass
@@ -635,6 +1299,8 @@ class Handler(SimpleHTTPRequestHandler):
                 info['runtime_seconds'] = None
                 info['runtime_hours'] = None
 
+            _note_soc(info)
+            info.update(_power.status())
             return info
         except Exception:
             # Last-resort fallback: compute a quick percent or derive from load
@@ -653,13 +1319,116 @@ class Handler(SimpleHTTPRequestHandler):
                 'timestamp': time.time(),
             }
 
-class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
-    daemon_threads = True
+class ThreadingHTTPServer(HTTPServer):
+    """HTTPServer with a bounded worker pool and fast 503 load shedding."""
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS, max_queue=MAX_QUEUE):
+        super().__init__(server_address, handler_class)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='http')
+        # one slot per connection being served or waiting for a worker
+        self._slots = threading.BoundedSemaphore(max(1, max_workers) + max(0, max_queue))
+        self._max_workers = max(1, max_workers)
+        self._active = 0
+        self._idle = 0          # kept-alive connections waiting for their next request
+        self._active_lock = threading.Lock()
+        self.shed_count = 0
+        self._detached = set()
+
+    def saturated(self):
+        """True when connections are queued waiting for a worker, or there
+        are more of them than the low-power cap allows."""
+        cap = _power.profile['max_connections']
+        return self._active > self._max_workers or bool(cap and self._active > cap)
+
+    def note_idle(self, delta):
+        with self._active_lock:
+            self._idle += delta
+
+    def process_request(self, request, client_address):
+        cap = _power.profile['max_connections']
+        if cap and self._active - self._idle >= cap:
+            # low-power mode admits fewer concurrent connections; idle
+            # keep-alives do not count and are closed to make room instead
+            self.shed_count += 1
+            self._shed(request)
+            return
+        if not self._slots.acquire(blocking=False):
+            self.shed_count += 1
+            self._shed(request)
+            return
+        with self._active_lock:
+            self._active += 1
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except Exception:
+            self._release_slot()
+            self.shutdown_request(request)
+
+    def _release_slot(self):
+        with self._active_lock:
+            self._active -= 1
+        self._slots.release()
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._release_slot()
+
+    def detach(self, request):
+        """Keep `request` open after its handler returns (WebSocket hand-off)."""
+        self._detached.add(request)
+
+    def shutdown_request(self, request):
+        if request in self._detached:
+            self._detached.discard(request)
+            return
+        super().shutdown_request(request)
+
+    def _shed(self, request):
+        """Reject a connection without reading it; never blocks the accept loop."""
+        try:
+            request.settimeout(0.5)
+            request.sendall((
+                'HTTP/1.1 503 Service Unavailable\r\n'
+                'Retry-After: %d\r\n'
+                'Content-Type: text/plain\r\n'
+                'Content-Length: 5\r\n'
+                'Connection: close\r\n\r\nbusy\n' % RETRY_AFTER).encode('ascii'))
+        except Exception:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
 
 if __name__ == '__main__':
     # Start background CPU sampler (if psutil available)
     def _sampler_loop():
-        global _cached_cpu_percent
+        global _cached_cpu_percent, _cached_proc_sample
+        if proc_sampler.available():
+            # Linux: non-blocking deltas straight from /proc (no psutil needed)
+            sampler = proc_sampler.ProcSampler()
+            while not _stop_sampler.is_set():
+                try:
+                    sample = sampler.sample()
+                    if 'cpu_percent' in sample:
+                        _cached_cpu_percent = float(sample['cpu_percent'])
+                    _cached_proc_sample = sample
+                    system = {k: sample[k] for k in HISTORY_SYSTEM_FIELDS if k in sample}
+                    _history.append('system', system)
+                    _live_hub.publish('system', system)
+                    _note_live_demand()
+                    _record_mppt_file()
+                except Exception:
+                    pass
+                _stop_sampler.wait(SAMPLER_INTERVAL * _power.profile['slowdown'])
+            sampler.close()
+            return
         try:
             if psutil:
                 # initial call to establish internal psutil state
@@ -679,17 +1448,65 @@ if __name__ == '__main__':
                     _cached_cpu_percent = float(val)
                 except Exception:
                     _cached_cpu_percent = 0.0
+                _history.append('system', {'cpu_percent': _cached_cpu_percent})
+                _live_hub.publish('system', {'cpu_percent': _cached_cpu_percent})
+                _note_live_demand()
+                _record_mppt_file()
+                # psutil.cpu_percent(interval=1) already blocked for a second;
+                # the load-average path does not block, so pace it explicitly
+                pause = SAMPLER_INTERVAL * _power.profile['slowdown'] - (1.0 if psutil else 0.0)
+                if pause > 0:
+                    _stop_sampler.wait(pause)
         except Exception:
             pass
 
     print(f"Serving HTTP on {HOST} port {PORT} (http://{HOST}:{PORT}/) ...")
+    _publisher = None
     try:
-        _sampler_thread = threading.Thread(target=_sampler_loop, daemon=True)
+        _sampler_thread = threading.Thread(target=_sampler_loop, name='sampler', daemon=True)
         _sampler_thread.start()
+        if MPPT_IN_PROCESS:
+            _start_mppt_poller()
+        if _modbus_configured():
+            threading.Thread(target=_modbus_poll_loop, name='modbus-poll', daemon=True).start()
+        if _power.level != 'normal':
+            # POWER_MODE forced a level
+            _apply_power_profile(_power.level, _power.profile)
+        # systemd stop: unwind like Ctrl-C so the poller checkpoints its state
+        # and buffered samples reach the log
+        def _terminate(signum, frame):
+            raise KeyboardInterrupt
+        signal.signal(signal.SIGTERM, _terminate)
+
+        def _toggle_profile(signum, frame):
+            # SIGUSR1: start profiling; send it again to stop and write the output
+            global _profiler
+            with _profiler_lock:
+                if _profiler is not None and _profiler.running:
+                    paths = _profiler.stop().dump(PROFILE_DIR)
+                    sys.stderr.write('[profile] wrote %s\n' % ', '.join(paths))
+                else:
+                    _profiler = stack_profiler.StackProfiler().start()
+                    sys.stderr.write('[profile] started (send SIGUSR1 again to stop)\n')
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, _toggle_profile)
+        try:
+            # measure the page once up front so the first visitor does not wait
+            _page_weight.get()
+        except Exception:
+            pass
+        # SNAPSHOT_DIR=/var/www/html: also publish sysinfo.json(.gz/.br) as static files;
+        # rendered through the same cache and slowed down with the power profile
+        _publisher = snapshot_publisher.SnapshotPublisher(
+            render=Handler.cached_sysinfo, scale=lambda: _power.profile['slowdown']).start()
+        if _publisher.enabled():
+            print(f"Publishing {_publisher.path} every {_publisher.current_interval():g}s")
         httpd = ThreadingHTTPServer((HOST, PORT), Handler)
         httpd.serve_forever()
     except KeyboardInterrupt:
         print('\nShutting down server')
+        if _mppt_poller is not None:
+            _mppt_poller.stop()
     except Exception as e:
         # Log unexpected exceptions to stderr to aid debugging on the Pi
         try:
@@ -698,5 +1515,9 @@ if __name__ == '__main__':
         except Exception:
             sys.stderr.write('Server exited with error: %s\n' % str(e))
         raise
+    finally:
         _stop_sampler.set()
-        httpd.server_close()
+        _poll_scheduler.wake()
+        if _publisher is not None:
+            _publisher.stop()
+        _sample_log.flush()
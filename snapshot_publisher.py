@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Publish the /sysinfo snapshot as static files in the web root.
+
+Instead of every visitor's request reaching the Pi through the proxy, the
+collector renders the snapshot at a fixed cadence and writes
+
+    <SNAPSHOT_DIR>/sysinfo.json      (+ .gz, and .br when `brotli` is installed)
+
+each one to a temporary file in the same directory first and then
+os.replace()d into place, so nginx or a CDN never serves a half-written file.
+Unchanged snapshots are only rewritten every SNAPSHOT_HEARTBEAT seconds (so
+the timestamp still shows the device is alive) to save SD card writes.
+nginx serves the files with gzip_static / brotli_static and a short max-age,
+so the Pi's work no longer depends on the number of visitors:
+
+    publisher = SnapshotPublisher('/var/www/html', render=lambda: {...}).start()
+
+`scale` (optional) returns a factor applied to the interval before each wait,
+so a low-power profile can stretch the cadence without restarting the thread.
+
+Configure with SNAPSHOT_DIR (empty disables publishing), SNAPSHOT_NAME,
+SNAPSHOT_INTERVAL and SNAPSHOT_HEARTBEAT.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+
+from env_config import env_float
+from state_store import write_atomic
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '')
+SNAPSHOT_NAME = os.environ.get('SNAPSHOT_NAME', 'sysinfo.json')
+INTERVAL = env_float('SNAPSHOT_INTERVAL', 5.0)
+HEARTBEAT = env_float('SNAPSHOT_HEARTBEAT', 60.0)  # rewrite unchanged data this often
+
+
+class SnapshotPublisher:
+    """Renders `render()` to JSON every `interval` seconds and publishes it."""
+
+    def __init__(self, directory=SNAPSHOT_DIR, render=None, interval=INTERVAL, name=SNAPSHOT_NAME,
+                 heartbeat=HEARTBEAT, scale=None):
+        self.directory = directory
+        self.render = render
+        self.interval = max(0.5, float(interval))
+        self.scale = scale
+        self.heartbeat = heartbeat
+        self.path = os.path.join(directory, name) if directory else None
+        self.stats = {'published': 0, 'unchanged': 0, 'errors': 0}
+        self._last = None
+        self._last_write = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enabled(self):
+        return bool(self.directory) and self.render is not None
+
+    def publish_once(self):
+        """Render and write one snapshot; returns True if the files changed."""
+        info = self.render()
+        # the timestamp changes every render; compare the payload without it
+        key = json.dumps({k: v for k, v in info.items() if k != 'timestamp'}, sort_keys=True, default=str)
+        if key == self._last and time.monotonic() - self._last_write < (self.heartbeat or float('inf')):
+            self.stats['unchanged'] += 1
+            return False
+        body = json.dumps(info, separators=(',', ':'), default=str).encode('utf-8')
+        os.makedirs(self.directory, exist_ok=True)
+        # compressed variants first so they are never older than the plain file;
+        # 0644 so the web server can read them whatever our umask
+        if brotli is not None:
+            write_atomic(self.path + '.br', brotli.compress(body, quality=11), mode=0o644)
+        write_atomic(self.path + '.gz', gzip.compress(body, 9, mtime=0), mode=0o644)
+        write_atomic(self.path, body, mode=0o644)
+        self._last = key
+        self._last_write = time.monotonic()
+        self.stats['published'] += 1
+        return True
+
+    def start(self):
+        if not self.enabled():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='snapshot', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def current_interval(self):
+        try:
+            return self.interval * max(1.0, float(self.scale())) if self.scale else self.interval
+        except Exception:
+            return self.interval
+
+    def _run(self):
+        # fixed cadence: the next deadline does not drift with render time
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.publish_once()
+            except Exception:
+                self.stats['errors'] += 1
+            interval = self.current_interval()
+            deadline += interval
+            now = time.monotonic()
+            if deadline < now:
+                deadline = now + interval
+            self._stop.wait(deadline - now)
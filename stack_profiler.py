@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Low-overhead sampling profiler for the running server.
+
+A background thread snapshots every thread's stack with sys._current_frames()
+at a fixed interval (default 5 ms) and counts identical stacks per thread
+(HTTP workers, the sampler thread, the Modbus poller, ...). Output is either
+collapsed stacks, for flamegraph.pl / inferno:
+
+    http_0;do_GET (serve_with_info.py:300);get_sysinfo (serve_with_info.py:420) 17
+
+or a speedscope JSON file (https://www.speedscope.app), one profile per thread.
+
+Usage:
+    prof = StackProfiler().start()
+    ...
+    prof.stop()
+    text = prof.collapsed()
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+from env_config import env_float
+
+INTERVAL = env_float('PROFILE_INTERVAL', 0.005)
+MAX_DEPTH = 64
+
+
+class StackProfiler:
+    """Samples all thread stacks until stopped."""
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = max(0.001, float(interval))
+        self.counts = {}      # (thread name, (frame, ...)) -> samples
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._names = {}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.time() - (self.started or time.time())
+        return self
+
+    def _refresh_names(self):
+        self._names = {t.ident: t.name for t in threading.enumerate()}
+
+    def _run(self):
+        own = threading.get_ident()
+        next_names = 0.0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_names:
+                self._refresh_names()
+                next_names = now + 1.0
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                if tid not in self._names:
+                    # thread started since the last refresh (e.g. a new pool worker)
+                    self._refresh_names()
+                    self._names.setdefault(tid, 'thread-%d' % tid)
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                key = (self._names[tid], tuple(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+    # --- output formats ---
+    @staticmethod
+    def _label(frame):
+        name, filename, line = frame
+        return '%s (%s:%d)' % (name, os.path.basename(filename), line)
+
+    def collapsed(self):
+        """Brendan Gregg collapsed-stack text (thread name as the root frame)."""
+        lines = []
+        for (thread, stack), count in sorted(self.counts.items(), key=lambda kv: -kv[1]):
+            path = ';'.join([thread.replace(';', '_')] + [self._label(f).replace(';', '_') for f in stack])
+            lines.append('%s %d' % (path, count))
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self, name='serve_with_info'):
+        """speedscope file-format dict with one sampled profile per thread."""
+        frames = []
+        index = {}
+        profiles = {}
+        for (thread, stack), count in self.counts.items():
+            ids = []
+            for f in stack:
+                if f not in index:
+                    index[f] = len(frames)
+                    frames.append({'name': f[0], 'file': f[1], 'line': f[2]})
+                ids.append(index[f])
+            prof = profiles.setdefault(thread, {'samples': [], 'weights': []})
+            prof['samples'].append(ids)
+            prof['weights'].append(count * self.interval)
+        out = []
+        for thread, prof in sorted(profiles.items()):
+            total = sum(prof['weights'])
+            out.append({
+                'type': 'sampled',
+                'name': thread,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': total,
+                'samples': prof['samples'],
+                'weights': prof['weights'],
+            })
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'lowimpact stack_profiler',
+            'shared': {'frames': frames},
+            'profiles': out,
+        }
+
+    def dump(self, directory, prefix='profile'):
+        """Write both formats to `directory`; returns the written paths."""
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        base = os.path.join(directory, '%s-%s' % (prefix, stamp))
+        with open(base + '.collapsed', 'w') as f:
+            f.write(self.collapsed())
+        with open(base + '.speedscope.json', 'w') as f:
+            json.dump(self.speedscope(), f)
+        return [base + '.collapsed', base + '.speedscope.json']
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Crash-safe, flash-friendly persistence for the MPPT reader.
+
+Two pieces:
+
+- OutputWriter publishes the live snapshot (/tmp/mppt_data.json). Every
+  write goes to a temporary file that is renamed over the target, so readers
+  see either the old or the new file, never a truncated one. Updates whose
+  values did not change are skipped (only rewritten every `heartbeat`
+  seconds so the timestamp stays fresh), and updates arriving faster than
+  `min_interval` are coalesced: the newest is written once `min_interval`
+  has passed, whether or not another update follows.
+
+- Checkpoint keeps long-lived state (energy counters, last-known-good
+  values) on persistent storage. It is written at a wear-friendly interval
+  (default every 5 minutes, plus on shutdown) with fsync, and the previous
+  checkpoint is kept as `<file>.prev`, so a crash or power cut mid-write
+  always leaves one intact copy to restore from on restart.
+
+    out = OutputWriter('/tmp/mppt_data.json')
+    state = Checkpoint('/var/tmp/lowimpact-mppt-state.json')
+    state.load()
+    ...
+    out.update(data)
+    state.maybe_save()
+"""
+import json
+import os
+import threading
+import time
+
+from env_config import env_float
+
+OUTPUT_MIN_INTERVAL = env_float('MPPT_OUTPUT_MIN_INTERVAL', 1.0)   # coalesce faster updates
+OUTPUT_HEARTBEAT = env_float('MPPT_OUTPUT_HEARTBEAT', 30.0)        # rewrite unchanged data this often
+STATE_FILE = os.environ.get('MPPT_STATE_FILE', '/var/tmp/lowimpact-mppt-state.json')
+CHECKPOINT_INTERVAL = env_float('MPPT_CHECKPOINT_INTERVAL', 300.0)
+
+
+def write_atomic(path, data, fsync=False, mode=None):
+    """Write bytes to `path` via a temporary file and rename.
+
+    Readers never see a partial file. With fsync=True the file and its
+    directory are flushed to the device, so the new contents survive a power
+    cut once this returns; `mode` sets the permissions before the rename.
+    """
+    directory = os.path.dirname(path) or '.'
+    tmp = os.path.join(directory, '.%s.tmp-%d' % (os.path.basename(path), os.getpid()))
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+
+class OutputWriter:
+    """Atomic, change-aware, rate-limited writer for the live JSON snapshot."""
+
+    def __init__(self, path, min_interval=OUTPUT_MIN_INTERVAL, heartbeat=OUTPUT_HEARTBEAT):
+        self.path = path
+        self.min_interval = min_interval or 0.0
+        self.heartbeat = heartbeat
+        self.stats = {'written': 0, 'unchanged': 0, 'coalesced': 0}
+        self._pending = None
+        self._last_key = None
+        self._last_write = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def update(self, data):
+        """Offer a new snapshot; returns True if it was written now."""
+        key = json.dumps({k: v for k, v in data.items() if k != 'timestamp'}, sort_keys=True)
+        with self._lock:
+            now = time.monotonic()
+            since = now - self._last_write if self._last_write is not None else None
+            if key == self._last_key and since is not None and since < (self.heartbeat or float('inf')):
+                self._pending = None
+                self.stats['unchanged'] += 1
+                return False
+            if since is not None and since < self.min_interval:
+                # keep only the newest; written when min_interval is up
+                if self._pending is not None:
+                    self.stats['coalesced'] += 1
+                self._pending = (key, data)
+                if self._timer is None:
+                    self._timer = threading.Timer(self.min_interval - since, self._flush_due)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return False
+            self._write(key, data, now)
+            return True
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending is not None:
+                key, data = self._pending
+                self._write(key, data, time.monotonic())
+
+    def _flush_due(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def _write(self, key, data, now):
+        write_atomic(self.path, json.dumps(data).encode('utf-8'))
+        self._pending = None
+        self._last_key = key
+        self._last_write = now
+        self.stats['written'] += 1
+
+
+class Checkpoint:
+    """Long-lived reader state, restored on start and saved every `interval` seconds."""
+
+    def __init__(self, path=STATE_FILE, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.state = {}
+        self._last_save = time.monotonic()
+        self._dirty = False
+
+    def load(self):
+        """Restore the newest intact checkpoint; returns the state dict."""
+        for candidate in (self.path, self.path + '.prev'):
+            try:
+                with open(candidate, 'r') as f:
+                    state = json.load(f)
+                if isinstance(state, dict):
+                    self.state = state
+                    return state
+            except Exception:
+                continue
+        self.state = {}
+        return self.state
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def maybe_save(self):
+        if self._dirty and time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        """Write the state now (keeping the previous checkpoint as .prev)."""
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            body = json.dumps(dict(self.state, saved_at=time.time())).encode('utf-8')
+            if os.path.exists(self.path):
+                os.replace(self.path, self.path + '.prev')
+            write_atomic(self.path, body, fsync=True)
+            self._dirty = False
+        except Exception as e:
+            print(f"Could not write checkpoint {self.path}: {e}")
+        self._last_save = time.monotonic()
+
+
+class EnergyCounter:
+    """Integrates a power reading (W) into watt-hours, skipping long gaps."""
+
+    def __init__(self, total_wh=0.0, max_gap=120.0):
+        self.total_wh = float(total_wh or 0.0)
+        self.max_gap = max_gap
+        self._last = None   # (ts, watts)
+
+    def add(self, ts, watts):
+        if watts is None:
+            self._last = None
+            return self.total_wh
+        if self._last is not None:
+            dt = ts - self._last[0]
+            if 0 < dt <= self.max_gap:
+                # trapezoid between the two readings
+                self.total_wh += (watts + self._last[1]) / 2.0 * dt / 3600.0
+        self._last = (ts, watts)
+        return self.total_wh
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+In-memory telemetry history and the batch query engine behind /query.
+
+TelemetryWindow is a fixed-capacity columnar ring buffer: one timestamp column
+plus one float64 row per field (NaN where a sample did not carry that field),
+preallocated up front. Rows are kept in time order (a row older than the
+newest one is dropped), which the range lookups rely on. With NumPy installed the columns live in one 2-D array
+and appends write in place without allocating; window statistics are computed
+with vectorized operations (a 24 h query over 86,400 samples takes a few ms).
+Without NumPy it falls back to array('d') columns and plain Python loops.
+
+TelemetryHistory keeps one window per source (system sampler, MPPT, Modbus),
+so sources sampling at different rates neither push each other's history out
+nor interleave out-of-order timestamps.
+
+run_queries() answers several metric / range / aggregation requests in one go,
+sharing the range lookup, column slices and bucket boundaries between queries
+that ask for the same window, and returns columnar results:
+
+    {"metric": "cpu_percent", "agg": "avg", "step": 60, "t": [...], "v": [...]}
+
+Aggregations: raw, avg, min, max, sum, count, last, pNN (percentile, e.g.
+p95), moving_avg (time window `window` seconds) and wh (trapezoidal energy
+integration of a watts metric, segments longer than `max_gap` are skipped).
+"""
+import bisect
+import contextlib
+import math
+import re
+import threading
+import time
+from array import array
+
+from env_config import env_int
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+CAPACITY = env_int('HISTORY_SIZE', 86400)  # samples kept per source (24 h at 1 Hz)
+MAX_QUERIES = 32
+AGGREGATES = ('raw', 'avg', 'min', 'max', 'sum', 'count', 'last', 'moving_avg', 'wh', 'pNN')
+DEFAULT_WINDOW = 300.0   # moving_avg window, seconds
+DEFAULT_MAX_GAP = 300.0  # wh: do not integrate across gaps longer than this
+
+_NAN = float('nan')
+_PERCENTILE = re.compile(r'^p(\d{1,2}(\.\d+)?|100)$')
+
+
+class TelemetryWindow:
+    """Fixed-capacity ring buffer of timestamped samples, stored column-wise."""
+
+    def __init__(self, capacity=CAPACITY, fields=()):
+        self.capacity = max(2, int(capacity))
+        self._index = {}  # field -> row
+        self._head = 0    # next physical slot to write
+        self._count = 0
+        self.dropped = 0  # rows refused for arriving out of time order
+        self._lock = threading.Lock()
+        if np is not None:
+            self._ts = np.zeros(self.capacity)
+            self._data = np.full((max(8, len(fields)), self.capacity), np.nan)
+        else:
+            self._ts = array('d', bytes(8 * self.capacity))
+            self._data = []
+        for name in fields:
+            self._add_field(name)
+
+    def __len__(self):
+        return self._count
+
+    def fields(self):
+        return sorted(self._index)
+
+    def _add_field(self, name):
+        row = len(self._index)
+        if np is not None:
+            if row >= self._data.shape[0]:
+                # rare: a new field appeared; double the preallocated rows
+                grown = np.full((self._data.shape[0] * 2, self.capacity), np.nan)
+                grown[:row] = self._data
+                self._data = grown
+        else:
+            self._data.append(array('d', [_NAN]) * self.capacity)
+        self._index[name] = row
+        return row
+
+    def append(self, values, ts=None):
+        """Store one sample in place; non-numeric values are ignored.
+
+        Returns False (and stores nothing) if `ts` is older than the newest
+        stored sample.
+        """
+        ts = time.time() if ts is None else float(ts)
+        with self._lock:
+            if self._count and ts < self._ts[(self._head - 1) % self.capacity]:
+                self.dropped += 1
+                return False
+            i = self._head
+            self._ts[i] = ts
+            if np is not None:
+                self._data[:len(self._index), i] = np.nan
+            else:
+                for col in self._data:
+                    col[i] = _NAN
+            for key, val in values.items():
+                if not isinstance(val, (int, float)) or isinstance(val, bool):
+                    continue
+                row = self._index.get(key)
+                if row is None:
+                    row = self._add_field(key)
+                self._data[row][i] = val
+            self._head = (i + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+        return True
+
+    # --- logical (oldest-first) indexing ---
+    def _phys(self, i):
+        return (self._head - self._count + i) % self.capacity
+
+    def _bisect(self, t):
+        """First logical index with timestamp >= t."""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts[self._phys(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _slice(self, col, lo, hi):
+        """Logical [lo, hi) of a column (a view when it does not wrap)."""
+        if hi <= lo:
+            return np.empty(0) if np is not None else array('d')
+        a = self._phys(lo)
+        b = self._phys(hi - 1) + 1
+        if a < b:
+            return col[a:b]
+        if np is not None:
+            return np.concatenate((col[a:], col[:b]))
+        return col[a:] + col[:b]
+
+    def range(self, start=None, end=None):
+        """Logical index range [lo, hi) covering start <= ts <= end."""
+        lo = 0 if start is None else self._bisect(start)
+        hi = self._count if end is None else self._bisect(math.nextafter(end, math.inf))
+        return lo, max(lo, hi)
+
+    def column(self, name, lo, hi):
+        row = self._index.get(name)
+        if row is None:
+            return None
+        return self._slice(self._data[row], lo, hi)
+
+    def timestamps(self, lo, hi):
+        return self._slice(self._ts, lo, hi)
+
+
+class TelemetryHistory:
+    """One TelemetryWindow of `capacity` samples per source.
+
+    Metrics are named plainly ('panel_voltage') or qualified by source
+    ('modbus.battery_soc'); a plain name resolves to the first source in
+    `sources` order (then creation order) that has it.
+    """
+
+    def __init__(self, capacity=CAPACITY, sources=()):
+        self.capacity = capacity
+        self.order = list(sources)
+        self.windows = {}   # allocated on a source's first sample
+        self._lock = threading.Lock()
+
+    def window(self, source):
+        win = self.windows.get(source)
+        if win is None:
+            with self._lock:
+                win = self.windows.get(source)
+                if win is None:
+                    win = self.windows[source] = TelemetryWindow(self.capacity)
+                    if source not in self.order:
+                        self.order.append(source)
+        return win
+
+    def append(self, source, values, ts=None):
+        return self.window(source).append(values, ts)
+
+    def fields(self):
+        return sorted({'%s.%s' % (src, f) for src, win in self.windows.items() for f in win.fields()})
+
+    def resolve(self, metric):
+        """(window, field) holding `metric`, or (None, metric)."""
+        source, _, field = metric.partition('.')
+        if field and source in self.windows:
+            return self.windows[source], field
+        for source in list(self.order):
+            win = self.windows.get(source)
+            if win is not None and metric in win._index:
+                return win, metric
+        return None, metric
+
+
+# --------------------- bucketing ---------------------
+def _bucket_starts(ts, origin, step):
+    """Bucket start times and the index where each bucket begins in `ts`."""
+    if np is not None:
+        ids = np.floor((ts - origin) / step)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1)) if len(ts) else np.empty(0, int)
+        return origin + ids[starts] * step, starts
+    times, starts = [], []
+    i, n = 0, len(ts)
+    while i < n:
+        b = origin + math.floor((ts[i] - origin) / step) * step
+        times.append(b)
+        starts.append(i)
+        i = bisect.bisect_left(ts, b + step, i)
+    return times, starts
+
+def _bucket_slices(starts, n):
+    ends = list(starts[1:]) + [n]
+    return zip(starts, ends)
+
+
+# --------------------- NumPy aggregation ---------------------
+def _np_aggregate(ts, vals, agg, starts, opts):
+    valid = ~np.isnan(vals)
+    if agg in ('avg', 'sum', 'count'):
+        sums = np.add.reduceat(np.where(valid, vals, 0.0), starts)
+        counts = np.add.reduceat(valid.astype(np.float64), starts)
+        if agg == 'count':
+            return counts
+        if agg == 'sum':
+            return np.where(counts > 0, sums, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+    if agg == 'min':
+        return np.fmin.reduceat(vals, starts)
+    if agg == 'max':
+        return np.fmax.reduceat(vals, starts)
+    if agg == 'last':
+        idx = np.where(valid, np.arange(len(vals)), -1)
+        last = np.maximum.reduceat(idx, starts)
+        return np.where(last >= 0, vals[np.maximum(last, 0)], np.nan)
+    if agg == 'wh':
+        # segments join this metric's own consecutive samples, so rows that
+        # only carry other fields (NaN here) do not break the integral
+        idx = np.flatnonzero(valid)
+        if len(idx) < 2:
+            return np.zeros(len(starts))
+        t, v = ts[idx], vals[idx]
+        dt = np.diff(t)
+        seg = np.where(dt > opts['max_gap'], 0.0, (v[1:] + v[:-1]) * 0.5 * dt / 3600.0)
+        # a segment belongs to the bucket of its left point
+        bucket = np.searchsorted(starts, idx[:-1], side='right') - 1
+        return np.bincount(bucket, weights=seg, minlength=len(starts))
+    if agg.startswith('p'):
+        q = float(agg[1:])
+        out = np.full(len(starts), np.nan)
+        for k, (i, j) in enumerate(_bucket_slices(starts, len(vals))):
+            chunk = vals[i:j]
+            chunk = chunk[~np.isnan(chunk)]
+            if len(chunk):
+                out[k] = np.percentile(chunk, q)
+        return out
+    raise ValueError('unsupported agg %r' % agg)
+
+def _np_moving_avg(ts, vals, window):
+    valid = ~np.isnan(vals)
+    csum = np.concatenate(([0.0], np.cumsum(np.where(valid, vals, 0.0))))
+    ccnt = np.concatenate(([0], np.cumsum(valid)))
+    left = np.searchsorted(ts, ts - window, side='left')
+    right = np.arange(1, len(ts) + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = (csum[right] - csum[left]) / (ccnt[right] - ccnt[left])
+    return ts[valid], avg[valid]
+
+
+# --------------------- pure-Python aggregation ---------------------
+def _py_wh(ts, vals, starts, opts):
+    """Trapezoids between the metric's own consecutive samples, by left point."""
+    starts = list(starts)
+    out = [0.0] * len(starts)
+    prev = None
+    for k, v in enumerate(vals):
+        if v != v:
+            continue
+        if prev is not None:
+            dt = ts[k] - ts[prev]
+            if dt <= opts['max_gap']:
+                out[bisect.bisect_right(starts, prev) - 1] += (vals[prev] + v) * 0.5 * dt / 3600.0
+        prev = k
+    return out
+
+def _py_aggregate(ts, vals, agg, starts, opts):
+    if agg == 'wh':
+        return _py_wh(ts, vals, starts, opts)
+    out = []
+    for i, j in _bucket_slices(starts, len(vals)):
+        chunk = [v for v in vals[i:j] if v == v]
+        if agg == 'count':
+            out.append(float(len(chunk)))
+        elif not chunk:
+            out.append(_NAN)
+        elif agg == 'avg':
+            out.append(sum(chunk) / len(chunk))
+        elif agg == 'sum':
+            out.append(sum(chunk))
+        elif agg == 'min':
+            out.append(min(chunk))
+        elif agg == 'max':
+            out.append(max(chunk))
+        elif agg == 'last':
+            out.append(chunk[-1])
+        elif agg.startswith('p'):
+            chunk.sort()
+            pos = (len(chunk) - 1) * float(agg[1:]) / 100.0
+            lo = int(math.floor(pos))
+            hi = min(lo + 1, len(chunk) - 1)
+            out.append(chunk[lo] + (chunk[hi] - chunk[lo]) * (pos - lo))
+        else:
+            raise ValueError('unsupported agg %r' % agg)
+    return out
+
+def _py_moving_avg(ts, vals, window):
+    t_out, v_out = [], []
+    total, count, left = 0.0, 0, 0
+    for i, (t, v) in enumerate(zip(ts, vals)):
+        if v == v:
+            total += v
+            count += 1
+        while ts[left] < t - window:
+            if vals[left] == vals[left]:
+                total -= vals[left]
+                count -= 1
+            left += 1
+        if v == v:
+            t_out.append(t)
+            v_out.append(total / count)
+    return t_out, v_out
+
+
+def _tolist(values):
+    values = values.tolist() if hasattr(values, 'tolist') else list(values)
+    return [None if v != v else v for v in values]
+
+
+# --------------------- batch queries ---------------------
+def _parse_time(val, now):
+    if val is None or val == '':
+        return None
+    t = float(val)
+    # zero/negative values are relative to now (e.g. -3600 = one hour ago)
+    return now + t if t <= 0 else t
+
+def _parse_query(q, now):
+    if not isinstance(q, dict) or not isinstance(q.get('metric'), str):
+        raise ValueError('each query needs a "metric"')
+    agg = q.get('agg') or 'raw'
+    if (agg not in AGGREGATES or agg == 'pNN') and not _PERCENTILE.match(agg):
+        raise ValueError('agg must be one of %s' % ', '.join(AGGREGATES))
+    step = q.get('step')
+    step = float(step) if step not in (None, '') else None
+    if step is not None and not (0 < step < math.inf):
+        raise ValueError('step must be positive')
+    window = q.get('window')
+    window = float(window) if window not in (None, '') else (step or DEFAULT_WINDOW)
+    if not (0 < window < math.inf):
+        raise ValueError('window must be positive')
+    max_gap = q.get('max_gap')
+    max_gap = float(max_gap) if max_gap not in (None, '') else DEFAULT_MAX_GAP
+    if not (0 <= max_gap < math.inf):
+        raise ValueError('max_gap must not be negative')
+    opts = {'window': window, 'max_gap': max_gap}
+    return q['metric'], _parse_time(q.get('from'), now), _parse_time(q.get('to'), now), agg, step, opts
+
+def run_queries(window, queries, now=None):
+    """Answer a batch of queries against a TelemetryWindow or TelemetryHistory.
+
+    Each query: {"metric": str, "from": ts, "to": ts, "agg": str, "step":
+    seconds, "window": seconds, "max_gap": seconds}. Raises ValueError for
+    malformed input.
+    """
+    now = time.time() if now is None else now
+    if not isinstance(queries, list) or not queries:
+        raise ValueError('queries must be a non-empty list')
+    if len(queries) > MAX_QUERIES:
+        raise ValueError('at most %d queries per request' % MAX_QUERIES)
+    parsed = [_parse_query(q, now) for q in queries]
+    aggregate = _np_aggregate if np is not None else _py_aggregate
+    moving_avg = _np_moving_avg if np is not None else _py_moving_avg
+
+    if hasattr(window, 'resolve'):
+        targets = [window.resolve(p[0]) for p in parsed]
+    else:
+        targets = [(window, p[0]) for p in parsed]
+
+    results = []
+    ranges = {}   # (window, from, to) -> (lo, hi, timestamps)
+    columns = {}  # (window, field, lo, hi) -> values
+    buckets = {}  # (window, lo, hi, step) -> (bucket times, start indices)
+    with contextlib.ExitStack() as locks:
+        # one consistent snapshot per window; a fixed order avoids deadlocks
+        for win in sorted({id(w): w for w, _ in targets if w is not None}.items()):
+            locks.enter_context(win[1]._lock)
+        for (metric, start, end, agg, step, opts), (win, field) in zip(parsed, targets):
+            res = {'metric': metric, 'agg': agg, 'from': start, 'to': end, 't': [], 'v': []}
+            if step is not None:
+                res['step'] = step
+            if win is None:
+                results.append(res)
+                continue
+            key = (id(win), start, end)
+            if key not in ranges:
+                lo, hi = win.range(start, end)
+                ranges[key] = (lo, hi, win.timestamps(lo, hi))
+            lo, hi, ts = ranges[key]
+            ckey = (id(win), field, lo, hi)
+            if ckey not in columns:
+                columns[ckey] = win.column(field, lo, hi)
+            vals = columns[ckey]
+            if vals is not None and len(ts):
+                if agg == 'raw':
+                    if np is not None:
+                        mask = ~np.isnan(vals)
+                        res['t'], res['v'] = ts[mask].tolist(), vals[mask].tolist()
+                    else:
+                        pairs = [(t, v) for t, v in zip(ts, vals) if v == v]
+                        res['t'], res['v'] = [p[0] for p in pairs], [p[1] for p in pairs]
+                elif agg == 'moving_avg':
+                    t_out, v_out = moving_avg(ts, vals, opts['window'])
+                    res['t'], res['v'] = _tolist(t_out), _tolist(v_out)
+                    res['window'] = opts['window']
+                else:
+                    if step is None:
+                        times, starts = [ts[0]], [0]
+                        if np is not None:
+                            starts = np.array(starts)
+                    else:
+                        # bucket edges depend on the origin as well as the samples
+                        origin = start if start is not None else ts[0]
+                        bkey = (id(win), lo, hi, origin, step)
+                        if bkey not in buckets:
+                            buckets[bkey] = _bucket_starts(ts, origin, step)
+                        times, starts = buckets[bkey]
+                    res['t'] = _tolist(times)
+                    res['v'] = _tolist(aggregate(ts, vals, agg, starts, opts))
+            results.append(res)
+    return {'now': now, 'results': results}
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+WebSocket handshake, framing and sample layout in live_feed.py.
+
+    python3 -m unittest test_live_feed
+"""
+import json
+import math
+import socket
+import struct
+import unittest
+
+import live_feed
+
+
+def client_frame(opcode, payload, mask=b'\x01\x02\x03\x04'):
+    """A masked client frame as a browser would send it."""
+    n = len(payload)
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, 0x80 | n)
+    else:
+        head = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, n)
+    body = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+    return head + mask + body
+
+
+def read_frame(sock):
+    """(opcode, payload) of one unmasked server frame from a blocking socket."""
+    def exactly(n):
+        buf = b''
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise EOFError
+            buf += chunk
+        return buf
+    b0, b1 = exactly(2)
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack('!H', exactly(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', exactly(8))[0]
+    return b0 & 0x0F, exactly(n)
+
+
+class FramingTest(unittest.TestCase):
+
+    def test_accept_key_rfc_example(self):
+        self.assertEqual(live_feed.accept_key('dGhlIHNhbXBsZSBub25jZQ=='),
+                         's3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+
+    def test_encode_frame_length_forms(self):
+        self.assertEqual(live_feed.encode_frame(live_feed.OP_TEXT, b'hi'), b'\x81\x02hi')
+        mid = live_feed.encode_frame(live_feed.OP_BINARY, b'x' * 300)
+        self.assertEqual(mid[:4], b'\x82\x7e\x01\x2c')
+        self.assertEqual(len(mid), 4 + 300)
+        big = live_feed.encode_frame(live_feed.OP_BINARY, b'x' * 70000)
+        self.assertEqual(big[:2], b'\x82\x7f')
+        self.assertEqual(struct.unpack('!Q', big[2:10])[0], 70000)
+
+    def test_decode_masked_frame(self):
+        frame = client_frame(live_feed.OP_TEXT, b'{"subscribe": []}')
+        opcode, payload, used = live_feed._decode_frame(bytearray(frame + b'\x81'))
+        self.assertEqual(opcode, live_feed.OP_TEXT)
+        self.assertEqual(payload, b'{"subscribe": []}')
+        self.assertEqual(used, len(frame))
+
+    def test_decode_partial_frame_waits(self):
+        frame = client_frame(live_feed.OP_TEXT, b'x' * 200)
+        for cut in (1, 3, 8, len(frame) - 1):
+            self.assertIsNone(live_feed._decode_frame(bytearray(frame[:cut])))
+
+    def test_decode_rejects_unmasked_and_oversized(self):
+        with self.assertRaises(ValueError):
+            live_feed._decode_frame(bytearray(live_feed.encode_frame(live_feed.OP_TEXT, b'hi')))
+        with self.assertRaises(ValueError):
+            live_feed._decode_frame(bytearray(client_frame(live_feed.OP_TEXT, b'x' * (live_feed.MAX_CLIENT_FRAME + 1))))
+
+    def test_topic_encode_layout(self):
+        topic = live_feed._Topic('mppt', 2, ['panel_voltage', 'load_on', 'missing'])
+        frame = topic.encode({'panel_voltage': 18.5, 'load_on': True}, 1700000000.25)
+        self.assertEqual(frame[:2], bytes([0x80 | live_feed.OP_BINARY, live_feed.HEADER.size + 3 * 4]))
+        ident, seq, ts, volts, load, missing = topic.struct.unpack(frame[2:])
+        self.assertEqual((ident, seq, ts, volts), (2, 1, 1700000000.25, 18.5))
+        self.assertTrue(math.isnan(load))     # bools are not numbers here
+        self.assertTrue(math.isnan(missing))
+        self.assertEqual(topic.struct.unpack(topic.encode({}, 0)[2:])[1], 2)
+
+    def test_seq_wraps(self):
+        topic = live_feed._Topic('system', 1, ['cpu_percent'])
+        topic.seq = 0xFFFF
+        self.assertEqual(topic.struct.unpack(topic.encode({}, 0)[2:])[1], 0)
+
+
+class HubTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = live_feed.LiveHub({'system': ['cpu_percent'], 'mppt': ['panel_voltage', 'battery_voltage']})
+        self.addCleanup(self.stop_hub)
+        self.server, self.client = socket.socketpair()
+        self.addCleanup(self.client.close)
+        self.client.settimeout(5)
+
+    def stop_hub(self):
+        self.hub.close()
+        if self.hub._thread is not None:
+            self.hub._thread.join(5)
+        else:
+            self.server.close()
+
+    def test_schema_then_samples(self):
+        self.assertTrue(self.hub.add(self.server, ('local', 0), ['mppt']))
+        opcode, payload = read_frame(self.client)
+        self.assertEqual(opcode, live_feed.OP_TEXT)
+        schema = json.loads(payload)
+        self.assertEqual(schema['type'], 'schema')
+        self.assertEqual(schema['subscribed'], ['mppt'])
+        self.assertEqual(schema['topics']['mppt'], {'id': 2, 'fields': ['panel_voltage', 'battery_voltage']})
+
+        self.hub.publish('system', {'cpu_percent': 50}, ts=1.0)   # not subscribed
+        self.hub.publish('mppt', {'panel_voltage': 19.0, 'battery_voltage': 12.5}, ts=2.0)
+        opcode, payload = read_frame(self.client)
+        self.assertEqual(opcode, live_feed.OP_BINARY)
+        ident, seq, ts, pv, bv = struct.unpack(schema['header'] + 'ff', payload)
+        self.assertEqual((ident, seq, ts, pv, bv), (2, 1, 2.0, 19.0, 12.5))
+
+    def test_subscribe_message_and_ping(self):
+        self.hub.add(self.server, ('local', 0), ['mppt'])
+        read_frame(self.client)
+        self.client.sendall(client_frame(live_feed.OP_TEXT, json.dumps({'subscribe': ['system']}).encode()))
+        opcode, payload = read_frame(self.client)
+        self.assertEqual(json.loads(payload)['subscribed'], ['system'])
+        self.client.sendall(client_frame(live_feed.OP_PING, b'abc'))
+        self.assertEqual(read_frame(self.client), (live_feed.OP_PONG, b'abc'))
+
+        self.client.sendall(client_frame(live_feed.OP_TEXT, b'{"subscribe": ["nope"]}'))
+        reply = json.loads(read_frame(self.client)[1])
+        self.assertEqual(reply['type'], 'error')
+
+    def test_unmasked_frame_closes_with_1002(self):
+        self.hub.add(self.server, ('local', 0), self.hub.parse_topics(None))
+        read_frame(self.client)
+        self.client.sendall(live_feed.encode_frame(live_feed.OP_TEXT, b'hi'))
+        opcode, payload = read_frame(self.client)
+        self.assertEqual((opcode, payload), (live_feed.OP_CLOSE, struct.pack('!H', 1002)))
+
+    def test_queue_drops_oldest(self):
+        hub = live_feed.LiveHub({'system': ['cpu_percent']}, queue_frames=2)
+        sub = live_feed._Subscriber(None, None, ['system'])
+        hub._subs.append(sub)           # no writer thread: frames stay queued
+        for i in range(5):
+            hub.publish('system', {'cpu_percent': i}, ts=i)
+        self.assertEqual(len(sub.frames), 2)
+        self.assertEqual(sub.dropped, 3)
+        self.assertEqual(hub.stats['dropped'], 3)
+        values = [hub.topics['system'].struct.unpack(f[2:])[3] for f in sub.frames]
+        self.assertEqual(values, [3.0, 4.0])
+
+    def test_full_hub_refuses(self):
+        hub = live_feed.LiveHub({'system': ['cpu_percent']}, max_subscribers=0)
+        self.assertFalse(hub.add(self.server, ('local', 0), ['system']))
+        self.assertTrue(hub.full())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Register cache, request merging and the socket protocol in modbus_gateway.py.
+
+    python3 -m unittest test_modbus_gateway
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import modbus_gateway
+
+
+class FakeBus:
+    """read_block over addr -> addr * 10; counts transactions."""
+
+    def __init__(self, delay=0.0, reject=()):
+        self.calls = []
+        self.delay = delay
+        self.reject = set(reject)
+
+    def read_block(self, start, count):
+        self.calls.append((start, count))
+        time.sleep(self.delay)
+        if any(a in self.reject for a in range(start, start + count)):
+            return None
+        return [a * 10 for a in range(start, start + count)]
+
+
+class RegisterCacheTest(unittest.TestCase):
+
+    def test_hits_within_ttl(self):
+        bus = FakeBus()
+        cache = modbus_gateway.RegisterCache(bus.read_block, default_ttl=60)
+        self.assertEqual(cache.read(100, 2)[0], [1000, 1010])
+        self.assertEqual(cache.read(101, 1)[0], [1010])
+        self.assertEqual(bus.calls, [(100, 2)])
+        self.assertEqual(cache.snapshot_stats()['hits'], 1)
+
+    def test_missing_registers_merge_across_small_gaps(self):
+        self.assertEqual(modbus_gateway.RegisterCache._blocks([1, 2, 5, 40]), [(1, 5), (40, 1)])
+
+    def test_concurrent_misses_share_one_transaction(self):
+        bus = FakeBus(delay=0.2)
+        cache = modbus_gateway.RegisterCache(bus.read_block, default_ttl=60)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.read(10, 3)[0])) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [[100, 110, 120]] * 4)
+        self.assertEqual(bus.calls, [(10, 3)])
+
+    def test_rejected_block_falls_back_to_singles(self):
+        bus = FakeBus(reject=(11,))
+        cache = modbus_gateway.RegisterCache(bus.read_block, default_ttl=60)
+        self.assertEqual(cache.read(10, 1)[0], [100])
+        cache.read(12, 1)
+        # 10 is cached; a merged read of 11-12 fails, then 11 and 12 alone
+        self.assertEqual(cache.read(11, 2), (None, None))
+        self.assertEqual(cache.read(12, 1)[0], [120])
+
+    def test_count_is_bounded(self):
+        cache = modbus_gateway.RegisterCache(FakeBus().read_block)
+        for addr, count in ((0, 0), (0, 126), (0, 100000), (-1, 1), (0xFFFF, 2)):
+            with self.assertRaises(ValueError, msg=(addr, count)):
+                cache.read(addr, count)
+
+
+class SocketTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'gw.sock')
+        self.bus = FakeBus()
+        cache = modbus_gateway.RegisterCache(self.bus.read_block, default_ttl=60)
+        self.server = modbus_gateway.GatewayServer(self.path, cache)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_round_trip_and_errors(self):
+        client = modbus_gateway.GatewayClient(self.path)
+        self.addCleanup(client._close)
+        self.assertTrue(client.available())
+        self.assertEqual(client.read_registers(5, 2), [50, 60])
+        self.assertEqual(client.read_register_scaled(5, 100), 0.5)
+        self.assertIsNone(client.read_registers(0, 500))
+        self.assertEqual(client._call({'op': 'read', 'addr': 0, 'count': 500})['ok'], False)
+        self.assertEqual(client.stats()['bus_reads'], 1)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o660)
+
+    def test_stale_socket_is_not_available(self):
+        self.server.shutdown()
+        self.server.server_close()
+        client = modbus_gateway.GatewayClient(self.path)
+        self.assertFalse(client.available())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Token buckets, in-flight caps and client identification in rate_limit.py.
+
+    python3 -m unittest test_rate_limit
+"""
+import io
+import unittest
+from unittest import mock
+
+import rate_limit
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_page_load_fits_the_default_concurrency(self):
+        limiter = rate_limit.RateLimiter(trusted='')
+        keys = [limiter.client_key('10.0.0.5', {}) for _ in ('/page-weight', '/weather', '/sysinfo')]
+        self.assertEqual([limiter.acquire(k)[0] for k in keys], [True, True, True])
+
+    def test_concurrency_cap_and_release(self):
+        limiter = rate_limit.RateLimiter(rate=100, burst=100, concurrency=1, trusted='')
+        self.assertTrue(limiter.acquire('a')[0])
+        self.assertFalse(limiter.acquire('a')[0])
+        self.assertTrue(limiter.acquire('b')[0])
+        limiter.release('a')
+        self.assertTrue(limiter.acquire('a')[0])
+
+    def test_bucket_refuses_with_retry_after(self):
+        limiter = rate_limit.RateLimiter(rate=1, burst=2, concurrency=0, trusted='')
+        self.assertTrue(limiter.acquire('a')[0])
+        self.assertTrue(limiter.acquire('a')[0])
+        allowed, retry = limiter.acquire('a')
+        self.assertFalse(allowed)
+        self.assertGreater(retry, 0.5)
+
+    def test_forwarded_headers_only_from_trusted_proxies(self):
+        limiter = rate_limit.RateLimiter(trusted='127.0.0.1')
+        headers = {'X-Forwarded-For': '203.0.113.9, 127.0.0.1'}
+        self.assertEqual(limiter.client_key('127.0.0.1', headers), '203.0.113.9')
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as err:
+            self.assertEqual(limiter.client_key('198.51.100.7', headers), '198.51.100.7')
+            limiter.client_key('198.51.100.7', headers)
+        # an untrusted proxy is reported once
+        self.assertEqual(err.getvalue().count('198.51.100.7'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Register map compilation, decoders and block fallback in register_map.py.
+
+    python3 -m unittest test_register_map
+"""
+import unittest
+
+import register_map
+
+
+def device(registers, reject=()):
+    """read_block over a dict of registers; blocks covering `reject` fail."""
+    calls = []
+
+    def read_block(start, count):
+        calls.append((start, count))
+        addrs = range(start, start + count)
+        if any(a in reject or a not in registers for a in addrs):
+            return None
+        return [registers[a] for a in addrs]
+    return read_block, calls
+
+
+class DecodeTest(unittest.TestCase):
+
+    def test_types_scales_and_word_order(self):
+        rmap = register_map.RegisterMap({
+            'v': {'addr': 10, 'type': 'uint16', 'scale': 100, 'round': 2},
+            't': {'addr': 11, 'type': 'int16', 'scale': 10},
+            'e': {'addr': 12, 'type': 'uint32', 'word_order': 'little'},
+            'f': {'addr': 14, 'type': 'float32'},
+        })
+        self.assertEqual(len(rmap.blocks), 1)
+        regs = {10: 1234, 11: 0xFFF6, 12: 0x0002, 13: 0x0001, 14: 0x4049, 15: 0x0FDB}
+        read_block, _ = device(regs)
+        values = rmap.read(read_block)
+        self.assertEqual(values['v'], 12.34)
+        self.assertEqual(values['t'], -1.0)
+        self.assertEqual(values['e'], 0x00010002)
+        self.assertAlmostEqual(values['f'], 3.14159, places=5)
+
+    def test_gap_registers_are_skipped(self):
+        rmap = register_map.RegisterMap({'a': {'addr': 1}, 'b': {'addr': 4}})
+        self.assertEqual([(b.start, b.count) for b in rmap.blocks], [(1, 4)])
+        read_block, _ = device({1: 5, 2: 0, 3: 0, 4: 7})
+        self.assertEqual(rmap.read(read_block), {'a': 5.0, 'b': 7.0})
+
+    def test_overlap_is_an_error(self):
+        with self.assertRaises(ValueError):
+            register_map.RegisterMap({'a': {'addr': 1, 'type': 'uint32'}, 'b': {'addr': 2}})
+
+
+class FallbackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rmap = register_map.RegisterMap({'a': {'addr': 1}, 'b': {'addr': 4}})
+
+    def test_rejected_block_is_split_for_good(self):
+        # the device refuses the unmapped registers 2-3 bridged by the block
+        read_block, calls = device({1: 5, 4: 7}, reject=(2, 3))
+        self.assertEqual(self.rmap.read(read_block), {'a': 5.0, 'b': 7.0})
+        del calls[:]
+        self.assertEqual(self.rmap.read(read_block), {'a': 5.0, 'b': 7.0})
+        self.assertEqual(calls, [(1, 1), (4, 1)])
+
+    def test_dead_bus_keeps_the_block(self):
+        read_block, calls = device({})
+        self.assertEqual(self.rmap.read(read_block), {})
+        self.assertEqual([(b.start, b.count) for b in self.rmap.blocks], [(1, 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
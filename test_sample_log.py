@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Block codec, torn-block recovery and exports in sample_log.py.
+
+    python3 -m unittest test_sample_log
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import sample_log
+
+DAY = 1714521600.0   # 2024-05-01 00:00 UTC
+
+
+def samples(n, start=DAY + 3600, step=5.0):
+    return [(start + i * step, {'battery_voltage': 12.5 + (i % 7) * 0.01,
+                                'panel_power': float(i * 3),
+                                'load_on': True,
+                                'fault': None if i % 3 else 1})
+            for i in range(n)]
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = samples(50)
+        block = sample_log.encode_block(data)
+        magic, t0, t1, length, crc = sample_log._HEADER.unpack_from(block)
+        self.assertEqual(magic, sample_log.MAGIC)
+        self.assertEqual((t0, t1), (int(data[0][0] * 1000), int(data[-1][0] * 1000)))
+        self.assertEqual(length, len(block) - sample_log._HEADER.size)
+        rows = sample_log.decode_block(block[sample_log._HEADER.size:])
+        self.assertEqual(len(rows), 50)
+        for (ts, vals), (ts2, vals2) in zip(data, rows):
+            self.assertEqual(ts, ts2)
+            want = {k: round(v, sample_log.DECIMALS) for k, v in vals.items()
+                    if v is not None and not isinstance(v, bool)}
+            self.assertEqual(vals2, want)
+
+    def test_negative_and_irregular_values(self):
+        data = [(DAY + 0.001, {'current': -1.5}), (DAY + 7.25, {'current': 0.0}),
+                (DAY + 7.5, {}), (DAY + 1000, {'current': 123456.789})]
+        rows = sample_log.decode_block(sample_log.encode_block(data)[sample_log._HEADER.size:])
+        self.assertEqual(rows, [(DAY + 0.001, {'current': -1.5}), (DAY + 7.25, {'current': 0.0}),
+                                (DAY + 7.5, {}), (DAY + 1000, {'current': 123456.789})])
+
+    def test_varints(self):
+        out = bytearray()
+        for n in (0, -1, 1, 63, -64, 300, -2 ** 40):
+            sample_log._put_svarint(out, n)
+        pos, got = 0, []
+        for _ in range(7):
+            n, pos = sample_log._get_svarint(out, pos)
+            got.append(n)
+        self.assertEqual(got, [0, -1, 1, 63, -64, 300, -2 ** 40])
+        self.assertEqual(pos, len(out))
+
+
+class SegmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, 'mppt-20240501.seg')
+
+    def write(self, *blocks):
+        with open(self.path, 'ab') as f:
+            for b in blocks:
+                f.write(b)
+
+    def timestamps(self, start_ms=None, end_ms=None):
+        return [ts for rows in sample_log.iter_blocks(self.path, start_ms, end_ms) for ts, _ in rows]
+
+    def test_resync_after_torn_block(self):
+        a = sample_log.encode_block(samples(3, start=DAY))
+        torn = sample_log.encode_block(samples(3, start=DAY + 100))
+        c = sample_log.encode_block(samples(3, start=DAY + 200))
+        self.write(a, torn[:len(torn) // 2], c)
+        self.assertEqual(self.timestamps(), [DAY, DAY + 5, DAY + 10, DAY + 200, DAY + 205, DAY + 210])
+
+    def test_resync_after_corrupt_payload(self):
+        a = bytearray(sample_log.encode_block(samples(3, start=DAY)))
+        a[-1] ^= 0xFF
+        b = sample_log.encode_block(samples(3, start=DAY + 100))
+        self.write(bytes(a), b'junk', b)
+        self.assertEqual(self.timestamps(), [DAY + 100, DAY + 105, DAY + 110])
+
+    def test_range_skips_blocks(self):
+        self.write(*[sample_log.encode_block(samples(3, start=DAY + i * 100)) for i in range(4)])
+        got = self.timestamps(int((DAY + 150) * 1000), int((DAY + 250) * 1000))
+        self.assertEqual(got, [DAY + 200, DAY + 205, DAY + 210])
+
+    def test_repair_truncates_torn_tail(self):
+        a = sample_log.encode_block(samples(3, start=DAY))
+        b = sample_log.encode_block(samples(3, start=DAY + 100))
+        self.write(a, b[:-5])
+        self.assertEqual(sample_log.repair_segment(self.path), len(b) - 5)
+        self.assertEqual(os.path.getsize(self.path), len(a))
+        self.assertEqual(sample_log.repair_segment(self.path), 0)
+        self.assertEqual(sample_log.repair_segment(os.path.join(self.tmp, 'missing.seg')), 0)
+
+    def test_log_repairs_before_appending(self):
+        a = sample_log.encode_block(samples(2, start=DAY))
+        self.write(a, sample_log.encode_block(samples(2, start=DAY + 50))[:20])
+        log = sample_log.SampleLog('mppt', self.tmp, block_samples=2, retention_days=0)
+        log.append({'battery_voltage': 13.0}, ts=DAY + 100)
+        log.append({'battery_voltage': 13.1}, ts=DAY + 105)
+        rows = list(log.iter_rows())
+        self.assertEqual([ts for ts, _ in rows], [DAY, DAY + 5, DAY + 100, DAY + 105])
+        self.assertEqual(rows[-1][1], {'battery_voltage': 13.1})
+
+
+class SampleLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.log = sample_log.SampleLog('mppt', self.tmp, block_samples=4, flush_interval=3600, retention_days=0)
+
+    def test_day_rotation_and_buffered_rows(self):
+        for i in range(6):
+            self.log.append({'v': i}, ts=DAY - 15 + i * 5)   # crosses midnight
+        # the day change flushed the first block; the rest is still buffered
+        self.assertEqual([os.path.basename(p) for p in self.log.segments()], ['mppt-20240430.seg'])
+        self.assertEqual([v['v'] for _, v in self.log.iter_rows()], [0, 1, 2, 3, 4, 5])
+        self.log.flush()
+        self.assertEqual([os.path.basename(p) for p in self.log.segments()],
+                         ['mppt-20240430.seg', 'mppt-20240501.seg'])
+        self.assertEqual([v['v'] for _, v in self.log.iter_rows()], [0, 1, 2, 3, 4, 5])
+        self.assertEqual(list(self.log.iter_rows(start=DAY, end=DAY + 5, fields=['v'])),
+                         [(DAY, {'v': 3.0}), (DAY + 5, {'v': 4.0})])
+        self.assertEqual(sample_log.sources(self.tmp), ['mppt'])
+
+    def test_export_csv_and_ndjson(self):
+        rows = [(DAY, {'a': 1.5}), (DAY + 5, {'a': 2.0, 'b': -1.0})]
+        self.assertEqual(''.join(sample_log.export_lines(rows, 'csv')),
+                         'timestamp,a,b\n%r,1.5,\n%r,2.0,-1.0\n' % (DAY, DAY + 5))
+        self.assertEqual(''.join(sample_log.export_lines(rows, 'csv', fields=['b'])),
+                         'timestamp,b\n%r,\n%r,-1.0\n' % (DAY, DAY + 5))
+        lines = list(sample_log.export_lines(rows, 'ndjson'))
+        self.assertEqual([json.loads(l) for l in lines],
+                         [{'timestamp': DAY, 'a': 1.5}, {'timestamp': DAY + 5, 'a': 2.0, 'b': -1.0}])
+        self.assertEqual(list(sample_log.export_lines([], 'csv')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
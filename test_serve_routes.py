@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Route matching, rate limiting and keep-alive handling in serve_with_info.py.
+
+    python3 -m unittest test_serve_routes
+"""
+import http.client
+import threading
+import time
+import unittest
+from unittest import mock
+
+import rate_limit
+import serve_with_info
+
+
+class RouteTest(unittest.TestCase):
+
+    def test_api_route_is_exact(self):
+        self.assertEqual(serve_with_info._api_route('/sysinfo'), '/sysinfo')
+        self.assertEqual(serve_with_info._api_route('/sysinfo?x=1'), '/sysinfo')
+        self.assertIsNone(serve_with_info._api_route('/sysinfo/x'))
+        self.assertIsNone(serve_with_info._api_route('/sysinfo.json'))
+        self.assertIsNone(serve_with_info._api_route('/exports'))
+
+
+class RateLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        limiter = rate_limit.RateLimiter(rate=0.001, burst=3, concurrency=0)
+        patcher = mock.patch.object(serve_with_info, '_limiter', limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sysinfo = mock.patch.object(serve_with_info.Handler, 'cached_sysinfo',
+                                    staticmethod(lambda: {'ok': True}))
+        sysinfo.start()
+        self.addCleanup(sysinfo.stop)
+        self.httpd = serve_with_info.ThreadingHTTPServer(('127.0.0.1', 0), serve_with_info.Handler)
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+
+    def status(self, path):
+        conn = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=5)
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        finally:
+            conn.close()
+
+    def test_limit_applies_to_query_string_variants(self):
+        codes = [self.status('/sysinfo?n=%d' % i) for i in range(5)]
+        self.assertEqual(codes, [200, 200, 200, 429, 429])
+
+    def test_suffix_does_not_reach_sysinfo(self):
+        # a sub-path is not a route: a plain 404 that never runs get_sysinfo
+        codes = [self.status('/sysinfo/x') for _ in range(5)]
+        self.assertEqual(codes, [404] * 5)
+        self.assertEqual(self.status('/sysinfo'), 200)
+
+
+class KeepAliveTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(serve_with_info, '_limiter', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.httpd = serve_with_info.ThreadingHTTPServer(('127.0.0.1', 0), serve_with_info.Handler)
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+
+    def connect(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+        return conn
+
+    def get(self, conn, path='/index.html'):
+        conn.request('GET', path)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status
+
+    def idle_then_new(self, idle):
+        for _ in range(idle):
+            self.assertEqual(self.get(self.connect()), 200)   # left open, idle
+        time.sleep(0.3)
+        started = time.monotonic()
+        status = self.get(self.connect())
+        return status, time.monotonic() - started
+
+    def test_idle_connections_yield_to_queued_ones(self):
+        status, elapsed = self.idle_then_new(self.httpd._max_workers)
+        self.assertEqual(status, 200)
+        self.assertLess(elapsed, 1.0)
+
+    def test_power_cap_counts_busy_connections_only(self):
+        profile = dict(serve_with_info._power.profile, max_connections=4)
+        with mock.patch.object(type(serve_with_info._power), 'profile', profile):
+            status, elapsed = self.idle_then_new(4)
+            self.assertEqual(status, 200)
+            self.assertLess(elapsed, 1.0)
+            time.sleep(0.3)
+            # the idle keep-alives were closed down to the cap
+            self.assertLessEqual(self.httpd._active, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Static snapshot files and cadence in snapshot_publisher.py.
+
+    python3 -m unittest test_snapshot_publisher
+"""
+import gzip
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+import snapshot_publisher
+
+
+class SnapshotPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.renders = 0
+        self.value = 1
+
+    def render(self):
+        self.renders += 1
+        return {'value': self.value, 'timestamp': time.time()}
+
+    def publisher(self, **kw):
+        return snapshot_publisher.SnapshotPublisher(self.tmp, render=self.render, **kw)
+
+    def test_writes_plain_and_gzip(self):
+        pub = self.publisher()
+        self.assertTrue(pub.publish_once())
+        with open(pub.path, 'rb') as f:
+            plain = f.read()
+        with open(pub.path + '.gz', 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), plain)
+        self.assertEqual(json.loads(plain)['value'], 1)
+        self.assertEqual(stat.S_IMODE(os.stat(pub.path).st_mode), 0o644)
+
+    def test_unchanged_data_waits_for_heartbeat(self):
+        pub = self.publisher(heartbeat=60)
+        self.assertTrue(pub.publish_once())
+        self.assertFalse(pub.publish_once())   # only the timestamp moved
+        self.value = 2
+        self.assertTrue(pub.publish_once())
+        self.assertEqual(pub.stats, {'published': 2, 'unchanged': 1, 'errors': 0})
+
+    def test_scale_stretches_interval(self):
+        factor = [1]
+        pub = self.publisher(interval=2, scale=lambda: factor[0])
+        self.assertEqual(pub.current_interval(), 2)
+        factor[0] = 15
+        self.assertEqual(pub.current_interval(), 30)
+        factor[0] = None                     # a broken scale keeps the base cadence
+        self.assertEqual(pub.current_interval(), 2)
+
+    def test_start_and_stop(self):
+        pub = self.publisher(interval=0.5, scale=lambda: 100).start()
+        deadline = time.time() + 5
+        while not self.renders:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        pub.stop()
+        self.assertFalse(pub._thread.is_alive())
+        self.assertEqual(self.renders, 1)
+
+    def test_disabled_without_directory(self):
+        pub = snapshot_publisher.SnapshotPublisher('', render=self.render).start()
+        self.assertFalse(pub.enabled())
+        self.assertIsNone(pub._thread)
+        pub.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Snapshot writer and atomic writes in state_store.py.
+
+    python3 -m unittest test_state_store
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import state_store
+
+
+class OutputWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'mppt_data.json')
+
+    def read(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def test_coalesced_update_is_written_when_interval_is_up(self):
+        out = state_store.OutputWriter(self.path, min_interval=0.3, heartbeat=30)
+        self.assertTrue(out.update({'v': 1}))
+        self.assertFalse(out.update({'v': 2}))
+        self.assertFalse(out.update({'v': 3}))
+        self.assertEqual(self.read(), {'v': 1})
+        time.sleep(0.5)
+        # no further update() or flush(): the timer wrote the newest one
+        self.assertEqual(self.read(), {'v': 3})
+        self.assertEqual(out.stats['coalesced'], 1)
+
+    def test_unchanged_values_are_skipped(self):
+        out = state_store.OutputWriter(self.path, min_interval=0, heartbeat=30)
+        self.assertTrue(out.update({'v': 1, 'timestamp': 1}))
+        self.assertFalse(out.update({'v': 1, 'timestamp': 2}))
+        self.assertEqual(out.stats['unchanged'], 1)
+
+    def test_flush_writes_pending(self):
+        out = state_store.OutputWriter(self.path, min_interval=60, heartbeat=30)
+        out.update({'v': 1})
+        out.update({'v': 2})
+        out.flush()
+        self.assertEqual(self.read(), {'v': 2})
+
+
+class WriteAtomicTest(unittest.TestCase):
+
+    def test_mode_and_no_leftovers(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'f.json')
+        old = os.umask(0o077)
+        try:
+            state_store.write_atomic(path, b'{}', fsync=True, mode=0o644)
+        finally:
+            os.umask(old)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+        self.assertEqual(os.listdir(directory), ['f.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
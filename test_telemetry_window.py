@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Batch history queries in telemetry_window.py.
+
+    python3 -m unittest test_telemetry_window
+"""
+import unittest
+
+import telemetry_window
+
+
+def history(rows):
+    h = telemetry_window.TelemetryHistory(sources=('s',))
+    for ts, values in rows:
+        h.append('s', values, ts)
+    return h
+
+
+class BucketTest(unittest.TestCase):
+
+    def test_queries_with_different_origins_do_not_share_buckets(self):
+        h = history((t, {'x': 1.0 if t in (100, 110) else 2.0}) for t in range(100, 111))
+        out = telemetry_window.run_queries(h, [
+            {'metric': 'x', 'from': 99.5, 'to': 111, 'agg': 'avg', 'step': 2},
+            {'metric': 'x', 'from': 99, 'to': 111, 'agg': 'avg', 'step': 2},
+        ], now=200)['results']
+        self.assertEqual(out[0]['t'], [99.5, 101.5, 103.5, 105.5, 107.5, 109.5])
+        self.assertEqual(out[1]['t'], [99.0, 101.0, 103.0, 105.0, 107.0, 109.0])
+        self.assertEqual(out[1]['v'], [1.0, 2.0, 2.0, 2.0, 2.0, 1.5])
+
+
+class ValidationTest(unittest.TestCase):
+
+    def run_one(self, **query):
+        h = history((t, {'x': float(t)}) for t in range(100, 110))
+        return telemetry_window.run_queries(h, [dict(metric='x', **query)], now=200)
+
+    def test_bad_window_and_max_gap_are_rejected(self):
+        for query in ({'agg': 'moving_avg', 'window': -5}, {'agg': 'moving_avg', 'window': 0},
+                      {'agg': 'moving_avg', 'window': 'nan'}, {'agg': 'wh', 'max_gap': -1},
+                      {'agg': 'wh', 'max_gap': 'nan'}, {'agg': 'avg', 'step': 'nan'}):
+            with self.assertRaises(ValueError, msg=query):
+                self.run_one(**query)
+
+    def test_zero_max_gap_is_allowed(self):
+        self.run_one(agg='wh', max_gap=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+weather_cache.py against a local stub upstream.
+
+    python3 -m unittest test_weather_cache
+"""
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+
+import weather_cache
+
+
+class StubUpstream(http.server.ThreadingHTTPServer):
+    """Answers /weather with the query echoed back; counts requests."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.requests = []
+        self.status = 200
+        self.delay = 0.0
+        self.body = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/weather' % self.server_address[1]
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delay)
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        body = self.server.body
+        if body is None:
+            body = json.dumps({'query': query, 'n': len(self.server.requests)}).encode('utf-8')
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+QUERY = {'lat': ['38.7223'], 'lon': ['-9.1393'], 'date': ['2024-05-01'], 'junk': ['x']}
+
+
+class WeatherCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubUpstream()
+        threading.Thread(target=self.stub.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, 'weather.json')
+
+    def cache(self, **kw):
+        kw.setdefault('ttl', 60)
+        kw.setdefault('stale', 600)
+        kw.setdefault('timeout', 5)
+        return weather_cache.WeatherCache(upstream=self.stub.url, path=self.path, **kw)
+
+    def backdate(self, cache, seconds):
+        for key, (fetched_at, body) in list(cache._entries.items()):
+            cache._entries[key] = (fetched_at - seconds, body)
+
+    def test_normalize(self):
+        key, params = weather_cache.normalize(QUERY)
+        self.assertEqual(params, {'lat': '38.722', 'lon': '-9.139', 'date': '2024-05-01'})
+        self.assertEqual(key, weather_cache.normalize({'lon': '-9.13901', 'lat': '38.72199', 'date': '2024-05-01'})[0])
+        with self.assertRaises(ValueError):
+            weather_cache.normalize({'lat': '1'})
+        with self.assertRaises(ValueError):
+            weather_cache.normalize({'lat': 'north', 'lon': '1'})
+
+    def test_miss_then_hit(self):
+        cache = self.cache()
+        body, state, age = cache.get(QUERY)
+        self.assertEqual(state, 'miss')
+        self.assertEqual(json.loads(body)['query'], {'lat': '38.722', 'lon': '-9.139', 'date': '2024-05-01'})
+        body2, state, _ = cache.get({'lat': '38.72231', 'lon': '-9.13928', 'date': '2024-05-01'})
+        self.assertEqual((body2, state), (body, 'hit'))
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        self.stub.delay = 0.2
+        cache = self.cache()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(QUERY))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(len({body for body, _, _ in results}), 1)
+        self.assertEqual({state for _, state, _ in results}, {'miss'})
+
+    def test_stale_while_revalidate(self):
+        cache = self.cache()
+        first, _, _ = cache.get(QUERY)
+        self.backdate(cache, 120)
+        body, state, age = cache.get(QUERY)
+        self.assertEqual((body, state), (first, 'stale'))
+        self.assertGreaterEqual(age, 120)
+        deadline = time.time() + 5
+        while len(self.stub.requests) < 2 or cache._flights:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        body, state, _ = cache.get(QUERY)
+        self.assertEqual(state, 'hit')
+        self.assertEqual(json.loads(body)['n'], 2)
+
+    def test_expired_entry_served_when_upstream_fails(self):
+        cache = self.cache()
+        first, _, _ = cache.get(QUERY)
+        self.backdate(cache, 10000)          # past the stale window
+        self.stub.status = 500
+        body, state, age = cache.get(QUERY)
+        self.assertEqual((body, state), (first, 'stale'))
+        self.assertEqual(cache.stats['errors'], 1)
+
+    def test_client_error_passes_status(self):
+        self.stub.status = 404
+        cache = self.cache()
+        with self.assertRaises(weather_cache.UpstreamError) as ctx:
+            cache.get(QUERY)
+        self.assertEqual(ctx.exception.status, 404)
+        self.stub.status = 503
+        with self.assertRaises(weather_cache.UpstreamError) as ctx:
+            cache.get(QUERY)
+        self.assertEqual(ctx.exception.status, 502)
+
+    def test_garbled_answer_not_cached(self):
+        self.stub.body = b'{"truncated'
+        cache = self.cache()
+        with self.assertRaises(weather_cache.UpstreamError):
+            cache.get(QUERY)
+        self.assertEqual(len(cache._entries), 0)
+
+    def test_lru_eviction(self):
+        cache = self.cache(size=2)
+        for lat in ('1', '2', '1', '3'):
+            cache.get({'lat': lat, 'lon': '0'})
+        self.assertEqual([weather_cache.normalize({'lat': k, 'lon': '0'})[0] for k in ('1', '3')],
+                         list(cache._entries))
+
+    def test_persisted_across_restart(self):
+        body, _, _ = self.cache().get(QUERY)
+        self.assertTrue(os.path.exists(self.path))
+        again, state, _ = self.cache().get(QUERY)
+        self.assertEqual((again, state), (body, 'hit'))
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_persisted_cache_ignored_for_other_upstream(self):
+        self.cache().get(QUERY)
+        other = weather_cache.WeatherCache(upstream=self.stub.url + '?v=2', path=self.path, ttl=60, stale=600)
+        self.assertEqual(len(other._entries), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
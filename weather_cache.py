@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Caching proxy for the Bright Sky weather API (served at /weather).
+
+Visitors' browsers used to call api.brightsky.dev directly, each one repeating
+the same lat/lon/date query. The server now forwards the query once and
+answers everyone from a small cache:
+
+- entries are keyed by the normalised query (lat/lon rounded to 3 decimals,
+  ~100 m) and kept for WEATHER_TTL seconds; the least recently used entry is
+  evicted beyond WEATHER_CACHE_SIZE entries
+- single flight: concurrent misses for one key wait for a single upstream
+  request instead of each starting their own
+- stale-while-revalidate: an expired entry younger than WEATHER_STALE seconds
+  is answered immediately while one background fetch refreshes it; the same
+  entry is also served if the upstream is unreachable
+- the cache is persisted to WEATHER_CACHE_FILE after every fetch and loaded
+  on start, so a restart does not refetch everything
+
+WEATHER_UPSTREAM points at another API-compatible server (e.g. a local stub
+for testing):
+
+    cache = WeatherCache()
+    body, state, age = cache.get({'lat': '38.72', 'lon': '-9.14', 'date': '2024-05-01'})
+"""
+import collections
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from env_config import env_float
+from state_store import write_atomic
+
+UPSTREAM = os.environ.get('WEATHER_UPSTREAM', 'https://api.brightsky.dev/weather')
+TTL = env_float('WEATHER_TTL', 1800.0)            # seconds an answer is fresh
+STALE = env_float('WEATHER_STALE', 6 * 3600.0)    # seconds an expired answer may still be served
+CACHE_SIZE = int(env_float('WEATHER_CACHE_SIZE', 32))
+TIMEOUT = env_float('WEATHER_TIMEOUT', 10.0)
+CACHE_FILE = os.environ.get('WEATHER_CACHE_FILE', '/var/tmp/lowimpact-weather.json')
+
+# query parameters forwarded upstream; anything else is ignored
+PARAMS = ('lat', 'lon', 'date', 'last_date', 'tz', 'units')
+
+
+class UpstreamError(Exception):
+    """The upstream failed and no cached answer could stand in (status = HTTP code to return)."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def normalize(query):
+    """Canonical (key, params) for a query dict; raises ValueError if unusable."""
+    params = {}
+    for name in PARAMS:
+        value = query.get(name)
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if value not in (None, ''):
+            params[name] = str(value)
+    try:
+        params['lat'] = '%.3f' % float(params['lat'])
+        params['lon'] = '%.3f' % float(params['lon'])
+    except KeyError:
+        raise ValueError('lat and lon are required')
+    except ValueError:
+        raise ValueError('lat and lon must be numbers')
+    key = urllib.parse.urlencode(sorted(params.items()))
+    return key, params
+
+
+class _Flight:
+    """One upstream request that concurrent callers wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class WeatherCache:
+    """TTL + LRU cache in front of the weather API with single-flight fetches."""
+
+    def __init__(self, upstream=UPSTREAM, ttl=TTL, stale=STALE, size=CACHE_SIZE,
+                 path=CACHE_FILE, timeout=TIMEOUT):
+        self.upstream = upstream
+        self.ttl = ttl
+        self.stale = stale
+        self.size = max(1, size)
+        self.path = path
+        self.timeout = timeout
+        self.stats = {'hit': 0, 'stale': 0, 'miss': 0, 'fetched': 0, 'errors': 0}
+        self._entries = collections.OrderedDict()   # key -> (fetched_at wall time, body bytes)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()   # refreshes of different keys may finish together
+        self.load()
+
+    def get(self, query):
+        """(body, state, age) for a query; state is 'hit', 'stale' or 'miss'.
+
+        Raises ValueError for a bad query and UpstreamError when the upstream
+        failed with nothing cached to fall back on.
+        """
+        key, params = normalize(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = now - entry[0]
+                if age < self.ttl:
+                    self.stats['hit'] += 1
+                    return entry[1], 'hit', age
+                if age < self.ttl + self.stale:
+                    # answer now, refresh in the background (once per key)
+                    self.stats['stale'] += 1
+                    if key not in self._flights:
+                        flight = self._flights[key] = _Flight()
+                        threading.Thread(target=self._fetch, args=(key, params, flight),
+                                         name='weather-refresh', daemon=True).start()
+                    return entry[1], 'stale', age
+            self.stats['miss'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if leader:
+            self._fetch(key, params, flight)
+        else:
+            flight.done.wait(self.timeout + 1.0)
+        if flight.entry is not None:
+            return flight.entry[1], 'miss', 0.0
+        if entry is not None:
+            # upstream down: an answer older than the stale window beats none
+            return entry[1], 'stale', now - entry[0]
+        if isinstance(flight.error, UpstreamError):
+            raise flight.error
+        raise UpstreamError(504, 'weather upstream did not answer')
+
+    def _fetch(self, key, params, flight):
+        try:
+            url = self.upstream + ('&' if '?' in self.upstream else '?') + urllib.parse.urlencode(params)
+            req = urllib.request.Request(url, headers={'Accept': 'application/json'})
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = resp.read()
+            json.loads(body.decode('utf-8'))   # never cache a truncated/garbled answer
+            entry = (time.time(), body)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+                self.stats['fetched'] += 1
+            flight.entry = entry
+            self.save()
+        except urllib.error.HTTPError as e:
+            # 4xx: the query itself is wrong, pass the status through
+            flight.error = UpstreamError(e.code if 400 <= e.code < 500 else 502,
+                                         'weather upstream returned %d' % e.code)
+            self.stats['errors'] += 1
+        except Exception as e:
+            flight.error = UpstreamError(502, 'weather upstream failed: %s' % e)
+            self.stats['errors'] += 1
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    # --- persistence ---
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            if saved.get('upstream') != self.upstream:
+                return
+            horizon = time.time() - self.ttl - self.stale
+            for key, fetched_at, body in saved.get('entries', [])[-self.size:]:
+                if fetched_at > horizon:
+                    self._entries[key] = (fetched_at, body.encode('utf-8'))
+        except Exception:
+            pass
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[key, fetched_at, body.decode('utf-8')]
+                       for key, (fetched_at, body) in self._entries.items()]
+        try:
+            body = json.dumps({'upstream': self.upstream, 'entries': entries}).encode('utf-8')
+            with self._save_lock:
+                write_atomic(self.path, body)
+        except Exception as e:
+            print(f"Could not write weather cache {self.path}: {e}")